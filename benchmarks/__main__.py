@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Runs the CTS benchmarks.
+
+The database is populated with the synthetic data and every scenario is
+run against the Flask test client. The results can be saved and compared
+with the results of previous run, for example of the last release:
+
+    CTS_DEVELOPER_ENV=1 python -m benchmarks -o baseline.json
+    CTS_DEVELOPER_ENV=1 python -m benchmarks -b baseline.json
+
+The command fails if some scenario regressed more than allowed.
+"""
+
+import sys
+
+import click
+
+from cts import app, db
+from cts.models import Compose
+
+from benchmarks.generator import populate
+from benchmarks.runner import (
+    compare_results,
+    format_results,
+    load_results,
+    run_scenario,
+    save_results,
+)
+from benchmarks.scenarios import SCENARIOS
+
+
+@click.command()
+@click.option(
+    "-c", "--composes", type=int, default=1000, help="Number of generated composes"
+)
+@click.option("-t", "--tags", type=int, default=20, help="Number of generated tags")
+@click.option(
+    "-r", "--requests", type=int, default=100, help="Number of requests per scenario"
+)
+@click.option("-w", "--warmup", type=int, default=5, help="Number of warmup requests")
+@click.option("--seed", type=int, default=0, help="Seed of the random generator")
+@click.option(
+    "-s",
+    "--scenario",
+    "scenarios",
+    multiple=True,
+    type=click.Choice([s.__name__ for s in SCENARIOS]),
+    help="Scenario to run, all by default. Can be used multiple times.",
+)
+@click.option(
+    "-d",
+    "--database-url",
+    default="sqlite://",
+    help="Empty database to populate, in-memory SQLite by default",
+)
+@click.option("-o", "--output", help="Save the results as JSON to this file")
+@click.option("-b", "--baseline", help="Compare the results with this JSON file")
+@click.option(
+    "-m",
+    "--max-regression",
+    type=float,
+    default=0.25,
+    help="Allowed relative regression of latency and SQL statements",
+)
+def main(
+    composes,
+    tags,
+    requests,
+    warmup,
+    seed,
+    scenarios,
+    database_url,
+    output,
+    baseline,
+    max_regression,
+):
+    """Run the CTS benchmarks"""
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    scenarios = [s for s in SCENARIOS if not scenarios or s.__name__ in scenarios]
+
+    with app.app_context():
+        db.create_all()
+        if db.session.query(Compose.id).first():
+            raise click.UsageError("The database %s is not empty." % database_url)
+        dataset = populate(db.session, composes=composes, tags=tags, seed=seed)
+        db.session.remove()
+
+        client = app.test_client()
+        results = []
+        for scenario in scenarios:
+            results.append(
+                run_scenario(
+                    client,
+                    scenario,
+                    dataset,
+                    requests=requests,
+                    warmup=warmup,
+                    seed=seed,
+                )
+            )
+            click.echo("Finished %s" % scenario.__name__, err=True)
+
+    click.echo(format_results(results))
+    if output:
+        save_results(output, results, composes=composes, tags=tags, seed=seed)
+    if baseline:
+        regressions = compare_results(results, load_results(baseline), max_regression)
+        for regression in regressions:
+            click.echo("Regression: %s" % regression, err=True)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
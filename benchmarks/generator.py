@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Generator of the synthetic CTS data used by the benchmarks"""
+
+import random
+from datetime import datetime, timedelta
+
+from productmd import ComposeInfo
+
+from cts.models import (
+    Compose,
+    ComposeChange,
+    Tag,
+    TagChange,
+    User,
+    composes_to_composes,
+    tags_to_composes,
+)
+
+# (release short, release version, release name, weight)
+RELEASES = [
+    ("Fedora", "Rawhide", "Fedora", 40),
+    ("Fedora", "41", "Fedora", 20),
+    ("Fedora", "40", "Fedora", 10),
+    ("Fedora-IoT", "Rawhide", "Fedora IoT", 10),
+    ("RHEL", "10.0", "Red Hat Enterprise Linux", 10),
+    ("RHEL", "9.6", "Red Hat Enterprise Linux", 10),
+]
+# (compose type, weight)
+TYPES = [("nightly", 70), ("production", 20), ("test", 5), ("ci", 5)]
+# The most used tags first, the tags are picked with Zipf-like distribution.
+TAG_NAMES = [
+    "nightly",
+    "nightly-requested",
+    "test-ready",
+    "test-requested",
+    "rc",
+    "rc-requested",
+    "released",
+    "final",
+]
+BUILDER = "odcs"
+
+
+class Dataset(object):
+    """Summary of the generated data used to build the benchmark requests."""
+
+    def __init__(self):
+        self.compose_ids = []
+        self.tags = []
+        self.users = []
+        # (release short, release version, compose type) of each stream.
+        self.streams = []
+        # (compose ID, tag name) pairs of the tagged composes.
+        self.tagged = []
+
+
+def _compose_row(stream, date, respin):
+    short, version, name, compose_type = stream
+    ci = ComposeInfo()
+    ci.release.name = name
+    ci.release.short = short
+    ci.release.version = version
+    ci.release.is_layered = False
+    ci.release.type = "ga"
+    ci.release.internal = False
+    ci.compose.type = compose_type
+    ci.compose.date = date
+    ci.compose.respin = respin
+    release = "%s-%s" % (short, version)
+    return {
+        "id": ci.create_compose_id(),
+        "date": date,
+        "respin": respin,
+        "release_date_respin": "%s-%s.%d" % (release, date, respin),
+        "type": compose_type,
+        "final": False,
+        "release_name": name,
+        "release_version": version,
+        "release_short": short,
+        "release_is_layered": False,
+        "release_type": "ga",
+        "release_internal": False,
+        "builder": BUILDER,
+        "respin_of_id": None,
+    }
+
+
+def _insert(session, table, rows, batch_size):
+    for i in range(0, len(rows), batch_size):
+        session.execute(table.insert(), rows[i : i + batch_size])
+
+
+def populate(session, composes=1000, tags=20, users=10, seed=0, batch_size=1000):
+    """
+    Populates the empty database with `composes` synthetic composes.
+
+    The composes belong to compose streams of few releases and types with
+    weighted distribution. Each stream has about one compose per day, some
+    days have respins. Some of the respins have `respin_of` set and some
+    composes have parent composes. The tags are picked with Zipf-like
+    distribution and each compose has the "created", "tagged" and some
+    also "untagged" changes.
+
+    :param session: SQLAlchemy session.
+    :param int composes: Number of composes.
+    :param int tags: Number of tags.
+    :param int users: Number of users tagging the composes.
+    :param int seed: Seed of the random generator, the same seed generates
+        the same data.
+    :param int batch_size: Number of rows inserted by single statement.
+    :return Dataset: Summary of the generated data.
+    """
+    rng = random.Random(seed)
+    dataset = Dataset()
+
+    builder = User(username=BUILDER)
+    session.add(builder)
+    taggers = [User(username="user-%d" % i) for i in range(users)]
+    session.add_all(taggers)
+    tag_names = TAG_NAMES[:tags] + [
+        "tag-%d" % i for i in range(max(0, tags - len(TAG_NAMES)))
+    ]
+    tag_objects = [
+        Tag(name=name, description=name, documentation="http://localhost/")
+        for name in tag_names
+    ]
+    session.add_all(tag_objects)
+    session.flush()
+    dataset.users = [u.username for u in taggers]
+    dataset.tags = tag_names
+    tag_ids = [t.id for t in tag_objects]
+    tag_weights = [1.0 / (rank + 1) for rank in range(len(tag_ids))]
+
+    start = datetime(2020, 1, 1)
+    session.add_all(
+        [
+            TagChange(time=start, tag_id=t.id, user_id=builder.id, action="created")
+            for t in tag_objects
+        ]
+    )
+
+    compose_rows = []
+    parent_rows = []
+    tag_rows = []
+    change_rows = []
+    # Last day and compose ID of each stream.
+    stream_state = {}
+    # Next respin of each (release short, release version, day), the respins
+    # are shared by all the compose types of the release.
+    next_respin = {}
+    stream_weights = [
+        release[3] * weight for release in RELEASES for _, weight in TYPES
+    ]
+    all_streams = [
+        release[:3] + (compose_type,)
+        for release in RELEASES
+        for compose_type, _ in TYPES
+    ]
+    for _ in range(composes):
+        stream = rng.choices(all_streams, stream_weights)[0]
+        day, last_id = stream_state.get(stream, (0, None))
+        # Most of the streams have single compose per day.
+        same_day = last_id is not None and rng.random() >= 0.75
+        if not same_day:
+            day += 1
+        release_day = (stream[0], stream[1], day)
+        respin = next_respin.get(release_day, 0)
+        next_respin[release_day] = respin + 1
+        date = (start + timedelta(days=day)).strftime("%Y%m%d")
+        row = _compose_row(stream, date, respin)
+        if same_day and rng.random() < 0.5:
+            row["respin_of_id"] = last_id
+        stream_state[stream] = (day, row["id"])
+
+        if compose_rows and rng.random() < 0.05:
+            recent = compose_rows[-50:]
+            for parent in rng.sample(recent, min(rng.randint(1, 2), len(recent))):
+                parent_rows.append(
+                    {"parent_compose_id": parent["id"], "child_compose_id": row["id"]}
+                )
+        compose_rows.append(row)
+
+        created = start + timedelta(days=day, minutes=respin * 30)
+        change_rows.append(
+            {
+                "time": created,
+                "compose_id": row["id"],
+                "user_id": builder.id,
+                "action": "created",
+                "message": None,
+                "tag_id": None,
+            }
+        )
+        n_tags = (
+            0
+            if rng.random() < 0.4
+            else min(len(tag_ids), 1 + int(rng.expovariate(1.5)))
+        )
+        compose_tags = set()
+        while len(compose_tags) < n_tags:
+            compose_tags.add(rng.choices(tag_ids, tag_weights)[0])
+        # Some tags have been added and removed later.
+        removed_tags = set()
+        if rng.random() < 0.3:
+            removed_tags.add(rng.choices(tag_ids, tag_weights)[0])
+        for i, tag_id in enumerate(sorted(compose_tags | removed_tags)):
+            tagger = rng.choice(taggers)
+            tag_name = tag_names[tag_ids.index(tag_id)]
+            tagged = created + timedelta(hours=1 + i)
+            change_rows.append(
+                {
+                    "time": tagged,
+                    "compose_id": row["id"],
+                    "user_id": tagger.id,
+                    "action": "tagged",
+                    "message": 'User "%s" added "%s" tag.'
+                    % (tagger.username, tag_name),
+                    "tag_id": tag_id,
+                }
+            )
+            if tag_id in compose_tags:
+                tag_rows.append({"compose_id": row["id"], "tag_id": tag_id})
+                dataset.tagged.append((row["id"], tag_name))
+            else:
+                change_rows.append(
+                    {
+                        "time": tagged + timedelta(hours=6),
+                        "compose_id": row["id"],
+                        "user_id": tagger.id,
+                        "action": "untagged",
+                        "message": 'User "%s" removed "%s" tag.'
+                        % (tagger.username, tag_name),
+                        "tag_id": tag_id,
+                    }
+                )
+
+    _insert(session, Compose.__table__, compose_rows, batch_size)
+    _insert(session, composes_to_composes, parent_rows, batch_size)
+    _insert(session, tags_to_composes, tag_rows, batch_size)
+    _insert(session, ComposeChange.__table__, change_rows, batch_size)
+    Tag.reconcile_compose_counts(session)
+    session.commit()
+
+    dataset.compose_ids = [row["id"] for row in compose_rows]
+    dataset.streams = sorted(
+        (short, version, compose_type)
+        for short, version, _, compose_type in stream_state
+    )
+    return dataset
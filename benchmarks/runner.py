@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Runner of the benchmark scenarios"""
+
+import json
+import math
+import random
+import time
+
+from sqlalchemy import event
+
+from cts import db
+
+
+def percentile(values, percent):
+    """Returns the `percent` percentile of the sorted `values` (nearest rank)."""
+    if not values:
+        return None
+    rank = max(1, math.ceil(percent / 100.0 * len(values)))
+    return values[rank - 1]
+
+
+class StatementCounter(object):
+    """Counts the SQL statements executed by the `engine`."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+def run_scenario(client, scenario, dataset, requests=100, warmup=5, seed=0):
+    """
+    Runs the `scenario` using the Flask test `client`.
+
+    :param client: Flask test client.
+    :param scenario: Function returning the request, see `benchmarks.scenarios`.
+    :param Dataset dataset: Generated data.
+    :param int requests: Number of measured requests.
+    :param int warmup: Number of requests done before the measured ones.
+    :param int seed: Seed of the random generator used by the scenario.
+    :return dict: Result with the latency percentiles in milliseconds and
+        number of SQL statements per request.
+    """
+    rng = random.Random(seed)
+    latencies = []
+    statements = []
+    errors = 0
+    with StatementCounter(db.engine) as counter:
+        for i in range(warmup + requests):
+            method, url, body = scenario(dataset, rng, i)
+            counter.count = 0
+            start = time.perf_counter()
+            rv = client.open(url, method=method, json=body)
+            rv.get_data()
+            latency = time.perf_counter() - start
+            if i < warmup:
+                continue
+            if rv.status_code >= 400:
+                errors += 1
+            latencies.append(latency * 1000)
+            statements.append(counter.count)
+
+    latencies.sort()
+    return {
+        "scenario": scenario.__name__,
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1] if latencies else None,
+        "statements": sum(statements) / len(statements) if statements else None,
+        "max_statements": max(statements) if statements else None,
+    }
+
+
+def format_results(results):
+    """Returns the `results` as text table."""
+    columns = [
+        ("scenario", "%-20s", "%-20s"),
+        ("requests", "%8s", "%8d"),
+        ("errors", "%6s", "%6d"),
+        ("p50_ms", "%9s", "%9.2f"),
+        ("p90_ms", "%9s", "%9.2f"),
+        ("p99_ms", "%9s", "%9.2f"),
+        ("max_ms", "%9s", "%9.2f"),
+        ("statements", "%10s", "%10.1f"),
+        ("max_statements", "%14s", "%14d"),
+    ]
+    lines = [" ".join(header % name for name, header, _ in columns)]
+    for result in results:
+        lines.append(
+            " ".join(
+                value % result[name] if result[name] is not None else header % "-"
+                for name, header, value in columns
+            )
+        )
+    return "\n".join(lines)
+
+
+def compare_results(results, baseline, max_regression=0.25):
+    """
+    Compares the `results` with the `baseline` results.
+
+    :param list results: Results of `run_scenario`.
+    :param list baseline: Results of previous run.
+    :param float max_regression: Allowed relative increase of the p50 and
+        p90 latency and the mean number of SQL statements.
+    :return list: Descriptions of the regressions.
+    """
+    baseline = {result["scenario"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["scenario"])
+        if not base:
+            continue
+        if result["errors"] > base["errors"]:
+            regressions.append(
+                "%s: errors %d > %d"
+                % (result["scenario"], result["errors"], base["errors"])
+            )
+        for key in ["p50_ms", "p90_ms", "statements"]:
+            if result[key] is None or base[key] is None:
+                continue
+            if result[key] > base[key] * (1 + max_regression):
+                regressions.append(
+                    "%s: %s %.2f > %.2f"
+                    % (result["scenario"], key, result[key], base[key])
+                )
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def save_results(path, results, **info):
+    with open(path, "w") as f:
+        json.dump(dict(info, results=results), f, indent=2)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Benchmark scenarios.
+
+Each scenario is a function returning the (method, URL, JSON body) of the
+`i`-th request of the scenario. The requests are built from the `Dataset`
+returned by `benchmarks.generator.populate`, using the `rng` random
+generator, so they are the same for the same seed.
+"""
+
+import json
+from urllib.parse import urlencode
+
+from productmd import ComposeInfo
+
+from benchmarks.generator import RELEASES
+
+
+def list_default(dataset, rng, i):
+    return "GET", "/api/1/composes/", None
+
+
+def list_release(dataset, rng, i):
+    short, version, _ = rng.choice(dataset.streams)
+    args = {"release_short": short, "release_version": version}
+    return "GET", "/api/1/composes/?" + urlencode(args), None
+
+
+def list_tag(dataset, rng, i):
+    tag = rng.choice(dataset.tags)
+    return "GET", "/api/1/composes/?" + urlencode({"tag": tag}), None
+
+
+def list_latest_tagged(dataset, rng, i):
+    """The latest compose of the release with the tag, the most common query."""
+    short, version, compose_type = rng.choice(dataset.streams)
+    args = [
+        ("release_short", short),
+        ("release_version", version),
+        ("type", compose_type),
+        ("tag", rng.choice(dataset.tags[:3])),
+        ("order_by", "-date"),
+        ("order_by", "-id"),
+        ("per_page", 1),
+    ]
+    return "GET", "/api/1/composes/?" + urlencode(args), None
+
+
+def detail(dataset, rng, i):
+    return "GET", "/api/1/composes/%s" % rng.choice(dataset.compose_ids), None
+
+
+def changes(dataset, rng, i):
+    compose_id = rng.choice(dataset.compose_ids)
+    return "GET", "/api/1/composes/%s/changes/" % compose_id, None
+
+
+def create(dataset, rng, i):
+    short, version, name, _ = RELEASES[0]
+    ci = ComposeInfo()
+    ci.release.name = name
+    ci.release.short = short
+    ci.release.version = version
+    ci.release.is_layered = False
+    ci.release.type = "ga"
+    ci.release.internal = False
+    ci.compose.type = "nightly"
+    ci.compose.date = "29990101"
+    ci.compose.respin = i
+    ci.compose.id = ci.create_compose_id()
+    return "POST", "/api/1/composes/", {"compose_info": json.loads(ci.dumps())}
+
+
+def tag(dataset, rng, i):
+    compose_id = rng.choice(dataset.compose_ids)
+    tag_name = rng.choice(dataset.tags)
+    dataset.tagged.append((compose_id, tag_name))
+    return (
+        "PATCH",
+        "/api/1/composes/%s" % compose_id,
+        {"action": "tag", "tag": tag_name},
+    )
+
+
+def untag(dataset, rng, i):
+    compose_id, tag_name = dataset.tagged.pop(rng.randrange(len(dataset.tagged)))
+    body = {"action": "untag", "tag": tag_name}
+    return "PATCH", "/api/1/composes/%s" % compose_id, body
+
+
+def userinfo(dataset, rng, i):
+    return "GET", "/api/1/userinfo", None
+
+
+def metrics(dataset, rng, i):
+    return "GET", "/api/1/metrics/", None
+
+
+# All the scenarios in the order they are run by default.
+SCENARIOS = [
+    list_default,
+    list_release,
+    list_tag,
+    list_latest_tagged,
+    detail,
+    changes,
+    create,
+    tag,
+    untag,
+    userinfo,
+    metrics,
+]
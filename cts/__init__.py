@@ -26,7 +26,6 @@ from logging import getLogger
 
 from flask import Flask, jsonify
 from flask_login import LoginManager
-from flask_sqlalchemy import SQLAlchemy
 from werkzeug.exceptions import BadRequest, Unauthorized, NotFound as WerkzeugNotFound
 
 from opentelemetry import trace
@@ -40,7 +39,9 @@ from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
 
 from cts.logger import init_logging
 from cts.config import init_config
+from cts.db_pool import init_statement_timeout
 from cts.proxy import ReverseProxy
+from cts.replicas import RoutingSQLAlchemy
 from cts.errors import NotFound, Forbidden
 
 import pkg_resources
@@ -55,7 +56,15 @@ app.wsgi_app = ReverseProxy(app.wsgi_app)
 
 conf = init_config(app)
 
-db = SQLAlchemy(app)
+# The Prometheus multiprocess mode is enabled by the environment variable,
+# which must be set before the prometheus_client is imported.
+if conf.prometheus_multiproc_dir and not (
+    os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    or os.environ.get("prometheus_multiproc_dir")
+):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = conf.prometheus_multiproc_dir
+
+db = RoutingSQLAlchemy(app)
 
 init_logging(conf)
 log = getLogger(__name__)
@@ -69,6 +78,19 @@ from cts.auth import init_auth  # noqa
 
 init_auth(login_manager, conf.auth_backend)
 
+from cts.metrics import init_request_metrics  # noqa
+
+init_request_metrics(app)
+
+from cts.slow_queries import init_slow_query_log  # noqa
+
+init_slow_query_log()
+
+from cts.replicas import init_replicas  # noqa
+
+init_replicas(app)
+init_statement_timeout()
+
 # Set up telemetry exporter if configured.
 provider = TracerProvider(resource=Resource.create({SERVICE_NAME: "cts"}))
 trace.set_tracer_provider(provider)
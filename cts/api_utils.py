@@ -19,11 +19,22 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+
 from flask import request, url_for
-from sqlalchemy import cast, func, ARRAY, Integer
+from flask_sqlalchemy import Pagination
+from sqlalchemy import and_, cast, func, or_, ARRAY, Integer
 from sqlalchemy.orm import selectinload
+from werkzeug.datastructures import MultiDict
 
-from cts.models import Compose, Tag
+from cts import conf, db
+from cts.errors import NotFound
+from cts.models import Compose, ComposeChange, Tag, TagChange, User
+from cts.tag_catalogue import tag_catalogue
 
 
 def pagination_metadata(p_query, request_args):
@@ -90,16 +101,17 @@ def pagination_metadata(p_query, request_args):
     return pagination_data
 
 
-def _order_by(flask_request, query, base_class, allowed_keys, default_keys):
+def _order_by_keys(flask_request, allowed_keys, default_keys):
     """
-    Parses the "order_by" argument from flask_request.args, checks that
-    it is allowed for ordering in `allowed_keys` list and sets the ordering
-    in the `query`.
+    Parses the "order_by" argument from flask_request.args and checks that
+    it is allowed for ordering in `allowed_keys` list.
     In case "order_by" is not set in flask_request.args, use `default_keys`
     instead.
 
     If "order_by" argument starts with minus sign ('-'), the descending order
     is used.
+
+    :return: List of (key, ascending) tuples.
     """
     order_by_list = flask_request.args.getlist("order_by") or default_keys
 
@@ -107,6 +119,7 @@ def _order_by(flask_request, query, base_class, allowed_keys, default_keys):
     if "" in order_by_list:
         order_by_list = default_keys
 
+    keys = []
     for order_by in order_by_list:
         if order_by and len(order_by) > 1 and order_by[0] == "-":
             order_asc = False
@@ -119,7 +132,18 @@ def _order_by(flask_request, query, base_class, allowed_keys, default_keys):
                 "An invalid order_by key was suplied, allowed keys are: "
                 "%r" % allowed_keys
             )
+        keys.append((order_by, order_asc))
+    return keys
+
 
+def _order_by(flask_request, query, base_class, allowed_keys, default_keys):
+    """
+    Sets the ordering requested by the "order_by" argument from
+    flask_request.args in the `query`, see `_order_by_keys`.
+    """
+    for order_by, order_asc in _order_by_keys(
+        flask_request, allowed_keys, default_keys
+    ):
         order_by_attr = getattr(base_class, order_by)
         if order_by == "release_version":
             order_by_attr = cast(
@@ -134,47 +158,48 @@ def _order_by(flask_request, query, base_class, allowed_keys, default_keys):
     return query
 
 
-def filter_composes(flask_request):
+COMPOSE_FILTER_KEYS = [
+    "id",
+    "date",
+    "respin",
+    "type",
+    "label",
+    "final",
+    "release_name",
+    "release_version",
+    "release_short",
+    "release_is_layered",
+    "release_type",
+    "release_internal",
+    "base_product_name",
+    "base_product_short",
+    "base_product_version",
+    "base_product_type",
+    "builder",
+]
+
+
+def query_composes(args, query=None):
     """
-    Returns a flask_sqlalchemy.Pagination object based on the request parameters
-    :param request: Flask request object
-    :return: flask_sqlalchemy.Pagination
+    Returns Compose query filtered based on the `args`.
+
+    The `args` are the same as the query parameters accepted by the
+    "/api/1/composes/" endpoint, ordering and pagination is not handled here.
+
+    :param args: werkzeug.datastructures.MultiDict with the filters.
+    :param query: Query to add the filters to. Compose.query by default.
+    :return: sqlalchemy.orm.Query
     """
     search_query = dict()
 
-    allowed_keys = [
-        "id",
-        "date",
-        "respin",
-        "type",
-        "label",
-        "final",
-        "release_name",
-        "release_version",
-        "release_short",
-        "release_is_layered",
-        "release_type",
-        "release_internal",
-        "base_product_name",
-        "base_product_short",
-        "base_product_version",
-        "base_product_type",
-        "builder",
-    ]
     allowed_suffixes = ["", "_contains", "_startswith", "_endswith"]
-    for key in allowed_keys:
+    for key in COMPOSE_FILTER_KEYS:
         for suffix in allowed_suffixes:
-            if flask_request.args.get(key + suffix, None):
-                search_query[key] = (flask_request.args[key + suffix], suffix)
+            if args.get(key + suffix, None):
+                search_query[key] = (args[key + suffix], suffix)
 
-    query = Compose.query
-    query = query.options(
-        selectinload(Compose.tags),
-        selectinload(Compose.parents),
-        selectinload(Compose.respin_of),
-        selectinload(Compose.children),
-        selectinload(Compose.respun_by),
-    )
+    if query is None:
+        query = Compose.query
     for key, data in search_query.items():
         value, suffix = data
         column = getattr(Compose, key)
@@ -187,14 +212,14 @@ def filter_composes(flask_request):
         else:
             query = query.filter(column == value)
 
-    date_before = flask_request.args.get("date_before")
+    date_before = args.get("date_before")
     if date_before:
         query = query.filter(Compose.date < date_before)
-    date_after = flask_request.args.get("date_after")
+    date_after = args.get("date_after")
     if date_after:
         query = query.filter(Compose.date > date_after)
 
-    tags = flask_request.args.getlist("tag")
+    tags = args.getlist("tag")
     if tags:
         if "" in tags:
             # Get just composes without any Compose.tags.
@@ -206,35 +231,373 @@ def filter_composes(flask_request):
                 else:
                     query = query.filter(Compose.tags.any(Tag.name == tag))
 
-    query = _order_by(flask_request, query, Compose, allowed_keys, ["-date", "-id"])
+    return query
+
+
+def bulk_composes_query(data):
+    """
+    Returns Compose query selecting the composes for bulk action based on the
+    JSON `data`.
+
+    The `data` must contain either "composes" list with compose IDs or
+    "filters" object with the same filters as accepted by the
+    "/api/1/composes/" endpoint.
+
+    :param dict data: JSON data of the bulk action request.
+    :return: sqlalchemy.orm.Query
+    """
+    compose_ids = data.get("composes", None)
+    filters = data.get("filters", None)
+    if (compose_ids is None) == (filters is None):
+        raise ValueError('Exactly one of "composes" or "filters" must be set.')
+
+    if compose_ids is not None:
+        if (
+            not isinstance(compose_ids, list)
+            or not compose_ids
+            or not all(isinstance(id, str) for id in compose_ids)
+        ):
+            raise ValueError('"composes" must be non-empty list of compose IDs.')
+        query = Compose.query.filter(Compose.id.in_(compose_ids))
+        found = {row[0] for row in query.with_entities(Compose.id)}
+        missing = [id for id in compose_ids if id not in found]
+        if missing:
+            raise NotFound("No such compose found: %s." % ", ".join(missing))
+        return query
+
+    if not isinstance(filters, dict) or not filters:
+        raise ValueError('"filters" must be non-empty object.')
+
+    allowed_filters = {"date_before", "date_after", "tag"}
+    for key in COMPOSE_FILTER_KEYS:
+        for suffix in ["", "_contains", "_startswith", "_endswith"]:
+            allowed_filters.add(key + suffix)
+
+    args = MultiDict()
+    for key, value in filters.items():
+        if key not in allowed_filters:
+            raise ValueError("Unknown filter %r." % key)
+        for v in value if isinstance(value, list) else [value]:
+            args.add(key, str(v))
+    return query_composes(args)
+
+
+def filter_composes(flask_request):
+    """
+    Returns a flask_sqlalchemy.Pagination object based on the request parameters
+    :param request: Flask request object
+    :return: flask_sqlalchemy.Pagination
+    """
+    query = Compose.query
+    query = query.options(
+        selectinload(Compose.tags),
+        selectinload(Compose.parents),
+        selectinload(Compose.children),
+        selectinload(Compose.respun_by),
+    )
+    query = query_composes(flask_request.args, query)
+    query = _order_by(
+        flask_request, query, Compose, COMPOSE_FILTER_KEYS, ["-date", "-id"]
+    )
 
     page = flask_request.args.get("page", 1, type=int)
     per_page = flask_request.args.get("per_page", 10, type=int)
     return query.paginate(page=page, per_page=per_page, error_out=False)
 
 
+COMPOSE_FACET_KEYS = [
+    "tag",
+    "date",
+    "type",
+    "label",
+    "final",
+    "release_name",
+    "release_version",
+    "release_short",
+    "release_is_layered",
+    "release_type",
+    "release_internal",
+    "base_product_short",
+    "base_product_version",
+    "builder",
+]
+
+_facets_cache_lock = threading.Lock()
+# Maps the request arguments to (expiration time, facets).
+_facets_cache = {}
+_FACETS_CACHE_SIZE = 256
+
+
+def compose_facets(flask_request):
+    """
+    Returns the number of composes matching the request parameters grouped
+    by each requested facet.
+
+    The results are cached for `conf.compose_facets_cache_ttl` seconds.
+
+    :param flask_request: Flask request object.
+    :return: Dict with the "total" number of composes and the "facets" dict
+        mapping each facet to the list of {"value": ..., "count": ...} dicts.
+    """
+    args = flask_request.args
+    facets = args.getlist("facet") or ["tag", "release_short", "type", "date"]
+    for facet in facets:
+        if facet not in COMPOSE_FACET_KEYS:
+            raise ValueError('Unknown facet "%s".' % facet)
+    interval = args.get("interval", "day")
+    if interval not in ("day", "week", "month"):
+        raise ValueError('"interval" must be one of "day", "week" or "month".')
+
+    ttl = conf.compose_facets_cache_ttl
+    key = tuple(sorted(args.items(multi=True)))
+    now = time.monotonic()
+    if ttl:
+        with _facets_cache_lock:
+            cached = _facets_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    query = query_composes(args)
+    result = {
+        "total": query.with_entities(func.count(Compose.id)).scalar(),
+        "facets": {
+            facet: [
+                {"value": value, "count": count}
+                for value, count in Compose.facet_counts(query, facet, interval)
+            ]
+            for facet in facets
+        },
+    }
+
+    if ttl:
+        with _facets_cache_lock:
+            if len(_facets_cache) >= _FACETS_CACHE_SIZE:
+                for cache_key, (expires, _) in list(_facets_cache.items()):
+                    if expires <= now:
+                        del _facets_cache[cache_key]
+                if len(_facets_cache) >= _FACETS_CACHE_SIZE:
+                    _facets_cache.clear()
+            _facets_cache[key] = (now + ttl, result)
+    return result
+
+
+TAG_FIELDS = [
+    "id",
+    "name",
+    "description",
+    "documentation",
+    "taggers",
+    "untaggers",
+    "tagger_groups",
+    "untagger_groups",
+]
+
+
 def filter_tags(flask_request):
     """
     Returns a flask_sqlalchemy.Pagination object based on the request parameters
+
+    The tags are taken from the `tag_catalogue`, so the items of the returned
+    object are the dicts returned by `Tag.json()` and must not be modified.
+
     :param request: Flask request object
     :return: flask_sqlalchemy.Pagination
     """
-    search_query = dict()
+    tags = [tag.json for tag in tag_catalogue.tags(db.session)]
 
     for key in ["id", "name"]:
-        if flask_request.args.get(key, None):
-            search_query[key] = flask_request.args[key]
+        value = flask_request.args.get(key, None)
+        if value:
+            tags = [t for t in tags if str(t[key]) == value]
 
-    query = Tag.query
+    order_by_keys = _order_by_keys(flask_request, ["id", "name"], ["-id"])
+    # Sort by the least significant key first, the sort is stable.
+    for key, order_asc in reversed(order_by_keys):
+        tags = sorted(tags, key=lambda t: t[key], reverse=not order_asc)
 
-    if search_query:
-        query = query.filter_by(**search_query)
+    page = max(flask_request.args.get("page", 1, type=int), 1)
+    per_page = flask_request.args.get("per_page", 10, type=int)
+    if per_page < 0:
+        per_page = 20
+    items = tags[(page - 1) * per_page : page * per_page]
+    return Pagination(None, page, per_page, len(tags), items)
 
-    query = _order_by(flask_request, query, Tag, ["id", "name"], ["-id"])
 
-    page = flask_request.args.get("page", 1, type=int)
-    per_page = flask_request.args.get("per_page", 10, type=int)
-    return query.paginate(page=page, per_page=per_page, error_out=False)
+def get_tag(id):
+    """
+    Returns the tag with numeric `id` or with name `id` if it is not numeric.
+
+    :param str id: Tag ID or name.
+    :return dict: Tag JSON as returned by `Tag.json()` or None.
+    """
+    if id.isdigit():
+        tag = tag_catalogue.get_by_id(db.session, int(id))
+    else:
+        tag = tag_catalogue.get_by_name(db.session, id)
+    return tag.json if tag else None
+
+
+def tag_fields(flask_request):
+    """
+    Returns the tag fields requested by the "fields" argument of the request.
+    All the fields are returned by default.
+
+    :param flask_request: Flask request object.
+    :return list: Names of the fields.
+    """
+    fields = []
+    for value in flask_request.args.getlist("fields"):
+        fields += [field for field in value.split(",") if field]
+    for field in fields:
+        if field not in TAG_FIELDS:
+            raise ValueError('Unknown field "%s".' % field)
+    return fields or TAG_FIELDS
+
+
+def _parse_datetime(value, name):
+    """
+    Parses the ISO 8601 datetime `value` of request argument `name` as
+    returned in JSON by CTS, for example "2020-05-17T10:00:00Z".
+    """
+    if value.endswith("Z"):
+        value = value[:-1]
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError('Invalid datetime "%s" for "%s".' % (value, name))
+
+
+def filter_changes(flask_request, change_class, query):
+    """
+    Filters the `query` of ComposeChange or TagChange records based on the
+    request parameters and returns single page of them ordered by time.
+
+    The pages are keyset paginated: the "after" request parameter contains
+    the ID of the last change on the previous page.
+
+    :param flask_request: Flask request object.
+    :param change_class: ComposeChange or TagChange.
+    :param query: Query with the changes of single compose or tag.
+    :return: Tuple with the list of changes and the pagination metadata.
+    """
+    args = flask_request.args
+
+    since = args.get("since")
+    if since:
+        query = query.filter(change_class.time >= _parse_datetime(since, "since"))
+    until = args.get("until")
+    if until:
+        query = query.filter(change_class.time < _parse_datetime(until, "until"))
+    actions = args.getlist("action")
+    if actions:
+        query = query.filter(change_class.action.in_(actions))
+    username = args.get("user")
+    if username:
+        query = query.filter(
+            change_class.user_id.in_(
+                User.query.filter_by(username=username).with_entities(User.id)
+            )
+        )
+
+    after = args.get("after", type=int)
+    if after is not None:
+        last = change_class.query.get(after)
+        if not last:
+            raise ValueError('Invalid "after" change ID %d.' % after)
+        query = query.filter(
+            or_(
+                change_class.time > last.time,
+                and_(change_class.time == last.time, change_class.id > last.id),
+            )
+        )
+
+    limit = args.get("limit", 100, type=int)
+    if limit < 1 or limit > 1000:
+        raise ValueError('"limit" must be between 1 and 1000.')
+
+    changes = query.order_by(change_class.time, change_class.id).limit(limit + 1).all()
+    meta = {"limit": limit, "next": None}
+    if len(changes) > limit:
+        changes = changes[:limit]
+        next_args = args.to_dict(flat=False)
+        next_args["after"] = changes[-1].id
+        meta["next"] = url_for(
+            flask_request.endpoint,
+            _external=True,
+            **flask_request.view_args,
+            **next_args
+        )
+    return changes, meta
+
+
+def parse_changes_cursor(cursor):
+    """
+    Parses the changes feed `cursor` in "<compose change ID>-<tag change ID>"
+    format.
+
+    :param str cursor: Cursor as returned by `changes_feed`.
+    :return: Tuple with last ComposeChange ID and last TagChange ID.
+    """
+    try:
+        compose_change_id, tag_change_id = [int(i) for i in cursor.split("-")]
+    except ValueError:
+        raise ValueError('Invalid changes cursor "%s".' % cursor)
+    return compose_change_id, tag_change_id
+
+
+def changes_feed(cursor, limit):
+    """
+    Returns the compose and tag changes done after the `cursor`.
+
+    The ComposeChange and TagChange records are both read in order of their
+    IDs, so the cursor is the pair of IDs of the last returned record of each
+    kind. The IDs are ordered as the commits, see `lock_change_ids`, so no
+    record with lower ID than the cursor can be committed later.
+
+    The records of each kind are returned in order of their IDs. The two
+    kinds are interleaved by the time of the records, but the time does not
+    always grow with the ID, so the result is not strictly ordered by time.
+
+    :param str cursor: Cursor returned by previous call, "0-0" to start from
+        the first change.
+    :param int limit: Maximum number of returned changes.
+    :return: Tuple with the list of changes and the cursor for next call.
+    """
+    compose_change_id, tag_change_id = parse_changes_cursor(cursor)
+
+    compose_changes = (
+        ComposeChange.compact_query(
+            ComposeChange.query.filter(ComposeChange.id > compose_change_id)
+        )
+        .add_columns(ComposeChange.compose_id.label("compose"))
+        .order_by(ComposeChange.id)
+        .limit(limit)
+    )
+    tag_changes = (
+        TagChange.compact_query(TagChange.query.filter(TagChange.id > tag_change_id))
+        .join(Tag, Tag.id == TagChange.tag_id)
+        .add_columns(Tag.name.label("tag"))
+        .order_by(TagChange.id)
+        .limit(limit)
+    )
+
+    merged = heapq.merge(
+        [("compose", row) for row in compose_changes],
+        [("tag", row) for row in tag_changes],
+        key=lambda change: change[1].time,
+    )
+    changes = []
+    for change_type, row in itertools.islice(merged, limit):
+        if change_type == "compose":
+            compose_change_id = row.id
+        else:
+            tag_change_id = row.id
+        change = ComposeChange.compact_json(row)
+        change["type"] = change_type
+        change.setdefault("compose", None)
+        changes.append(change)
+
+    return changes, "%d-%d" % (compose_change_id, tag_change_id)
 
 
 def has_required_group(user_groups, required_groups):
@@ -257,16 +620,15 @@ def is_tagger(user, user_groups, tag):
 
     :param cts.models.User user: User instance.
     :param list user_groups: Groups of the user.
-    :param cts.models.Tag tag: Tag instance.
+    :param cts.tag_catalogue.CachedTag tag: Tag from the tag catalogue.
     :return: True or False.
     :rtype: Boolean.
     """
-    if user in tag.taggers:
+    if user.username in tag.taggers:
         return True
 
     if tag.tagger_groups:
-        tagger_groups = [tg.group for tg in tag.tagger_groups]
-        return has_required_group(user_groups, tagger_groups)
+        return has_required_group(user_groups, tag.tagger_groups)
 
     return False
 
@@ -276,15 +638,14 @@ def is_untagger(user, user_groups, tag):
 
     :param cts.models.User user: User instance.
     :param list user_groups: Groups of the user.
-    :param cts.models.Tag tag: Tag instance.
+    :param cts.tag_catalogue.CachedTag tag: Tag from the tag catalogue.
     :return: True or False.
     :rtype: Boolean.
     """
-    if user in tag.untaggers:
+    if user.username in tag.untaggers:
         return True
 
     if tag.untagger_groups:
-        untagger_groups = [tg.group for tg in tag.untagger_groups]
-        return has_required_group(user_groups, untagger_groups)
+        return has_required_group(user_groups, tag.untagger_groups)
 
     return False
@@ -171,6 +171,141 @@ class Config(object):
             "default": "cts.",
             "desc": "Prefix for AMQP or fedora-messaging messages.",
         },
+        "compose_graph_max_depth": {
+            "type": int,
+            "default": 10,
+            "desc": "Maximum depth of the compose ancestors and descendants graph.",
+        },
+        "changes_feed_batch_size": {
+            "type": int,
+            "default": 100,
+            "desc": "Maximum number of changes returned by the changes feed at once.",
+        },
+        "changes_feed_max_wait": {
+            "type": int,
+            "default": 30,
+            "desc": "Maximum time in seconds the changes feed waits for new changes.",
+        },
+        "changes_feed_poll_interval": {
+            "type": float,
+            "default": 1.0,
+            "desc": "Time in seconds in between checks for new changes in the changes feed.",
+        },
+        "prometheus_multiproc_dir": {
+            "type": str,
+            "default": "",
+            "desc": "Directory shared by all the CTS processes to store the "
+            "Prometheus metrics when CTS runs in multiple processes. It should "
+            "be emptied when the CTS service starts. The PROMETHEUS_MULTIPROC_DIR "
+            "environment variable takes precedence.",
+        },
+        "slow_query_threshold": {
+            "type": float,
+            "default": 1.0,
+            "desc": "SQL statements taking more seconds are logged as slow "
+            "queries, 0 disables the slow queries log.",
+        },
+        "slow_query_log_size": {
+            "type": int,
+            "default": 100,
+            "desc": "Number of the last slow queries kept in memory of each "
+            "CTS process.",
+        },
+        "slow_query_explain": {
+            "type": bool,
+            "default": False,
+            "desc": "Run EXPLAIN for the slow SELECT queries with PostgreSQL. "
+            "It runs in background thread using its own database connection "
+            "and the plan is added to the slow query later.",
+        },
+        "slow_query_explain_analyze": {
+            "type": bool,
+            "default": False,
+            "desc": "Run EXPLAIN (ANALYZE, BUFFERS) instead of EXPLAIN for the "
+            "slow queries. The query is executed again by the background "
+            "thread to get the plan.",
+        },
+        "compose_facets_cache_ttl": {
+            "type": int,
+            "default": 0,
+            "desc": "Number of seconds the compose facets are cached for, "
+            "0 disables the cache.",
+        },
+        "event_stream_retention": {
+            "type": int,
+            "default": 24,
+            "desc": "Number of hours the compose events are kept for the "
+            "event stream. Set to 0 to disable the event stream.",
+        },
+        "event_stream_batch_size": {
+            "type": int,
+            "default": 100,
+            "desc": "Maximum number of events read at once for single event "
+            "stream subscriber.",
+        },
+        "event_stream_poll_interval": {
+            "type": float,
+            "default": 1.0,
+            "desc": "Time in seconds in between checks for new compose events "
+            "stored by other processes, when not using PostgreSQL.",
+        },
+        "event_stream_keepalive": {
+            "type": int,
+            "default": 15,
+            "desc": "Time in seconds after which a keepalive comment is sent "
+            "to idle event stream subscribers.",
+        },
+        "database_pool_size": {
+            "type": int,
+            "default": 5,
+            "desc": "Number of connections kept open in the database "
+            "connection pool of each CTS process.",
+        },
+        "database_max_overflow": {
+            "type": int,
+            "default": 10,
+            "desc": "Number of connections which can be opened over the "
+            "database_pool_size when all the pooled connections are in use.",
+        },
+        "database_pool_timeout": {
+            "type": float,
+            "default": 30.0,
+            "desc": "Number of seconds to wait for a connection from the full "
+            "database connection pool before giving up.",
+        },
+        "database_pool_recycle": {
+            "type": int,
+            "default": -1,
+            "desc": "Number of seconds after which the pooled connections are "
+            "reconnected, -1 to never reconnect.",
+        },
+        "database_pool_pre_ping": {
+            "type": bool,
+            "default": False,
+            "desc": "Test the pooled connections before each use and reconnect "
+            "the broken ones.",
+        },
+        "database_statement_timeout": {
+            "type": float,
+            "default": 0.0,
+            "desc": "Number of seconds after which the SQL statement of an API "
+            "request is canceled, 0 disables the timeout. Supported only with "
+            "PostgreSQL.",
+        },
+        "database_replica_uris": {
+            "type": list,
+            "default": [],
+            "desc": "Database URIs of the read-only replicas of the "
+            "SQLALCHEMY_DATABASE_URI database. The GET requests of the "
+            "compose and tag views are routed to them.",
+        },
+        "database_replica_sticky_window": {
+            "type": int,
+            "default": 10,
+            "desc": "Number of seconds the client reads from the primary "
+            "database after its own write, so it does not miss the write on "
+            "a lagging replica.",
+        },
         "oidc_base_namespace": {
             "type": str,
             "default": "https://pagure.io/cts/",
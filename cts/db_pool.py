@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Connection pool options of the database engines and statement timeout"""
+
+import time
+
+from flask import has_request_context
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool storing the time spent waiting for the connection in the
+    "checkout_wait" item of the connection record info, so it can be read by
+    the "checkout" pool event handlers.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        rec = super(MeteredQueuePool, self)._do_get()
+        rec.info["checkout_wait"] = time.perf_counter() - start
+        return rec
+
+
+def engine_options(conf, uri, options=None):
+    """
+    Returns the keyword arguments of `create_engine` for the database `uri`
+    based on the `conf.database_pool_*` configuration.
+
+    :param conf: CTS configuration.
+    :param uri: Database URI as str or SQLAlchemy URL.
+    :param dict options: Engine options overriding the configuration, like
+        the SQLALCHEMY_ENGINE_OPTIONS.
+    :return dict: Engine options.
+    """
+    result = {
+        "pool_pre_ping": conf.database_pool_pre_ping,
+        "pool_recycle": conf.database_pool_recycle,
+    }
+    # SQLite uses the pools without the connection queue.
+    if make_url(uri).get_backend_name() != "sqlite":
+        result.update(
+            {
+                "poolclass": MeteredQueuePool,
+                "pool_size": conf.database_pool_size,
+                "max_overflow": conf.database_max_overflow,
+                "pool_timeout": conf.database_pool_timeout,
+            }
+        )
+    result.update(options or {})
+    return result
+
+
+def _set_statement_timeout(session, transaction, connection):
+    from cts import conf
+
+    if (
+        conf.database_statement_timeout
+        and has_request_context()
+        and connection.dialect.name == "postgresql"
+    ):
+        # SET LOCAL ends with the transaction, so the connection returned to
+        # the pool is not affected.
+        connection.exec_driver_sql(
+            "SET LOCAL statement_timeout = %d"
+            % (conf.database_statement_timeout * 1000)
+        )
+
+
+def init_statement_timeout():
+    """
+    Sets the SQLAlchemy session event limiting the duration of the SQL
+    statements executed by the API requests to
+    `conf.database_statement_timeout` seconds.
+    """
+    event.listen(SignallingSession, "after_begin", _set_statement_timeout)
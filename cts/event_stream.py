@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Server-Sent Events stream of the compose messages.
+
+The messages sent to the messaging backend are also stored in the
+compose_events table in the transaction of the change they describe, so no
+event is lost when the message cannot be sent. The table is shared by all
+the CTS processes. Each process
+runs single `EventNotifier` thread waking up its event streams when new events
+are stored and each event stream reads the events from the table, so the
+memory used by each subscriber is limited by `conf.event_stream_batch_size`.
+"""
+
+import json
+import select
+import threading
+import time
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, func, text
+
+from cts import app, conf, db
+
+log = getLogger(__name__)
+
+# PostgreSQL notification channel used to announce new events.
+NOTIFY_CHANNEL = "cts_compose_events"
+
+# Number of seconds in between the removals of the old events.
+PRUNE_INTERVAL = 3600
+
+
+def store_messages(session, msgs):
+    """
+    Stores the compose messages for the event stream subscribers.
+
+    The messages are stored in the transaction of the `session`, so they are
+    committed together with the changes they describe. The other CTS
+    processes are notified on the commit.
+
+    :param session: SQLAlchemy session.
+    :param list msgs: Messages as sent to the messaging backend.
+    """
+    from cts.models import ComposeEvent, lock_change_ids
+
+    if not conf.event_stream_retention or not msgs:
+        return
+
+    now = datetime.utcnow()
+    rows = []
+    for msg in msgs:
+        payload = msg["compose"]["compose_info"]["payload"]
+        rows.append(
+            {
+                "time": now,
+                "event": msg["event"],
+                "compose_id": payload["compose"]["id"],
+                "tag": msg.get("tag"),
+                "release_short": payload["release"]["short"],
+                "release_version": payload["release"]["version"],
+                "message": json.dumps(msg),
+            }
+        )
+    # The event stream uses the last event ID as a cursor.
+    lock_change_ids(session)
+    session.execute(ComposeEvent.__table__.insert(), rows)
+    if db.engine.dialect.name == "postgresql":
+        # The notification is delivered on commit.
+        session.execute(text("NOTIFY %s" % NOTIFY_CHANNEL))
+    session.info["compose_events_stored"] = True
+
+
+def _events_committed(session):
+    if session.info.pop("compose_events_stored", False):
+        notifier.notify()
+
+
+def _events_rolled_back(session):
+    if not session.in_nested_transaction():
+        session.info.pop("compose_events_stored", None)
+
+
+class EventNotifier(object):
+    """
+    Wakes up the event streams of this process when new events are stored
+    by this or any other CTS process.
+
+    The events stored by other processes are found by PostgreSQL LISTEN or by
+    checking the last event ID every `conf.event_stream_poll_interval`
+    seconds with other databases. The thread also removes the events older
+    than `conf.event_stream_retention` hours.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._thread = None
+        # Incremented whenever new events might have been stored.
+        self._generation = 0
+
+    def notify(self):
+        """Wakes up all the waiting event streams."""
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+
+    def generation(self):
+        """Returns the value to pass to `wait`."""
+        with self._cond:
+            return self._generation
+
+    def wait(self, generation, timeout):
+        """
+        Waits until new events might have been stored after the `generation`
+        was returned by `generation()` or until `timeout` seconds pass.
+
+        :return bool: False if timeout passed.
+        """
+        self._start()
+        with self._cond:
+            return self._cond.wait_for(lambda: self._generation != generation, timeout)
+
+    def _start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="EventNotifier", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    if db.engine.dialect.name == "postgresql":
+                        self._listen()
+                    else:
+                        self._poll()
+            except Exception:
+                log.exception("Cannot check for new compose events.")
+                time.sleep(conf.event_stream_poll_interval)
+
+    def _listen(self):
+        conn = db.engine.raw_connection()
+        try:
+            conn.set_isolation_level(0)  # autocommit
+            conn.cursor().execute("LISTEN %s" % NOTIFY_CHANNEL)
+            last_prune = time.monotonic()
+            while True:
+                # Prune also when the notifications keep coming.
+                timeout = PRUNE_INTERVAL - (time.monotonic() - last_prune)
+                ready, _, _ = select.select([conn], [], [], max(timeout, 0))
+                if ready:
+                    conn.poll()
+                    del conn.notifies[:]
+                    self.notify()
+                if time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                    self._prune()
+                    last_prune = time.monotonic()
+        finally:
+            conn.close()
+
+    def _poll(self):
+        from cts.models import ComposeEvent
+
+        last_id = None
+        last_prune = time.monotonic()
+        while True:
+            event_id = db.session.query(func.max(ComposeEvent.id)).scalar()
+            db.session.remove()
+            if event_id != last_id:
+                last_id = event_id
+                self.notify()
+            if time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                self._prune()
+                last_prune = time.monotonic()
+            time.sleep(conf.event_stream_poll_interval)
+
+    def _prune(self):
+        from cts.models import ComposeEvent
+
+        older_than = datetime.utcnow() - timedelta(hours=conf.event_stream_retention)
+        ComposeEvent.query.filter(ComposeEvent.time < older_than).delete()
+        db.session.commit()
+        db.session.remove()
+
+
+notifier = EventNotifier()
+
+event.listen(SignallingSession, "after_commit", _events_committed)
+
+event.listen(SignallingSession, "after_rollback", _events_rolled_back)
+
+
+def event_stream(
+    last_event_id=None, tag=None, release_short=None, release_version=None
+):
+    """
+    Generates the Server-Sent Events with the compose messages stored after
+    the event with ID `last_event_id`, or from now if not set.
+
+    :param int last_event_id: ID of the last event received by subscriber.
+    :param str tag: If set, only the events about this tag are generated.
+    :param str release_short: If set, only the events about composes of this
+        release are generated.
+    :param str release_version: If set, only the events about composes of
+        this release version are generated.
+    """
+    from cts.models import ComposeEvent
+
+    cursor = last_event_id
+    if cursor is None:
+        cursor = db.session.query(func.max(ComposeEvent.id)).scalar() or 0
+
+    filters = []
+    if tag:
+        filters.append(ComposeEvent.tag == tag)
+    if release_short:
+        filters.append(ComposeEvent.release_short == release_short)
+    if release_version:
+        filters.append(ComposeEvent.release_version == release_version)
+
+    while True:
+        generation = notifier.generation()
+        # The IDs are ordered as the commits, so no event with lower ID than
+        # the `last_id` can be committed later.
+        last_id = db.session.query(func.max(ComposeEvent.id)).scalar() or 0
+        events = (
+            db.session.query(ComposeEvent.id, ComposeEvent.event, ComposeEvent.message)
+            .filter(ComposeEvent.id > cursor, ComposeEvent.id <= last_id, *filters)
+            .order_by(ComposeEvent.id)
+            .limit(conf.event_stream_batch_size)
+            .all()
+        )
+        # Do not keep the connection while waiting for the subscriber or new
+        # events.
+        db.session.close()
+
+        for event_id, event_name, message in events:
+            yield "id: %d\nevent: %s\ndata: %s\n\n" % (event_id, event_name, message)
+
+        if len(events) == conf.event_stream_batch_size:
+            cursor = events[-1].id
+            continue
+        cursor = max(cursor, last_id)
+        if not notifier.wait(generation, conf.event_stream_keepalive):
+            yield ": keepalive\n\n"
@@ -36,6 +36,27 @@ _cache_lock = Lock()
 _cached_composes = {}
 
 
+def _cache_compose_message(comp, event, extra_args):
+    """Cache the message about `comp` to be sent after the commit"""
+    if comp.id not in _cached_composes:
+        _cached_composes[comp.id] = []
+    msg = {
+        "event": event,
+        "compose": comp.json(),
+    }
+    if flask.g.user:
+        extra_args["agent"] = flask.g.user.username
+    else:
+        extra_args["agent"] = None
+    # Add telemetry information. This includes an extra key
+    # traceparent.
+    TraceContextTextMapPropagator().inject(extra_args)
+
+    msg.update(extra_args)
+    _cached_composes[comp.id].append(msg)
+    return msg
+
+
 def cache_composes_if_state_changed(session, flush_context):
     """Prepare outgoing messages when compose state is changed"""
 
@@ -45,6 +66,7 @@ def cache_composes_if_state_changed(session, flush_context):
         item for item in (session.new | session.dirty) if isinstance(item, Compose)
     )
 
+    stored = session.info.setdefault("compose_event_messages", [])
     with _cache_lock:
         for comp in composes:
             extra_args = {}
@@ -67,32 +89,71 @@ def cache_composes_if_state_changed(session, flush_context):
             else:
                 event = "compose-changed"
 
-            if comp.id not in _cached_composes:
-                _cached_composes[comp.id] = []
-            msg = {
-                "event": event,
-                "compose": comp.json(),
-            }
-            if flask.g.user:
-                extra_args["agent"] = flask.g.user.username
-            else:
-                extra_args["agent"] = None
-            # Add telemetry information. This includes an extra key
-            # traceparent.
-            TraceContextTextMapPropagator().inject(extra_args)
-
-            msg.update(extra_args)
-            _cached_composes[comp.id].append(msg)
+            stored.append(_cache_compose_message(comp, event, extra_args))
 
     log.debug(
         "Cached composes to be sent due to state changed: %s", _cached_composes.keys()
     )
 
 
+def schedule_composes_messages(session, composes, event, **kwargs):
+    """
+    Schedule outgoing messages for composes changed without changing the
+    Compose instances, for example by inserting into tags_to_composes directly.
+
+    The messages are generated by the `cache_scheduled_messages` just before
+    the commit of the `session`, so no other change in the `session` is
+    needed to send them.
+
+    :param session: SQLAlchemy session.
+    :param list composes: List of changed Compose instances.
+    :param str event: Event name, for example "compose-tagged".
+    :param kwargs: Extra fields added to each message.
+    """
+    scheduled = session.info.setdefault("scheduled_compose_messages", [])
+    for comp in composes:
+        scheduled.append((comp, event, dict(kwargs)))
+
+
+def cache_scheduled_messages(session):
+    """Prepare outgoing messages scheduled by `schedule_composes_messages`"""
+    # The before_commit is also emitted when SAVEPOINT is released.
+    if session.in_nested_transaction():
+        return
+
+    scheduled = session.info.pop("scheduled_compose_messages", [])
+    stored = session.info.setdefault("compose_event_messages", [])
+    with _cache_lock:
+        for comp, event, extra_args in scheduled:
+            stored.append(_cache_compose_message(comp, event, extra_args))
+
+
+def store_compose_event_messages(session):
+    """
+    Stores the messages of the `session` for the event stream just before
+    the commit, so they are committed together with the changes.
+    """
+    from cts.event_stream import store_messages
+
+    # The before_commit is also emitted when SAVEPOINT is released.
+    if session.in_nested_transaction():
+        return
+
+    # The messages about the changes flushed on commit are cached by the
+    # `cache_composes_if_state_changed` only after the before_commit.
+    session.flush()
+    store_messages(session, session.info.pop("compose_event_messages", []))
+
+
 def start_to_publish_messages(session):
     """Publish messages after data is committed to database successfully"""
     import cts.messaging as messaging
 
+    # The after_commit is also emitted when SAVEPOINT is released. Wait for
+    # the commit of outermost transaction before publishing the messages.
+    if session.in_nested_transaction():
+        return
+
     with _cache_lock:
         msgs = []
         for compose_msgs in _cached_composes.values():
@@ -19,10 +19,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from datetime import timedelta
+from datetime import datetime, timedelta
 import logging
 import os
 import ssl
+import time
 
 import click
 import flask_migrate
@@ -116,6 +117,29 @@ def runssl(host=conf.host, port=conf.port, debug=conf.debug):
     run_simple(host, port, app, use_debugger=debug, ssl_context=ssl_ctx)
 
 
+def _get_system_user():
+    """Returns the SYSTEM user used by the periodic tasks, creates it if needed"""
+    system_user = models.User.find_user_by_name(username="SYSTEM")
+    if not system_user:
+        system_user = models.User.create_user(username="SYSTEM")
+        logging.info("New SYSTEM User is created in database.")
+        db.session.commit()
+    return system_user
+
+
+@cli.command()
+def reconcile_tag_counts():
+    """Recompute the number of composes tagged with each tag
+
+    The counts are kept up to date by the tagging itself, so this only fixes
+    the counts broken by changing the database directly. Run it periodically,
+    for example daily from cron.
+    """
+    models.Tag.reconcile_compose_counts(db.session)
+    db.session.commit()
+    logging.info("Number of composes tagged with each tag is recomputed")
+
+
 @cli.command()
 @click.option(
     "-t",
@@ -124,37 +148,116 @@ def runssl(host=conf.host, port=conf.port, debug=conf.debug):
     default=6,
     help="Timeout period in hours for retagging the stale composes",
 )
-def check_stale_requests(timeout):
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=100,
+    help="Number of composes retagged in single transaction",
+)
+@click.option(
+    "-n",
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="Only list the stale composes, do not retag them",
+)
+def check_stale_requests(timeout, batch_size, dry_run):
     """Check the stale requests in the database"""
 
     from flask import g
 
+    logging.info(
+        "Checking stale composes with requested tag within {} hours".format(timeout)
+    )
+    older_than = datetime.utcnow() - timedelta(hours=timeout)
+
+    if dry_run:
+        stale = models.Compose.stale_requested_tags(db.session, older_than)
+        tag_names = dict(db.session.query(models.Tag.id, models.Tag.name))
+        count = 0
+        for compose_id, tag_id in stale.yield_per(batch_size):
+            logging.info(
+                "Compose:{} with tag {} is stale".format(compose_id, tag_names[tag_id])
+            )
+            count += 1
+        logging.info("Found {} stale requests".format(count))
+        return
+
+    g.user = _get_system_user()
+
+    count = 0
     try:
-        timeout_h = timedelta(hours=timeout)
-        logging.info(
-            "Checking stale composes with requested tag within {} hours".format(timeout)
-        )
-        # Get the composes with -requested tag
-        query = models.Compose.query.outerjoin(models.Compose.tags, aliased=True)
-        composes = query.filter(models.Tag.name.contains("requested")).all()
-        system_user = models.User.find_user_by_name(username="SYSTEM")
-        if not system_user:
-            system_user = models.User.create_user(username="SYSTEM")
-            logging.info("New SYSTEM User is created in database.")
-            db.session.commit()
-        g.user = system_user
-        for compose in composes:
-            for retag in compose.retag_stale_composes(g.user.username, timeout_h):
+        for compose_id, tag in models.Compose.retag_stale_requested_tags(
+            db.session, g.user.username, older_than, batch_size
+        ):
+            logging.info("Compose:{} is retagged with {}".format(compose_id, tag.name))
+            count += 1
+    except BaseException:
+        logging.error("Error occured while retagging stale composes")
+        db.session.rollback()
+        raise
+    logging.info("Checking for stale requests is done, {} retagged".format(count))
+
+
+@cli.command()
+@click.option(
+    "-t",
+    "--timeout",
+    type=int,
+    default=6,
+    help="Timeout period in hours for retagging the stale composes",
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=100,
+    help="Number of composes retagged in single transaction",
+)
+@click.option(
+    "-i",
+    "--interval",
+    type=int,
+    default=300,
+    help="Maximum time in seconds in between two checks",
+)
+@click.option(
+    "-s",
+    "--state-file",
+    default=None,
+    help="File to persist the schedule of requested tags in between restarts",
+)
+def stale_requests_daemon(timeout, batch_size, interval, state_file):
+    """Check the stale requests in the database continuously"""
+
+    from flask import g
+    from cts.stale_requests import StaleRequestsScheduler
+
+    g.user = _get_system_user()
+    scheduler = StaleRequestsScheduler(
+        db.session, g.user.username, timedelta(hours=timeout), batch_size, state_file
+    )
+    if not scheduler.load():
+        scheduler.rebuild()
+    db.session.remove()
+
+    logging.info("Checking stale requests every {} seconds".format(interval))
+    while True:
+        try:
+            for compose_id, tag in scheduler.sweep():
                 logging.info(
-                    "Checking compose:{} for tag {} is done".format(
-                        compose.id, retag.name
-                    )
+                    "Compose:{} is retagged with {}".format(compose_id, tag.name)
                 )
-        logging.info("Checking for stale requests is done")
-
-    except BaseException as e:
-        logging.error("Error occured while retagging compose:{}".format(compose.id))
-        raise e
+        except Exception:
+            logging.exception("Error occured while retagging stale composes")
+            db.session.rollback()
+            # The failed sweep might have dropped some requests from the
+            # schedule, so start again from scratch.
+            scheduler.rebuild()
+        finally:
+            db.session.remove()
+        time.sleep(scheduler.sleep_time(interval))
 
 
 @cli.command()
@@ -22,28 +22,136 @@
 #
 # Written by Jan Kaluza <jkaluza@redhat.com>
 
+import atexit
+import fcntl
 import os
-import tempfile
+import threading
+import time
+from contextlib import contextmanager
 
 from prometheus_client.core import GaugeMetricFamily
 from prometheus_client import (  # noqa: F401
     ProcessCollector,
     CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
     multiprocess,
 )
+from prometheus_client.mmap_dict import MmapedDict
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from cts import db
+from cts.models import Tag
+
+
+# Directory shared by all the CTS processes when the deployment uses
+# multiple processes, see `conf.prometheus_multiproc_dir`.
+multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get(
+    "prometheus_multiproc_dir"
+)
+
+# Types of the metrics files which are kept when the process exits, so the
+# values do not decrease.
+ARCHIVED_METRIC_TYPES = ["counter", "histogram", "summary"]
+
+
+@contextmanager
+def _archive_lock(path, operation):
+    """
+    Holds the lock of the archive files in the multiprocess directory `path`.
+
+    :param str path: Multiprocess directory.
+    :param int operation: fcntl.LOCK_EX to archive, fcntl.LOCK_SH to read.
+    """
+    with open(os.path.join(path, "archive.lock"), "a") as lock:
+        fcntl.flock(lock, operation)
+        yield
+
+
+def archive_process_metrics(pid, path):
+    """
+    Adds the counters, histograms and summaries of the exited process `pid`
+    to the "<type>_archive.db" files in the multiprocess directory `path`
+    and removes the files of this process, so the number of files does not
+    grow with each started process. Removes also its "live" gauges.
+
+    The new archive is written to temporary file renamed over the old one
+    and the `ArchivedMultiProcessCollector` does not read the files while
+    they are archived, so the values are never counted twice.
+
+    :param int pid: PID of the exited process.
+    :param str path: Multiprocess directory.
+    """
+    multiprocess.mark_process_dead(pid, path)
+    with _archive_lock(path, fcntl.LOCK_EX):
+        for metric_type in ARCHIVED_METRIC_TYPES:
+            process_file = os.path.join(path, "%s_%d.db" % (metric_type, pid))
+            if not os.path.exists(process_file):
+                continue
+            archive_file = os.path.join(path, "%s_archive.db" % metric_type)
+            values = {}
+            for filename in (archive_file, process_file):
+                if not os.path.exists(filename):
+                    continue
+                for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(
+                    filename
+                ):
+                    archived, _ = values.get(key, (0, 0))
+                    values[key] = (archived + value, timestamp)
+
+            # The collector reads only the "*.db" files.
+            tmp_file = archive_file + ".tmp"
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            archive = MmapedDict(tmp_file)
+            try:
+                for key, (value, timestamp) in values.items():
+                    archive.write_value(key, value, timestamp)
+            finally:
+                archive.close()
+            os.rename(tmp_file, archive_file)
+            os.remove(process_file)
+
+
+def archive_current_process_metrics(path):
+    """
+    Archives the metrics of the current process, see `archive_process_metrics`.
+
+    It is registered by `atexit`, so the PID is read when the process exits.
+    The workers forked after the import would use the PID of the master
+    process otherwise.
 
+    :param str path: Multiprocess directory.
+    """
+    archive_process_metrics(os.getpid(), path)
 
-# This environment variable should be set if deployment uses multiple
-# processes.
-if not os.environ.get("prometheus_multiproc_dir"):
-    os.environ.setdefault("prometheus_multiproc_dir", tempfile.mkdtemp())
+
+class ArchivedMultiProcessCollector(multiprocess.MultiProcessCollector):
+    """
+    MultiProcessCollector not reading the metrics files while the metrics of
+    the exited process are archived by `archive_process_metrics`.
+    """
+
+    def collect(self):
+        with _archive_lock(self._path, fcntl.LOCK_SH):
+            return list(super(ArchivedMultiProcessCollector, self).collect())
 
 
 registry = CollectorRegistry()
-ProcessCollector(registry=registry)
-multiprocess.MultiProcessCollector(registry)
+if multiproc_dir:
+    # Each process writes its metrics to the multiproc_dir and they are
+    # collected from there. The process metrics are exported by each process
+    # as the `process_metrics` gauges.
+    ArchivedMultiProcessCollector(registry)
+    _metrics_registry = None
+    atexit.register(archive_current_process_metrics, multiproc_dir)
+else:
+    ProcessCollector(registry=registry)
+    _metrics_registry = registry
 
 
 class ComposesCollector(object):
@@ -57,13 +165,8 @@ class ComposesCollector(object):
             "Number of tagged composes",
             labels=["tag"],
         )
-        rs = db.session.execute(
-            "SELECT COUNT(composes.id), tags.name FROM composes JOIN (tags_to_composes JOIN tags ON tags.id = tags_to_composes.tag_id) ON composes.id = tags_to_composes.compose_id GROUP BY tags.name"
-        ).fetchall()
-        for tag in rs:
-            # First element is the number of occurence of tag
-            # Second element is the tag name
-            counter.add_metric([tag[1]], tag[0])
+        for name, count in Tag.compose_counts(db.session):
+            counter.add_metric([name], count)
         return counter
 
     def collect(self):
@@ -71,3 +174,219 @@ class ComposesCollector(object):
 
 
 registry.register(ComposesCollector())
+
+
+# Metrics of the `manage.py stale_requests_daemon`. The daemon runs in
+# separate process, so these are exported by the frontend only when both share
+# the same prometheus_multiproc_dir.
+stale_requests_sweep_duration = Histogram(
+    "stale_requests_sweep_duration_seconds",
+    "Duration of single stale requests sweep",
+    registry=_metrics_registry,
+)
+stale_requests_retagged = Counter(
+    "stale_requests_retagged",
+    "Number of composes retagged because of stale -requested tag",
+    labelnames=["tag"],
+    registry=_metrics_registry,
+)
+stale_requests_scheduled = Gauge(
+    "stale_requests_scheduled",
+    "Number of -requested tags waiting for the timeout",
+    multiprocess_mode="livesum",
+    registry=_metrics_registry,
+)
+
+
+# Metrics of the API requests, collected by the hooks set by
+# `init_request_metrics`.
+REQUEST_LABELS = ["endpoint", "method"]
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Duration of the API request",
+    labelnames=REQUEST_LABELS,
+    registry=_metrics_registry,
+)
+request_db_statements = Histogram(
+    "http_request_db_statements",
+    "Number of SQL statements executed by the API request",
+    labelnames=REQUEST_LABELS,
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 200, 500),
+    registry=_metrics_registry,
+)
+request_db_duration = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent executing SQL statements by the API request",
+    labelnames=REQUEST_LABELS,
+    registry=_metrics_registry,
+)
+response_size = Histogram(
+    "http_response_size_bytes",
+    "Size of the API response body",
+    labelnames=REQUEST_LABELS,
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+    registry=_metrics_registry,
+)
+request_errors = Counter(
+    "http_request_errors",
+    "Number of API requests which failed",
+    labelnames=REQUEST_LABELS + ["status"],
+    registry=_metrics_registry,
+)
+
+
+# Metrics of the database connection pools, collected by the pool events set
+# by `init_pool_metrics`.
+POOL_LABELS = ["database"]
+db_pool_checked_out = Gauge(
+    "db_pool_checked_out_connections",
+    "Number of connections checked out from the database connection pool",
+    labelnames=POOL_LABELS,
+    multiprocess_mode="livesum",
+    registry=_metrics_registry,
+)
+db_pool_overflow = Gauge(
+    "db_pool_overflow_connections",
+    "Number of connections opened over the database connection pool size",
+    labelnames=POOL_LABELS,
+    multiprocess_mode="livesum",
+    registry=_metrics_registry,
+)
+db_pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the database connection pool",
+    labelnames=POOL_LABELS,
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0),
+    registry=_metrics_registry,
+)
+
+
+def _is_measured_request():
+    return has_request_context() and "metrics_start" in g
+
+
+# Process metrics of each process in the multiprocess mode, updated by
+# `update_process_metrics`. In the single process mode, these are exported
+# by the ProcessCollector.
+process_metrics = {}
+if multiproc_dir:
+    for name, doc in [
+        ("process_virtual_memory_bytes", "Virtual memory size in bytes"),
+        ("process_resident_memory_bytes", "Resident memory size in bytes"),
+        ("process_start_time_seconds", "Start time of the process"),
+        ("process_cpu_seconds", "Total user and system CPU time in seconds"),
+        ("process_open_fds", "Number of open file descriptors"),
+    ]:
+        process_metrics[name] = Gauge(
+            name, doc, multiprocess_mode="liveall", registry=None
+        )
+_process_collector = ProcessCollector(registry=None)
+_process_metrics_updated = 0.0
+# Minimal number of seconds in between updates of the process metrics.
+PROCESS_METRICS_INTERVAL = 15
+
+
+def update_process_metrics():
+    """
+    Updates the `process_metrics` of this process in the multiprocess mode,
+    at most once in PROCESS_METRICS_INTERVAL seconds.
+    """
+    global _process_metrics_updated
+    now = time.monotonic()
+    if not process_metrics or now - _process_metrics_updated < PROCESS_METRICS_INTERVAL:
+        return
+    _process_metrics_updated = now
+    for metric in _process_collector.collect():
+        gauge = process_metrics.get(metric.name)
+        if gauge and metric.samples:
+            gauge.set(metric.samples[0].value)
+
+
+def _before_request():
+    update_process_metrics()
+    g.metrics_start = time.perf_counter()
+    g.metrics_db_statements = 0
+    g.metrics_db_duration = 0.0
+
+
+def _after_request(response):
+    if not _is_measured_request():
+        return response
+    labels = (request.endpoint or "none", request.method)
+    request_duration.labels(*labels).observe(time.perf_counter() - g.metrics_start)
+    request_db_statements.labels(*labels).observe(g.metrics_db_statements)
+    request_db_duration.labels(*labels).observe(g.metrics_db_duration)
+    # The size of streamed responses is not known.
+    size = None if response.is_streamed else response.calculate_content_length()
+    if size is not None:
+        response_size.labels(*labels).observe(size)
+    if response.status_code >= 400:
+        request_errors.labels(*labels, response.status_code).inc()
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _is_measured_request() and context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is not None and _is_measured_request():
+        g.metrics_db_statements += 1
+        g.metrics_db_duration += time.perf_counter() - start
+
+
+def init_request_metrics(app):
+    """
+    Sets the Flask request hooks and SQLAlchemy engine events collecting
+    the metrics of the API requests.
+
+    :param app: Flask application.
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def init_pool_metrics(engine, database):
+    """
+    Sets the SQLAlchemy pool events collecting the metrics of the `engine`
+    connection pool.
+
+    :param engine: SQLAlchemy engine.
+    :param str database: Value of the "database" label of the metrics.
+    """
+    checked_out = 0
+    lock = threading.Lock()
+
+    def update_overflow():
+        # Only the QueuePool can overflow. Its connections over the pool size
+        # are closed when checked in, so they are all checked out.
+        size = getattr(engine.pool, "size", None)
+        if size is not None:
+            db_pool_overflow.labels(database).set(max(checked_out - size(), 0))
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        nonlocal checked_out
+        with lock:
+            checked_out += 1
+            update_overflow()
+        # The engines sharing the label are summed, like the old and the new
+        # engine after the database URI is changed.
+        db_pool_checked_out.labels(database).inc()
+        # Set by the MeteredQueuePool.
+        wait = connection_record.info.pop("checkout_wait", None)
+        if wait is not None:
+            db_pool_checkout_wait.labels(database).observe(wait)
+
+    def on_checkin(dbapi_connection, connection_record):
+        nonlocal checked_out
+        with lock:
+            checked_out -= 1
+            update_overflow()
+        db_pool_checked_out.labels(database).dec()
+
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
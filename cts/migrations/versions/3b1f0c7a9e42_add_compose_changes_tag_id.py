@@ -0,0 +1,50 @@
+"""Add compose_changes.tag_id
+
+Revision ID: 3b1f0c7a9e42
+Revises: f6020a9602bb
+Create Date: 2026-10-19 09:12:40.518203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "3b1f0c7a9e42"
+down_revision = "f6020a9602bb"
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    with op.batch_alter_table("compose_changes", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("tag_id", sa.Integer(), nullable=True))
+        batch_op.create_foreign_key(
+            "compose_changes_tag_id_fkey", "tags", ["tag_id"], ["id"]
+        )
+        batch_op.create_index(
+            "idx_compose_changes_compose_tag",
+            ["compose_id", "tag_id", "action", "time"],
+            unique=False,
+        )
+
+    # Backfill the tag_id from the messages generated by Compose.tag and
+    # Compose.untag, for example 'User "foo" added "nightly" tag.'.
+    op.execute(
+        """
+        UPDATE compose_changes SET tag_id = (
+            SELECT tags.id FROM tags, users
+            WHERE users.id = compose_changes.user_id
+            AND compose_changes.message IN (
+                'User "' || users.username || '" added "' || tags.name || '" tag.',
+                'User "' || users.username || '" removed "' || tags.name || '" tag.'
+            )
+        )
+        WHERE action IN ('tagged', 'untagged')
+        """
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("compose_changes", schema=None) as batch_op:
+        batch_op.drop_index("idx_compose_changes_compose_tag")
+        batch_op.drop_constraint("compose_changes_tag_id_fkey", type_="foreignkey")
+        batch_op.drop_column("tag_id")
@@ -0,0 +1,23 @@
+"""Add index on composes.respin_of_id
+
+Revision ID: 5e0a8c3d71b9
+Revises: a4d2e61f5c87
+Create Date: 2026-10-19 13:40:52.871306
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "5e0a8c3d71b9"
+down_revision = "a4d2e61f5c87"
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index(
+        "idx_composes_respin_of_id", "composes", ["respin_of_id"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("idx_composes_respin_of_id", table_name="composes")
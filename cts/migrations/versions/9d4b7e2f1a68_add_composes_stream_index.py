@@ -0,0 +1,26 @@
+"""Add index on composes stream and date
+
+Revision ID: 9d4b7e2f1a68
+Revises: e37b9a04d5f6
+Create Date: 2026-10-19 16:12:37.402915
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "9d4b7e2f1a68"
+down_revision = "e37b9a04d5f6"
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index(
+        "idx_composes_stream_date",
+        "composes",
+        ["release_short", "release_version", "type", "date", "respin"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("idx_composes_stream_date", table_name="composes")
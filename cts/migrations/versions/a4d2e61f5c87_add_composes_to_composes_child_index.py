@@ -0,0 +1,26 @@
+"""Add index on composes_to_composes.child_compose_id
+
+Revision ID: a4d2e61f5c87
+Revises: 3b1f0c7a9e42
+Create Date: 2026-10-19 11:02:17.204931
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "a4d2e61f5c87"
+down_revision = "3b1f0c7a9e42"
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index(
+        "idx_composes_to_composes_child",
+        "composes_to_composes",
+        ["child_compose_id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("idx_composes_to_composes_child", table_name="composes_to_composes")
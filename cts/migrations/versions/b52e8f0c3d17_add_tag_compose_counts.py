@@ -0,0 +1,35 @@
+"""Add tag_compose_counts table
+
+Revision ID: b52e8f0c3d17
+Revises: 9d4b7e2f1a68
+Create Date: 2026-10-19 18:21:04.613590
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "b52e8f0c3d17"
+down_revision = "9d4b7e2f1a68"
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "tag_compose_counts",
+        sa.Column("tag_id", sa.Integer(), nullable=False),
+        sa.Column("composes", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["tag_id"],
+            ["tags.id"],
+        ),
+        sa.PrimaryKeyConstraint("tag_id"),
+    )
+    op.execute(
+        "INSERT INTO tag_compose_counts (tag_id, composes) "
+        "SELECT tag_id, COUNT(compose_id) FROM tags_to_composes GROUP BY tag_id"
+    )
+
+
+def downgrade():
+    op.drop_table("tag_compose_counts")
@@ -0,0 +1,30 @@
+"""Add indexes for compose and tag changes listing
+
+Revision ID: c81f4d2b6a03
+Revises: 5e0a8c3d71b9
+Create Date: 2026-10-19 15:21:08.440127
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "c81f4d2b6a03"
+down_revision = "5e0a8c3d71b9"
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index(
+        "idx_compose_changes_compose_time",
+        "compose_changes",
+        ["compose_id", "time"],
+        unique=False,
+    )
+    op.create_index(
+        "idx_tag_changes_tag_time", "tag_changes", ["tag_id", "time"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("idx_tag_changes_tag_time", table_name="tag_changes")
+    op.drop_index("idx_compose_changes_compose_time", table_name="compose_changes")
@@ -0,0 +1,37 @@
+"""Add compose_events table
+
+Revision ID: e37b9a04d5f6
+Revises: c81f4d2b6a03
+Create Date: 2026-10-19 17:05:33.918274
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "e37b9a04d5f6"
+down_revision = "c81f4d2b6a03"
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "compose_events",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("time", sa.DateTime(), nullable=False),
+        sa.Column("event", sa.String(), nullable=False),
+        sa.Column("compose_id", sa.String(), nullable=False),
+        sa.Column("tag", sa.String(), nullable=True),
+        sa.Column("release_short", sa.String(), nullable=True),
+        sa.Column("release_version", sa.String(), nullable=True),
+        sa.Column("message", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_compose_events_time"), "compose_events", ["time"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_compose_events_time"), table_name="compose_events")
+    op.drop_table("compose_events")
@@ -31,28 +31,41 @@ from datetime import datetime
 
 from cts import db
 from cts.events import cache_composes_if_state_changed
+from cts.events import cache_scheduled_messages
+from cts.events import schedule_composes_messages
 from cts.events import start_to_publish_messages
+from cts.events import store_compose_event_messages
+from cts.replicas import using_primary
+from cts.tag_catalogue import tag_catalogue
 
-from sqlalchemy import event
-from sqlalchemy.orm import backref
+from sqlalchemy import and_, event, func, literal, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import aliased, backref, selectinload
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import FlushError
 from flask_sqlalchemy import SignallingSession
 
 event.listen(SignallingSession, "after_flush", cache_composes_if_state_changed)
 
+event.listen(SignallingSession, "before_commit", cache_scheduled_messages)
+
+event.listen(SignallingSession, "before_commit", store_compose_event_messages)
+
 event.listen(SignallingSession, "after_commit", start_to_publish_messages)
 
 
 def commit_on_success(func):
     def _decorator(*args, **kwargs):
-        try:
-            return func(*args, **kwargs)
-        except Exception:
-            db.session.rollback()
-            raise
-        finally:
-            db.session.commit()
+        # The auth loaders create the users, so never look them up in
+        # the lagging replica.
+        with using_primary(db.session):
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.commit()
 
     return _decorator
 
@@ -70,6 +83,173 @@ def _utc_datetime_to_iso(datetime_object):
     return None
 
 
+def _compact_change_json(row):
+    """
+    Returns the JSON of compose or tag change selected by its `compact_query`.
+    """
+    data = row._asdict()
+    data["time"] = _utc_datetime_to_iso(row.time)
+    return data
+
+
+def _insert_or_ignore(table):
+    """
+    Returns INSERT statement for `table` which skips the rows violating
+    the unique constraints instead of raising IntegrityError.
+
+    :param table: sqlalchemy.Table to insert into.
+    :return: sqlalchemy.sql.expression.Insert
+    """
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return table.insert()
+
+
+# Key of the PostgreSQL advisory lock serializing the commits of the change
+# records, see `lock_change_ids`.
+CHANGE_IDS_LOCK = 0x43545331
+
+
+def lock_change_ids(session):
+    """
+    Makes the IDs of the change records inserted by the `session` from now
+    on ordered as the commits of their transactions.
+
+    The transaction-level advisory lock is held until the end of the
+    transaction and PostgreSQL releases it only after the commit is visible,
+    so the ID allocated by the next transaction taking the lock is always
+    committed later. The readers like the changes feed can then use the last
+    returned ID as a cursor: the missing lower IDs are never committed later,
+    they are rolled back. It expects the ID sequences without the CACHE.
+
+    SQLite serializes the writing transactions itself.
+
+    :param session: SQLAlchemy session or connection.
+    """
+    if db.engine.dialect.name == "postgresql":
+        session.execute(select(func.pg_advisory_xact_lock(CHANGE_IDS_LOCK)))
+
+
+def _add_audit_record(session, model, username, **values):
+    """
+    Adds the ComposeChange or TagChange record to be inserted on the commit
+    of the `session`, so it is written in the same transaction as the change
+    it describes.
+
+    :param session: SQLAlchemy session.
+    :param model: ComposeChange or TagChange.
+    :param str username: Name of the user who did the change.
+    :param values: Values of the record columns. The "compose" or "tag"
+        instance can be passed instead of the "compose_id" or "tag_id", so
+        the record can describe the instance which is not flushed yet.
+    """
+    values.setdefault("time", datetime.utcnow())
+    records = session.info.setdefault("audit_records", [])
+    records.append((model, username, values))
+
+
+def _write_audit_records(session):
+    """
+    Inserts the records added by `_add_audit_record` using single INSERT
+    per table, just before the commit of the outermost transaction.
+    """
+    if session.in_nested_transaction() or not session.info.get("audit_records"):
+        return
+
+    # The IDs must be allocated only after the lock is taken.
+    lock_change_ids(session)
+    # The users and the described instances might not be flushed yet.
+    session.flush()
+    records = session.info.pop("audit_records")
+    usernames = {username for _, username, _ in records}
+    user_ids = dict(
+        session.query(User.username, User.id).filter(User.username.in_(usernames))
+    )
+    rows = {}
+    for model, username, values in records:
+        values = dict(values, user_id=user_ids[username])
+        if "compose" in values:
+            values["compose_id"] = values.pop("compose").id
+        if "tag" in values:
+            values["tag_id"] = values.pop("tag").id
+        # All the rows of the executemany INSERT must have the same keys.
+        columns = [c.name for c in model.__table__.columns if c.name != "id"]
+        rows.setdefault(model, []).append({c: values.get(c) for c in columns})
+
+    for model, model_rows in rows.items():
+        session.execute(model.__table__.insert(), model_rows)
+    if TagChange in rows:
+        session.info["tags_changed"] = True
+
+
+def _audit_records_committed(session):
+    if session.info.pop("tags_changed", False):
+        tag_catalogue.invalidate()
+
+
+# Lists in the `session.info` buffering the changes until the commit.
+_SESSION_BUFFERS = (
+    "audit_records",
+    "scheduled_compose_messages",
+    "compose_event_messages",
+)
+
+
+def _begin_savepoint(session, transaction):
+    """
+    Remembers the state of the session buffers when the SAVEPOINT begins, so
+    `_discard_audit_records` can discard only the changes done in it.
+    """
+    if not transaction.nested:
+        return
+
+    savepoints = session.info.setdefault("savepoints", {})
+    savepoints[transaction] = (
+        {key: len(session.info.get(key, [])) for key in _SESSION_BUFFERS},
+        dict(session.info.get("tag_compose_counts", {})),
+    )
+
+
+def _end_savepoint(session, transaction):
+    if transaction.nested:
+        session.info.get("savepoints", {}).pop(transaction, None)
+
+
+def _discard_audit_records(session):
+    savepoint = session.get_nested_transaction()
+    if savepoint is not None:
+        # The after_rollback is also emitted when the rollback to SAVEPOINT is
+        # done, but the outer transaction can still be committed, so only the
+        # changes done in the SAVEPOINT are discarded.
+        lengths, counts = session.info.get("savepoints", {})[savepoint]
+        for key, length in lengths.items():
+            del session.info.get(key, [])[length:]
+        session.info["tag_compose_counts"] = counts
+        return
+
+    session.info.pop("audit_records", None)
+    session.info.pop("tag_compose_counts", None)
+    session.info.pop("tags_changed", None)
+    session.info.pop("savepoints", None)
+    # The messages about the rolled back changes must not be sent.
+    session.info.pop("scheduled_compose_messages", None)
+    session.info.pop("compose_event_messages", None)
+
+
+event.listen(SignallingSession, "after_transaction_create", _begin_savepoint)
+
+event.listen(SignallingSession, "after_transaction_end", _end_savepoint)
+
+event.listen(SignallingSession, "before_commit", _write_audit_records)
+
+event.listen(SignallingSession, "after_commit", _audit_records_committed)
+
+event.listen(SignallingSession, "after_rollback", _discard_audit_records)
+
+
 class CTSBase(db.Model):
     __abstract__ = True
 
@@ -127,6 +307,7 @@ composes_to_composes = db.Table(
     db.UniqueConstraint(
         "parent_compose_id", "child_compose_id", name="unique_composes"
     ),
+    db.Index("idx_composes_to_composes_child", "child_compose_id"),
 )
 
 
@@ -138,6 +319,74 @@ tags_to_composes = db.Table(
 )
 
 
+# Number of composes tagged with each tag. It is updated together with the
+# tags_to_composes, so the metrics do not need to count all its rows.
+tag_compose_counts = db.Table(
+    "tag_compose_counts",
+    db.Column("tag_id", db.Integer, db.ForeignKey("tags.id"), primary_key=True),
+    db.Column("composes", db.Integer, nullable=False, default=0),
+)
+
+
+def _add_tag_compose_count(session, tag_id, delta):
+    """
+    Adds `delta` to the number of composes tagged with the tag `tag_id` on
+    the commit of the `session`.
+
+    The counter row of the tag is locked until the end of the transaction
+    once it is updated, so the deltas are summed per tag and written by
+    `_write_tag_compose_counts` just before the commit. The concurrent
+    taggers of the same tag are then serialized only by their commits.
+
+    :param session: SQLAlchemy session.
+    :param int tag_id: ID of the tag.
+    :param int delta: Number of composes tagged, negative if untagged.
+    """
+    counts = session.info.setdefault("tag_compose_counts", {})
+    counts[tag_id] = counts.get(tag_id, 0) + delta
+
+
+def _write_tag_compose_count(session, tag_id, delta):
+    dialect = db.engine.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = (postgresql if dialect == "postgresql" else sqlite).insert
+        stmt = insert(tag_compose_counts).values(tag_id=tag_id, composes=delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tag_id"],
+            set_={"composes": tag_compose_counts.c.composes + stmt.excluded.composes},
+        )
+        session.execute(stmt)
+        return
+
+    result = session.execute(
+        tag_compose_counts.update()
+        .where(tag_compose_counts.c.tag_id == tag_id)
+        .values(composes=tag_compose_counts.c.composes + delta)
+    )
+    if not result.rowcount:
+        session.execute(
+            tag_compose_counts.insert().values(tag_id=tag_id, composes=delta)
+        )
+
+
+def _write_tag_compose_counts(session):
+    """
+    Writes the deltas added by `_add_tag_compose_count` just before the
+    commit of the outermost transaction.
+    """
+    if session.in_nested_transaction():
+        return
+
+    counts = session.info.pop("tag_compose_counts", {})
+    # Lock the counter rows always in the same order to avoid deadlocks.
+    for tag_id, delta in sorted(counts.items()):
+        if delta:
+            _write_tag_compose_count(session, tag_id, delta)
+
+
+event.listen(SignallingSession, "before_commit", _write_tag_compose_counts)
+
+
 taggers = db.Table(
     "taggers",
     db.Column("user_id", db.Integer, db.ForeignKey("users.id"), nullable=False),
@@ -180,7 +429,8 @@ class TagChange(CTSBase):
     time = db.Column(db.DateTime, nullable=False)
     # Tag associated with this record.
     tag_id = db.Column(db.Integer, db.ForeignKey("tags.id"), nullable=False)
-    # Action: "created", "add_tagger", "remove_tagger", "add_tagger", "remove_untagger"
+    # Action: "created", "updated", "add_tagger", "remove_tagger", "add_tagger",
+    # "remove_untagger"
     action = db.Column(db.String)
     # User which did the Tag change.
     user_id = db.Column(
@@ -192,15 +442,20 @@ class TagChange(CTSBase):
     # User data associated with this change further describing it.
     user_data = db.Column(db.String, nullable=True)
 
+    __table_args__ = (db.Index("idx_tag_changes_tag_time", "tag_id", "time"),)
+
     @classmethod
     def create(cls, session, tag, username, **kwargs):
-        user = User.find_user_by_name(username)
-        tag_change = cls(
-            time=datetime.utcnow(), tag_id=tag.id, user_id=user.id, **kwargs
-        )
-        session.add(tag_change)
-        session.commit()
-        return tag_change
+        """
+        Records the change of the `tag`. The record is inserted on the commit
+        of the `session`, together with the change.
+
+        :param session: SQLAlchemy session.
+        :param Tag tag: Changed tag.
+        :param str username: Name of the user who changed the tag.
+        :param kwargs: Values of the other TagChange columns.
+        """
+        _add_audit_record(session, cls, username, tag=tag, **kwargs)
 
     def json(self):
         return {
@@ -211,6 +466,36 @@ class TagChange(CTSBase):
             "user_data": self.user_data,
         }
 
+    @classmethod
+    def compact_query(cls, query):
+        """
+        Returns the TagChange `query` selecting just the columns of the
+        compact JSON returned by `compact_json`.
+        """
+        return query.join(User, User.id == cls.user_id).with_entities(
+            cls.id,
+            cls.time,
+            cls.action,
+            User.username.label("user"),
+            cls.user_data,
+        )
+
+    compact_json = staticmethod(_compact_change_json)
+
+    @classmethod
+    def version(cls, session):
+        """
+        Returns the version of the tags: the number of TagChange records and
+        the ID of the last one.
+
+        Every change of a tag is recorded by TagChange and the records are
+        never removed. The last ID alone is not enough, because the record
+        with lower ID can be committed later, but it still changes the
+        number of the records.
+        """
+        count, last_id = session.query(func.count(cls.id), func.max(cls.id)).one()
+        return count, last_id or 0
+
 
 class Tag(CTSBase):
     __tablename__ = "tags"
@@ -236,13 +521,63 @@ class Tag(CTSBase):
     def create(cls, session, logged_user, user_data=None, **kwargs):
         tag = cls(**kwargs)
         session.add(tag)
-        session.commit()
-
         TagChange.create(
             session, tag, logged_user, action="created", user_data=user_data
         )
+        session.commit()
         return tag
 
+    @classmethod
+    def compose_counts(cls, session):
+        """
+        Returns the number of composes tagged with each tag as maintained
+        in the tag_compose_counts table.
+
+        :param session: SQLAlchemy session.
+        :return: List of (tag name, number of composes) tuples.
+        """
+        return (
+            session.query(cls.name, tag_compose_counts.c.composes)
+            .join(tag_compose_counts, tag_compose_counts.c.tag_id == cls.id)
+            .order_by(cls.name)
+            .all()
+        )
+
+    @classmethod
+    def reconcile_compose_counts(cls, session):
+        """
+        Recomputes the tag_compose_counts table from the tags_to_composes.
+
+        The counts are updated together with the tags_to_composes, so this
+        only fixes the counts broken by changing the tables directly. It is
+        run periodically by the `reconcile_tag_counts` command and the caller
+        is responsible for committing the session.
+
+        :param session: SQLAlchemy session.
+        """
+        counts = session.query(
+            tags_to_composes.c.tag_id, func.count(tags_to_composes.c.compose_id)
+        ).group_by(tags_to_composes.c.tag_id)
+        session.execute(tag_compose_counts.delete())
+        session.execute(
+            tag_compose_counts.insert().from_select(
+                ["tag_id", "composes"], counts.subquery().select()
+            )
+        )
+
+    @classmethod
+    def with_permissions(cls, query):
+        """
+        Returns the Tag `query` loading the taggers and untaggers of all the
+        tags in a single query per relationship.
+        """
+        return query.options(
+            selectinload(cls.taggers),
+            selectinload(cls.untaggers),
+            selectinload(cls.tagger_groups),
+            selectinload(cls.untagger_groups),
+        )
+
     @classmethod
     def get_by_name(cls, tag_name):
         """Find a Tag by its name
@@ -437,6 +772,106 @@ class Tag(CTSBase):
 
         return True
 
+    @classmethod
+    def bulk_change_permissions(
+        cls, session, logged_user, tags, actions, user_data=None
+    ):
+        """
+        Grant or revoke the tagger and untagger permissions of all the `tags`.
+
+        Each action is applied to all the tags using single INSERT or DELETE
+        statement and the TagChange records are inserted in bulk on commit.
+        The caller is responsible for committing the session.
+
+        :param session: SQLAlchemy session.
+        :param str logged_user: Username of the logged user.
+        :param list tags: Tags to change.
+        :param list actions: Dicts with the "action" ("add_tagger",
+            "remove_tagger", "add_untagger" or "remove_untagger") and the
+            "username" or "group" to grant or revoke the permission.
+        :param str user_data: User data to add to TagChange records.
+        :return int: Number of permissions which have been actually changed.
+        """
+        usernames = {action["username"] for action in actions if action.get("username")}
+        users = {}
+        if usernames:
+            query = session.query(User).filter(User.username.in_(usernames))
+            users = {user.username: user for user in query}
+        for action in actions:
+            username = action.get("username")
+            if username and username not in users:
+                if action["action"].startswith("remove_"):
+                    raise ValueError('User "%s" does not exist.' % username)
+                users[username] = User.create_user(username)
+        session.flush()
+
+        tag_ids = [tag.id for tag in tags]
+        now = datetime.utcnow()
+        changes = 0
+        for action in actions:
+            name = action["action"]
+            if name.endswith("_untagger"):
+                user_table, group_table = untaggers, UntaggerGroups.__table__
+                permission = "Untagger"
+            else:
+                user_table, group_table = taggers, TaggerGroups.__table__
+                permission = "Tagger"
+
+            grantees = []
+            if action.get("username"):
+                user = users[action["username"]]
+                grantees.append(
+                    (user_table, "user_id", user.id, 'user "%s"' % user.username)
+                )
+            if action.get("group"):
+                group = action["group"]
+                grantees.append((group_table, "group", group, 'group "%s"' % group))
+
+            for table, column, value, grantee in grantees:
+                granted = {
+                    row[0]
+                    for row in session.query(table.c.tag_id).filter(
+                        table.c[column] == value, table.c.tag_id.in_(tag_ids)
+                    )
+                }
+                if name.startswith("add_"):
+                    changed = [id for id in tag_ids if id not in granted]
+                    if changed:
+                        session.execute(
+                            _insert_or_ignore(table),
+                            [{"tag_id": id, column: value} for id in changed],
+                        )
+                    message = "%s permission granted to %s." % (permission, grantee)
+                else:
+                    changed = [id for id in tag_ids if id in granted]
+                    if changed:
+                        session.execute(
+                            table.delete().where(
+                                table.c[column] == value, table.c.tag_id.in_(changed)
+                            )
+                        )
+                    message = "%s permission removed from %s." % (permission, grantee)
+                for id in changed:
+                    _add_audit_record(
+                        session,
+                        TagChange,
+                        logged_user,
+                        time=now,
+                        tag_id=id,
+                        action=name,
+                        message=message,
+                        user_data=user_data,
+                    )
+                changes += len(changed)
+
+        # The permission tables have been changed directly, so reload the
+        # relationships next time they are accessed.
+        for tag in tags:
+            session.expire(
+                tag, ["taggers", "untaggers", "tagger_groups", "untagger_groups"]
+            )
+        return changes
+
     def json(self):
         return {
             "id": self.id,
@@ -469,16 +904,32 @@ class ComposeChange(CTSBase):
     message = db.Column(db.String, nullable=True)
     # User data associated with this change further describing it.
     user_data = db.Column(db.String, nullable=True)
+    # Tag added or removed by "tagged" and "untagged" change.
+    tag_id = db.Column(db.Integer, db.ForeignKey("tags.id"), nullable=True)
+
+    __table_args__ = (
+        db.Index(
+            "idx_compose_changes_compose_tag",
+            "compose_id",
+            "tag_id",
+            "action",
+            "time",
+        ),
+        db.Index("idx_compose_changes_compose_time", "compose_id", "time"),
+    )
 
     @classmethod
     def create(cls, session, compose, username, **kwargs):
-        user = User.find_user_by_name(username)
-        compose_change = cls(
-            time=datetime.utcnow(), compose_id=compose.id, user_id=user.id, **kwargs
-        )
-        session.add(compose_change)
-        session.commit()
-        return compose_change
+        """
+        Records the change of the `compose`. The record is inserted on the
+        commit of the `session`, together with the change.
+
+        :param session: SQLAlchemy session.
+        :param Compose compose: Changed compose.
+        :param str username: Name of the user who changed the compose.
+        :param kwargs: Values of the other ComposeChange columns.
+        """
+        _add_audit_record(session, cls, username, compose=compose, **kwargs)
 
     def json(self):
         return {
@@ -489,6 +940,49 @@ class ComposeChange(CTSBase):
             "user_data": self.user_data,
         }
 
+    @classmethod
+    def compact_query(cls, query):
+        """
+        Returns the ComposeChange `query` selecting just the columns of the
+        compact JSON returned by `compact_json`.
+        """
+        return (
+            query.join(User, User.id == cls.user_id)
+            .outerjoin(Tag, Tag.id == cls.tag_id)
+            .with_entities(
+                cls.id,
+                cls.time,
+                cls.action,
+                User.username.label("user"),
+                Tag.name.label("tag"),
+                cls.user_data,
+            )
+        )
+
+    compact_json = staticmethod(_compact_change_json)
+
+
+class ComposeEvent(CTSBase):
+    """
+    Message about the compose change as sent to the messaging backend, kept
+    for the event stream subscribers for `conf.event_stream_retention` hours.
+    """
+
+    __tablename__ = "compose_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Time when the message has been sent.
+    time = db.Column(db.DateTime, nullable=False, index=True)
+    # The "event" of the message, for example "compose-tagged".
+    event = db.Column(db.String, nullable=False)
+    compose_id = db.Column(db.String, nullable=False)
+    # Tag added or removed by "compose-tagged" and "compose-untagged" events.
+    tag = db.Column(db.String, nullable=True)
+    release_short = db.Column(db.String, nullable=True)
+    release_version = db.Column(db.String, nullable=True)
+    # The JSON serialized message.
+    message = db.Column(db.String, nullable=False)
+
 
 class Compose(CTSBase):
     __tablename__ = "composes"
@@ -553,6 +1047,18 @@ class Compose(CTSBase):
 
     changes = db.relationship("ComposeChange", order_by="ComposeChange.time")
 
+    __table_args__ = (
+        db.Index("idx_composes_respin_of_id", "respin_of_id"),
+        db.Index(
+            "idx_composes_stream_date",
+            "release_short",
+            "release_version",
+            "type",
+            "date",
+            "respin",
+        ),
+    )
+
     @classmethod
     def create(
         cls,
@@ -567,6 +1073,9 @@ class Compose(CTSBase):
         """
         Creates new Compose and commits it to database ensuring that its ID is unique.
 
+        The Compose, its parents, respin_of and the "created" ComposeChange record
+        are committed in single transaction.
+
         :param session: SQLAlchemy session.
         :param str builder: Name of the user (service) building this compose.
         :param productmd.ComposeInfo ci: ComposeInfo metadata.
@@ -578,23 +1087,31 @@ class Compose(CTSBase):
             Compose and changed ComposeInfo metadata.
         """
 
-        # Find parent Compose instances before creating the Compose to be sure
-        # the parent_compose_ids are correct.
+        # Find parent and respin_of Compose instances before creating the Compose
+        # to be sure the parent_compose_ids and respin_of are correct. All of them
+        # are fetched using single query.
+        parent_compose_ids = parent_compose_ids or []
+        lookup_ids = set(parent_compose_ids)
+        if respin_of:
+            lookup_ids.add(respin_of)
+        found_composes = {}
+        if lookup_ids:
+            found_composes = {
+                c.id: c for c in Compose.query.filter(Compose.id.in_(lookup_ids))
+            }
+
         parent_composes = []
-        for parent_compose_id in parent_compose_ids or []:
-            parent_compose = Compose.query.filter(
-                Compose.id == parent_compose_id
-            ).first()
+        for parent_compose_id in parent_compose_ids:
+            parent_compose = found_composes.get(parent_compose_id)
             if not parent_compose:
                 raise ValueError(
                     "Cannot find parent compose with id %s." % parent_compose_id
                 )
             parent_composes.append(parent_compose)
 
-        # Find respin_of Compose instance before creating the Compose to be sure
-        # the respin_of is correct.
+        respin_of_compose = None
         if respin_of:
-            respin_of_compose = Compose.query.filter(Compose.id == respin_of).first()
+            respin_of_compose = found_composes.get(respin_of)
             if not respin_of_compose:
                 raise ValueError(
                     "Cannot find respin_of compose with id %s." % respin_of
@@ -625,16 +1142,21 @@ class Compose(CTSBase):
                 "builder": builder,
                 "compose_url": compose_url,
             }
-            compose = cls(**kwargs)
-            session.add(compose)
             try:
-                session.commit()
+                # Flush the new Compose in the savepoint, so only this attempt
+                # is rolled back in case the compose ID is already used.
+                with session.begin_nested():
+                    compose = cls(**kwargs)
+                    session.add(compose)
+                    # Populate the relationships before the flush, so the Compose
+                    # is written in single flush and single "compose-created"
+                    # event is generated for it.
+                    compose.parents = list(parent_composes)
+                    compose.respin_of = respin_of_compose
                 break
             except (IntegrityError, FlushError):
                 # Both IntegrityError and FlushError can be raised when the compose with
                 # the same ID already exists in database.
-                session.rollback()
-
                 # Really check that the IntegrityError was caused by
                 # existing compose.
                 existing_compose = Compose.query.filter(
@@ -643,22 +1165,19 @@ class Compose(CTSBase):
                 ).first()
                 if not existing_compose:
                     raise
-            # In case session.commit() failed with IntegrityErroir, increase
+                # The savepoint rollback expired the parent and respin_of
+                # composes, so refresh all of them using single query.
+                if lookup_ids:
+                    Compose.query.filter(Compose.id.in_(lookup_ids)).all()
+            # In case the flush failed with IntegrityError, increase
             # the `respin` and try again.
             ci.compose.respin += 1
             ci.compose.id = ci.create_compose_id()
 
-        # Add parent composes.
-        for parent_compose in parent_composes:
-            compose.parents.append(parent_compose)
-        # Add respin_of compose:
-        if respin_of:
-            compose.respin_of = respin_of_compose
-        session.commit()
-
         ComposeChange.create(
             session, compose, builder, action="created", user_data=user_data
         )
+        session.commit()
         return compose, ci
 
     def json(self, full=False):
@@ -685,7 +1204,7 @@ class Compose(CTSBase):
             "tags": [tag.name for tag in self.tags],
             "parents": [c.id for c in self.parents],
             "children": [c.id for c in self.children],
-            "respin_of": self.respin_of.id if self.respin_of else None,
+            "respin_of": self.respin_of_id,
             "respun_by": [c.id for c in self.respun_by],
             "compose_url": self.compose_url,
         }
@@ -694,89 +1213,540 @@ class Compose(CTSBase):
         """
         Tag the compose with tag `tag_name.
 
+        The tag is added using "INSERT ... ON CONFLICT DO NOTHING", so
+        concurrent tagging with the same tag does not fail. The ComposeChange
+        record and message are created only if the tag has been really added.
+
         :param str logged_user: Username of the logged user.
         :param str tag_name: Name of the tag.
         :param str user_data: User data to add to ComposeChange record.
         :return bool: True if compose tagged, False if tag does not exist.
         """
-        t = Tag.get_by_name(tag_name)
+        t = tag_catalogue.get_by_name(db.session, tag_name)
         if not t:
             return False
 
-        if t in self.tags:
+        result = db.session.execute(
+            _insert_or_ignore(tags_to_composes).values(compose_id=self.id, tag_id=t.id)
+        )
+        if not result.rowcount:
             # Tag is already added.
             return True
 
-        user = User.find_user_by_name(logged_user)
-        change = ComposeChange(
-            time=datetime.utcnow(),
-            compose_id=self.id,
-            user_id=user.id,
-            action="tagged",
-            user_data=user_data,
-            message='User "%s" added "%s" tag.' % (logged_user, tag_name),
+        self._tag_changed(
+            logged_user,
+            t,
+            "tagged",
+            'User "%s" added "%s" tag.' % (logged_user, tag_name),
+            user_data,
         )
-        self.changes.append(change)
-        self.tags.append(t)
         return True
 
     def untag(self, logged_user, tag_name, user_data=None):
         """
         Remove the tag `tag_name from the compose.
 
+        The ComposeChange record and message are created only if the tag
+        has been really removed.
+
         :param str logged_user: Username of the logged user.
         :param str tag_name: Name of the tag.
         :param str user_data: User data to add to ComposeChange record.
         :return bool: True if compose untagged, False if tag does not exist.
         """
-        t = Tag.get_by_name(tag_name)
+        t = tag_catalogue.get_by_name(db.session, tag_name)
         if not t:
             return False
 
-        if t not in self.tags:
+        result = db.session.execute(
+            tags_to_composes.delete().where(
+                tags_to_composes.c.compose_id == self.id,
+                tags_to_composes.c.tag_id == t.id,
+            )
+        )
+        if not result.rowcount:
             # Tag is not there, so return True.
             return True
 
-        user = User.find_user_by_name(logged_user)
-        change = ComposeChange(
-            time=datetime.utcnow(),
-            compose_id=self.id,
-            user_id=user.id,
-            action="untagged",
-            user_data=user_data,
-            message='User "%s" removed "%s" tag.' % (logged_user, tag_name),
+        self._tag_changed(
+            logged_user,
+            t,
+            "untagged",
+            'User "%s" removed "%s" tag.' % (logged_user, tag_name),
+            user_data,
         )
-        self.changes.append(change)
-        self.tags.remove(t)
         return True
 
-    def retag_stale_composes(self, logged_user, timeout, user_data=None):
+    def _tag_changed(self, logged_user, tag, action, message, user_data):
+        """
+        Adds the ComposeChange record and schedules the message for the compose
+        changed by `tag` or `untag`.
+        """
+        # The tags_to_composes has been changed directly, so reload the
+        # relationships next time they are accessed.
+        db.session.expire(self, ["tags", "changes"])
+        schedule_composes_messages(
+            db.session, [self], "compose-" + action, tag=tag.name, user_data=user_data
+        )
+        _add_tag_compose_count(db.session, tag.id, 1 if action == "tagged" else -1)
+        ComposeChange.create(
+            db.session,
+            self,
+            logged_user,
+            action=action,
+            user_data=user_data,
+            message=message,
+            tag_id=tag.id,
+        )
+
+    @classmethod
+    def bulk_tag(cls, session, logged_user, tag, query, user_data=None):
         """
-        Find and retag the composes with -requested tag and retag if the timeout occurs.
+        Tag all the composes matching the `query` with the `tag`.
 
+        The composes are tagged using single INSERT statement and the caller
+        is responsible for committing the session.
+
+        :param session: SQLAlchemy session.
         :param str logged_user: Username of the logged user.
-        :param int timeout: Timeout value in hours for retagging.
-        :param str user_data: User data to add to ComposeChange record.
-        :return Generator: The tag information that is retagged.
-        """
-        for tag in self.tags[:]:
-            if "requested" in tag.name:
-                # Get the latest requested tag info
-                last_change = (
-                    ComposeChange.query.filter(
-                        ComposeChange.compose_id == self.id,
-                        ComposeChange.action == "tagged",
-                        ComposeChange.message.contains('"' + tag.name + '"'),
+        :param tag: Tag or CachedTag to add.
+        :param query: Compose query selecting the composes to tag.
+        :param str user_data: User data to add to ComposeChange records.
+        :return list: IDs of composes which have been tagged. The composes
+            which have been already tagged are not included.
+        """
+        if db.engine.dialect.name == "postgresql":
+            # Only the rows really inserted are returned, so the composes
+            # tagged concurrently are not counted twice.
+            stmt = (
+                postgresql.insert(tags_to_composes)
+                .from_select(
+                    ["compose_id", "tag_id"],
+                    query.with_entities(cls.id, literal(tag.id)).statement,
+                )
+                .on_conflict_do_nothing()
+                .returning(tags_to_composes.c.compose_id)
+            )
+            compose_ids = sorted(row[0] for row in session.execute(stmt))
+        else:
+            tagged = session.query(tags_to_composes.c.compose_id).filter(
+                tags_to_composes.c.tag_id == tag.id
+            )
+            compose_ids = [
+                row[0]
+                for row in query.with_entities(cls.id)
+                .order_by(cls.id)
+                .filter(~cls.id.in_(tagged))
+            ]
+            if compose_ids:
+                session.execute(
+                    _insert_or_ignore(tags_to_composes),
+                    [{"compose_id": id, "tag_id": tag.id} for id in compose_ids],
+                )
+        if compose_ids:
+            cls._bulk_changed(
+                session,
+                logged_user,
+                tag,
+                compose_ids,
+                "tagged",
+                'User "%s" added "%s" tag.' % (logged_user, tag.name),
+                user_data,
+            )
+        return compose_ids
+
+    @classmethod
+    def bulk_untag(cls, session, logged_user, tag, query, user_data=None):
+        """
+        Remove the `tag` from all the composes matching the `query`.
+
+        The composes are untagged using single DELETE statement and the caller
+        is responsible for committing the session.
+
+        :param session: SQLAlchemy session.
+        :param str logged_user: Username of the logged user.
+        :param tag: Tag or CachedTag to remove.
+        :param query: Compose query selecting the composes to untag.
+        :param str user_data: User data to add to ComposeChange records.
+        :return list: IDs of composes which have been untagged. The composes
+            which have not been tagged are not included.
+        """
+        if db.engine.dialect.name == "postgresql":
+            # Only the rows really deleted are returned, so the composes
+            # untagged concurrently are not counted twice.
+            stmt = (
+                tags_to_composes.delete()
+                .where(
+                    tags_to_composes.c.tag_id == tag.id,
+                    tags_to_composes.c.compose_id.in_(
+                        query.with_entities(cls.id).statement
+                    ),
+                )
+                .returning(tags_to_composes.c.compose_id)
+            )
+            compose_ids = sorted(row[0] for row in session.execute(stmt))
+        else:
+            tagged = session.query(tags_to_composes.c.compose_id).filter(
+                tags_to_composes.c.tag_id == tag.id
+            )
+            compose_ids = [
+                row[0]
+                for row in query.with_entities(cls.id)
+                .order_by(cls.id)
+                .filter(cls.id.in_(tagged))
+            ]
+            if compose_ids:
+                session.execute(
+                    tags_to_composes.delete().where(
+                        tags_to_composes.c.tag_id == tag.id,
+                        tags_to_composes.c.compose_id.in_(compose_ids),
                     )
-                    .order_by(ComposeChange.time.desc())
-                    .first()
                 )
-                if datetime.utcnow() - last_change.time > timeout:
-                    # Untag compose
-                    self.untag(logged_user, tag.name, user_data)
-                    db.session.commit()
-
-                    # Tag compose again with -requested
-                    self.tag(logged_user, tag.name, user_data)
-                    db.session.commit()
-                yield tag
+        if compose_ids:
+            cls._bulk_changed(
+                session,
+                logged_user,
+                tag,
+                compose_ids,
+                "untagged",
+                'User "%s" removed "%s" tag.' % (logged_user, tag.name),
+                user_data,
+            )
+        return compose_ids
+
+    @classmethod
+    def _bulk_changed(
+        cls, session, logged_user, tag, compose_ids, action, message, user_data
+    ):
+        """
+        Adds the ComposeChange records and schedules the messages for composes
+        changed by `bulk_tag` or `bulk_untag`.
+        """
+        # Reload the changed composes, so the messages contain current tags.
+        composes = (
+            cls.query.filter(cls.id.in_(compose_ids))
+            .order_by(cls.id)
+            .options(
+                selectinload(cls.tags),
+                selectinload(cls.parents),
+                selectinload(cls.children),
+                selectinload(cls.respun_by),
+            )
+            .populate_existing()
+            .all()
+        )
+        schedule_composes_messages(
+            session, composes, "compose-" + action, tag=tag.name, user_data=user_data
+        )
+        # The `compose_ids` are only the composes really changed by this
+        # transaction, so the delta is exact.
+        delta = len(compose_ids) if action == "tagged" else -len(compose_ids)
+        _add_tag_compose_count(session, tag.id, delta)
+
+        now = datetime.utcnow()
+        for id in compose_ids:
+            _add_audit_record(
+                session,
+                ComposeChange,
+                logged_user,
+                time=now,
+                compose_id=id,
+                action=action,
+                message=message,
+                user_data=user_data,
+                tag_id=tag.id,
+            )
+
+    @classmethod
+    def graph_edges(cls, session, compose_id, ancestors, depth):
+        """
+        Returns the (parent_compose_id, child_compose_id) edges of the graph
+        of composes related to `compose_id` through the parents and children
+        relationships. The graph is found by single recursive query.
+
+        :param session: SQLAlchemy session.
+        :param str compose_id: ID of the compose in the root of the graph.
+        :param bool ancestors: When True, follow the parents of the compose,
+            otherwise follow its children.
+        :param int depth: Maximum distance of the composes from the root.
+        :return list: List of (parent_compose_id, child_compose_id) tuples.
+        """
+        edges = composes_to_composes.c
+        if ancestors:
+            near, far = edges.child_compose_id, edges.parent_compose_id
+        else:
+            near, far = edges.parent_compose_id, edges.child_compose_id
+
+        graph = (
+            session.query(
+                edges.parent_compose_id,
+                edges.child_compose_id,
+                literal(1).label("depth"),
+            )
+            .filter(near == compose_id)
+            .cte("graph", recursive=True)
+        )
+        graph_far = graph.c[far.name]
+        graph = graph.union(
+            session.query(
+                edges.parent_compose_id, edges.child_compose_id, graph.c.depth + 1
+            ).filter(near == graph_far, graph.c.depth < depth)
+        )
+        return (
+            session.query(graph.c.parent_compose_id, graph.c.child_compose_id)
+            .distinct()
+            .order_by(graph.c.parent_compose_id, graph.c.child_compose_id)
+            .all()
+        )
+
+    @classmethod
+    def respin_lineage(cls, session, compose_id):
+        """
+        Returns query of all the composes in the respin lineage of the compose
+        `compose_id`. This is the original compose which has not been respin
+        of any other compose and all the respins of it, recursively.
+
+        The composes are found by single recursive query and are ordered by
+        the distance from the original compose, date and respin, so the first
+        one is the original and the last one is the latest respin.
+
+        :param session: SQLAlchemy session.
+        :param str compose_id: ID of any compose in the lineage.
+        :return: sqlalchemy.orm.Query
+        """
+        # Follow the respin_of up to the original compose.
+        up = (
+            session.query(cls.id, cls.respin_of_id)
+            .filter(cls.id == compose_id)
+            .cte("respins_up", recursive=True)
+        )
+        parent = aliased(cls)
+        up = up.union(
+            session.query(parent.id, parent.respin_of_id).filter(
+                parent.id == up.c.respin_of_id
+            )
+        )
+        original = session.query(up.c.id).filter(up.c.respin_of_id.is_(None))
+
+        # And then all the respins of the original compose.
+        down = (
+            session.query(cls.id, literal(0).label("depth"))
+            .filter(cls.id.in_(original))
+            .cte("respins_down", recursive=True)
+        )
+        respin = aliased(cls)
+        down = down.union(
+            session.query(respin.id, down.c.depth + 1).filter(
+                respin.respin_of_id == down.c.id
+            )
+        )
+        return (
+            session.query(cls)
+            .join(down, cls.id == down.c.id)
+            .order_by(down.c.depth, cls.date, cls.respin, cls.id)
+        )
+
+    @classmethod
+    def latest_per_stream(cls, session, query=None):
+        """
+        Returns query of the newest compose of each compose stream, which is
+        the group of composes with the same release_short, release_version
+        and type. The newest compose has the highest date, respin and id.
+
+        This is single DISTINCT ON query with PostgreSQL, other databases
+        rank the composes in each stream using the row_number() window
+        function.
+
+        :param session: SQLAlchemy session.
+        :param query: Compose query with the filters, all the composes are
+            considered by default.
+        :return: sqlalchemy.orm.Query ordered by the stream.
+        """
+        if query is None:
+            query = session.query(cls)
+        stream = (cls.release_short, cls.release_version, cls.type)
+        newest = (cls.date.desc(), cls.respin.desc(), cls.id.desc())
+        if db.engine.dialect.name == "postgresql":
+            latest = (
+                query.with_entities(cls.id).distinct(*stream).order_by(*stream, *newest)
+            )
+        else:
+            rank = func.row_number().over(partition_by=stream, order_by=newest)
+            ranked = query.with_entities(cls.id, rank.label("rank")).subquery()
+            latest = session.query(ranked.c.id).filter(ranked.c.rank == 1)
+        return session.query(cls).filter(cls.id.in_(latest)).order_by(*stream)
+
+    @classmethod
+    def _date_bucket(cls, interval):
+        """
+        Returns SQL expression with the first day of the `interval` ("day",
+        "week" or "month") containing the compose date, in the same
+        YYYYMMDD format as the compose date. Weeks start on Monday.
+        """
+        if interval == "day":
+            return cls.date
+        if interval == "month":
+            return func.substr(cls.date, 1, 6).concat("01")
+        if db.engine.dialect.name == "postgresql":
+            week = func.date_trunc("week", func.to_date(cls.date, "YYYYMMDD"))
+            return func.to_char(week, "YYYYMMDD")
+        iso_date = (
+            func.substr(cls.date, 1, 4)
+            .concat("-")
+            .concat(func.substr(cls.date, 5, 2))
+            .concat("-")
+            .concat(func.substr(cls.date, 7, 2))
+        )
+        return func.replace(func.date(iso_date, "-6 days", "weekday 1"), "-", "")
+
+    @classmethod
+    def facet_counts(cls, query, facet, interval="day"):
+        """
+        Returns the number of composes matching the `query` grouped by the
+        `facet`.
+
+        :param query: Compose query with the filters.
+        :param str facet: Name of the Compose column, "tag" to count the
+            composes with each tag or "date" for the date histogram.
+        :param str interval: Bucket of the date histogram, "day", "week" or
+            "month".
+        :return: List of (value, count) tuples ordered by the value.
+        """
+        if facet == "tag":
+            column = Tag.name
+            query = query.join(cls.tags)
+        elif facet == "date":
+            column = cls._date_bucket(interval)
+        else:
+            column = getattr(cls, facet)
+        column = column.label("value")
+        return (
+            query.with_entities(column, func.count(cls.id))
+            .group_by(column)
+            .order_by(column)
+            .all()
+        )
+
+    @classmethod
+    def _last_requested_tagged(cls, session, compose_ids=None):
+        """
+        Returns subquery of (compose_id, tag_id, time) with the time when the
+        -requested tag has been added to the compose last time.
+        """
+        requested = session.query(Tag.id).filter(Tag.name.contains("requested"))
+        query = session.query(
+            ComposeChange.compose_id,
+            ComposeChange.tag_id,
+            func.max(ComposeChange.time).label("time"),
+        ).filter(
+            ComposeChange.action == "tagged",
+            ComposeChange.tag_id.in_(requested),
+        )
+        if compose_ids is not None:
+            query = query.filter(ComposeChange.compose_id.in_(compose_ids))
+        return query.group_by(ComposeChange.compose_id, ComposeChange.tag_id).subquery()
+
+    @classmethod
+    def requested_tags(cls, session, compose_ids=None):
+        """
+        Returns query of (compose_id, tag_id, time) of the composes currently
+        tagged with -requested tag, with the time when the tag has been added
+        last time.
+
+        :param session: SQLAlchemy session.
+        :param list compose_ids: If set, only these composes are returned.
+        :return: sqlalchemy.orm.Query
+        """
+        last_tagged = cls._last_requested_tagged(session, compose_ids)
+        return session.query(
+            tags_to_composes.c.compose_id, tags_to_composes.c.tag_id, last_tagged.c.time
+        ).join(
+            last_tagged,
+            and_(
+                last_tagged.c.compose_id == tags_to_composes.c.compose_id,
+                last_tagged.c.tag_id == tags_to_composes.c.tag_id,
+            ),
+        )
+
+    @classmethod
+    def stale_requested_tags(cls, session, older_than, compose_ids=None):
+        """
+        Returns query of (compose_id, tag_id) pairs of the composes tagged
+        with -requested tag which has been added last time before `older_than`.
+
+        The pairs are ordered by tag_id and compose_id.
+
+        :param session: SQLAlchemy session.
+        :param datetime older_than: Composes tagged before this time are stale.
+        :param list compose_ids: If set, only these composes are checked.
+        :return: sqlalchemy.orm.Query
+        """
+        last_tagged = cls._last_requested_tagged(session, compose_ids)
+        return (
+            session.query(tags_to_composes.c.compose_id, tags_to_composes.c.tag_id)
+            .join(
+                last_tagged,
+                and_(
+                    last_tagged.c.compose_id == tags_to_composes.c.compose_id,
+                    last_tagged.c.tag_id == tags_to_composes.c.tag_id,
+                ),
+            )
+            .filter(last_tagged.c.time < older_than)
+            .order_by(tags_to_composes.c.tag_id, tags_to_composes.c.compose_id)
+        )
+
+    @classmethod
+    def retag_stale_requested_tags(
+        cls,
+        session,
+        logged_user,
+        older_than,
+        batch_size=100,
+        user_data=None,
+        compose_ids=None,
+    ):
+        """
+        Untag and tag again the composes with stale -requested tags as found
+        by `stale_requested_tags`.
+
+        The composes are retagged in batches of `batch_size` (compose, tag)
+        pairs and each batch is committed in separate transaction.
+
+        :param session: SQLAlchemy session.
+        :param str logged_user: Username of the logged user.
+        :param datetime older_than: Composes tagged before this time are stale.
+        :param int batch_size: Number of (compose, tag) pairs retagged in
+            single transaction.
+        :param str user_data: User data to add to ComposeChange records.
+        :param list compose_ids: If set, only these composes are checked.
+        :return Generator: The (compose_id, CachedTag) pairs which are
+            retagged.
+        """
+        stale = cls.stale_requested_tags(session, older_than, compose_ids)
+        last = None
+        while True:
+            # Each batch is fetched by new query, because the commit of the
+            # previous batch would close the cursor of a streamed query.
+            query = stale
+            if last:
+                query = query.filter(
+                    tuple_(tags_to_composes.c.tag_id, tags_to_composes.c.compose_id)
+                    > tuple_(*last)
+                )
+            batch = query.limit(batch_size).all()
+            if not batch:
+                break
+            last = (batch[-1].tag_id, batch[-1].compose_id)
+
+            compose_ids_by_tag = {}
+            for compose_id, tag_id in batch:
+                compose_ids_by_tag.setdefault(tag_id, []).append(compose_id)
+            for tag_id, compose_ids in compose_ids_by_tag.items():
+                tag = tag_catalogue.get_by_id(session, tag_id)
+                query = cls.query.filter(cls.id.in_(compose_ids))
+                cls.bulk_untag(session, logged_user, tag, query, user_data)
+                cls.bulk_tag(session, logged_user, tag, query, user_data)
+            session.commit()
+
+            for compose_id, tag_id in batch:
+                yield compose_id, tag_catalogue.get_by_id(session, tag_id)
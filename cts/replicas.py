@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Routing of the read-only requests to the database replicas.
+
+The GET requests of the views with `read_replica = True` read from one of the
+`conf.database_replica_uris` replicas. Everything else, including all the
+writes, goes to the primary SQLALCHEMY_DATABASE_URI database.
+
+A client reading right after its own write could miss it on a lagging
+replica, so every successful write request sets the STICKY_COOKIE cookie and
+the STICKY_HEADER response header to the time until which the client's reads
+go to the primary. Clients not keeping cookies can send the header back.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+
+from flask import current_app, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+
+from cts.db_pool import engine_options
+
+STICKY_COOKIE = "cts_read_primary_until"
+STICKY_HEADER = "X-CTS-Read-Primary-Until"
+
+# Engines of the `conf.database_replica_uris`, created by `init_replicas`.
+replica_engines = []
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session reading from the engine in `info["replica"]` if set.
+
+    Once the session writes anything, all its following statements go to the
+    primary, so the session always reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+        elif self.info.get("replica") is not None and not self.info.get("wrote"):
+            return self.info["replica"]
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy extension using the `RoutingSession`.
+
+    The engine of the primary database uses the `engine_options` and has the
+    pool metrics set, also when it is created again for changed
+    SQLALCHEMY_DATABASE_URI.
+    """
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        from cts import conf
+
+        sa_url, options = super(RoutingSQLAlchemy, self).apply_driver_hacks(
+            app, sa_url, options
+        )
+        # The SQLALCHEMY_ENGINE_OPTIONS are applied by Flask-SQLAlchemy later,
+        # so they override these.
+        return sa_url, engine_options(conf, sa_url, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        from cts.metrics import init_pool_metrics
+
+        engine = super(RoutingSQLAlchemy, self).create_engine(sa_url, engine_opts)
+        init_pool_metrics(engine, "primary")
+        return engine
+
+
+@contextmanager
+def using_primary(session):
+    """
+    Routes the statements executed by the `session` in this context to the
+    primary database.
+
+    :param session: SQLAlchemy session.
+    """
+    replica = session.info.pop("replica", None)
+    try:
+        yield
+    finally:
+        if replica is not None:
+            session.info["replica"] = replica
+
+
+def _read_primary_until():
+    """Returns the time until which the client reads from the primary."""
+    value = request.headers.get(STICKY_HEADER) or request.cookies.get(STICKY_COOKIE)
+    try:
+        return float(value or 0)
+    except ValueError:
+        return 0
+
+
+def _is_replica_request():
+    if not replica_engines or request.method not in ("GET", "HEAD"):
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(getattr(view, "view_class", None), "read_replica", False):
+        return False
+    return _read_primary_until() <= time.time()
+
+
+def _reset_routing():
+    from cts import db
+
+    db.session.info.pop("replica", None)
+    db.session.info.pop("wrote", None)
+
+
+def _before_request():
+    from cts import db
+
+    # The session can outlive the request when the application context is
+    # shared, so do not let the routing leak in between the requests.
+    _reset_routing()
+    if _is_replica_request():
+        db.session.info["replica"] = random.choice(replica_engines)
+
+
+def _after_request(response):
+    from cts import conf
+
+    if (
+        replica_engines
+        and request.method not in ("GET", "HEAD", "OPTIONS")
+        and response.status_code < 400
+    ):
+        window = conf.database_replica_sticky_window
+        until = "%d" % (time.time() + window + 1)
+        response.set_cookie(STICKY_COOKIE, until, max_age=window, httponly=True)
+        response.headers[STICKY_HEADER] = until
+    return response
+
+
+def _teardown_request(exc):
+    _reset_routing()
+
+
+def create_replica_engines(app, uris):
+    """
+    Creates the engines of the replica databases.
+
+    :param app: Flask application.
+    :param list uris: Database URIs of the replicas.
+    """
+    from cts import conf
+    from cts.metrics import init_pool_metrics
+
+    options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS")
+    replica_engines[:] = [
+        create_engine(uri, **engine_options(conf, uri, options)) for uri in uris
+    ]
+    for i, engine in enumerate(replica_engines):
+        init_pool_metrics(engine, "replica%d" % i)
+
+
+def init_replicas(app):
+    """
+    Creates the engines of the `conf.database_replica_uris` and sets the
+    Flask request hooks routing the read-only requests to them.
+
+    :param app: Flask application.
+    """
+    from cts import conf
+
+    create_replica_engines(app, conf.database_replica_uris)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
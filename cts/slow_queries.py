@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Recorder of the SQL statements taking longer than `conf.slow_query_threshold`.
+
+The slow queries are logged and the last `conf.slow_query_log_size` of them
+are kept in memory of each process, so admins can view them using the API.
+"""
+
+import collections
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from logging import getLogger
+
+from flask import has_request_context, request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool
+
+from cts import conf
+
+log = getLogger(__name__)
+
+# Lists of bind parameters, for example "(?, ?, ?)" or "(%(id_1)s, %(id_2)s)"
+# generated for the "IN" operator.
+_PARAM = r"\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*"
+_PARAM_LIST_RE = re.compile(r"\((?:%s,)+%s\)" % (_PARAM, _PARAM))
+_WHITESPACE_RE = re.compile(r"\s+")
+# Only the SELECT statements without the row locks are explained.
+_PLAIN_SELECT_RE = re.compile(r"\s*SELECT\b", re.IGNORECASE)
+_LOCKING_RE = re.compile(
+    r"\bFOR\s+(?:NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b", re.IGNORECASE
+)
+
+
+def normalize_statement(statement):
+    """
+    Returns the SQL `statement` with collapsed whitespace and lists of bind
+    parameters, so the same queries with different number of parameters
+    look the same.
+    """
+    statement = _WHITESPACE_RE.sub(" ", statement).strip()
+    return _PARAM_LIST_RE.sub("(...)", statement)
+
+
+def parameters_shape(parameters, executemany=False):
+    """
+    Returns the shape of the bind `parameters`: their number and the number
+    of parameters of each type. The values are not included, because they
+    can be sensitive.
+    """
+    if executemany:
+        return {
+            "executemany": len(parameters),
+            "parameters": parameters_shape(parameters[0]) if parameters else None,
+        }
+    if isinstance(parameters, dict):
+        parameters = parameters.values()
+    types = collections.Counter(type(value).__name__ for value in parameters or [])
+    return {"count": sum(types.values()), "types": dict(types)}
+
+
+class SlowQueryLog(object):
+    """Bounded in-memory log of the recent slow queries."""
+
+    def __init__(self, size):
+        """
+        :param int size: Maximal number of kept slow queries.
+        """
+        self._lock = threading.Lock()
+        self._queries = collections.deque(maxlen=size)
+
+    def record(self, query):
+        """Adds the `query` dict to the log, removing the oldest one if full."""
+        with self._lock:
+            self._queries.append(query)
+
+    def queries(self):
+        """Returns the list of logged slow queries, the newest first."""
+        with self._lock:
+            return list(reversed(self._queries))
+
+    def clear(self):
+        with self._lock:
+            self._queries.clear()
+
+
+slow_query_log = SlowQueryLog(conf.slow_query_log_size)
+
+# Maximal number of slow queries waiting for the EXPLAIN.
+EXPLAIN_QUEUE_SIZE = 10
+
+
+def _explain(engine, statement, parameters):
+    """
+    Returns the output of EXPLAIN of the `statement` using the `engine`.
+
+    The statement is executed again only with
+    `conf.slow_query_explain_analyze`, so the EXPLAIN runs in transaction
+    which is always rolled back.
+    """
+    if conf.slow_query_explain_analyze:
+        explain = "EXPLAIN (ANALYZE, BUFFERS) "
+    else:
+        explain = "EXPLAIN "
+
+    try:
+        dbapi_conn = engine.raw_connection()
+    except Exception:
+        log.exception("Cannot explain slow query.")
+        return None
+    try:
+        cursor = dbapi_conn.cursor()
+        if conf.database_statement_timeout:
+            cursor.execute(
+                "SET LOCAL statement_timeout = %d"
+                % (conf.database_statement_timeout * 1000)
+            )
+        cursor.execute(explain + statement, parameters)
+        return "\n".join(row[0] for row in cursor.fetchall())
+    except Exception:
+        log.exception("Cannot explain slow query.")
+        return None
+    finally:
+        # Nothing done by the EXPLAIN ANALYZE is kept.
+        dbapi_conn.rollback()
+        dbapi_conn.close()
+
+
+class SlowQueryExplainer(object):
+    """
+    Runs the EXPLAIN of the slow queries in background thread and stores the
+    result as the "plan" of the logged query.
+
+    The slow queries are likely when the database is overloaded, so the
+    request executing the slow query must not wait for the EXPLAIN or for
+    the connection pool. The EXPLAIN uses its own connection opened for each
+    query and the queries not fitting into the queue are not explained.
+    """
+
+    def __init__(self, size):
+        """
+        :param int size: Maximal number of queries waiting for the EXPLAIN.
+        """
+        self._queue = queue.Queue(size)
+        self._lock = threading.Lock()
+        self._thread = None
+        # Engines without the connection pool, by database URL.
+        self._engines = {}
+
+    def explainable(self, conn, statement):
+        """Returns True if the `statement` executed by `conn` can be explained."""
+        return (
+            conn.dialect.name == "postgresql"
+            and bool(_PLAIN_SELECT_RE.match(statement))
+            and not _LOCKING_RE.search(statement)
+        )
+
+    def submit(self, conn, query, statement, parameters):
+        """
+        Queues the EXPLAIN of the slow `statement` executed by `conn`.
+
+        :param conn: SQLAlchemy connection which executed the statement.
+        :param dict query: Logged slow query to store the "plan" into.
+        :param str statement: SQL statement as executed by the DBAPI cursor.
+        :param parameters: DBAPI parameters of the statement.
+        """
+        self._start()
+        try:
+            self._queue.put_nowait((conn.engine.url, query, statement, parameters))
+        except queue.Full:
+            log.warning("Too many slow queries, not explaining: %s", query["statement"])
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="SlowQueryExplainer", daemon=True
+                )
+                self._thread.start()
+
+    def _engine(self, url):
+        engine = self._engines.get(url)
+        if engine is None:
+            engine = self._engines[url] = create_engine(url, poolclass=NullPool)
+        return engine
+
+    def _run(self):
+        while True:
+            url, query, statement, parameters = self._queue.get()
+            try:
+                query["plan"] = _explain(self._engine(url), statement, parameters)
+            except Exception:
+                log.exception("Cannot explain slow query.")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Waits until all the queued queries are explained."""
+        self._queue.join()
+
+
+explainer = SlowQueryExplainer(EXPLAIN_QUEUE_SIZE)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if conf.slow_query_threshold and context is not None:
+        context._slow_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_slow_query_start", None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+    if duration < conf.slow_query_threshold:
+        return
+
+    query = {
+        "time": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "duration": duration,
+        "statement": normalize_statement(statement),
+        "parameters": parameters_shape(parameters, executemany),
+        "endpoint": None,
+        "method": None,
+        "args": None,
+        "plan": None,
+    }
+    if has_request_context():
+        query["endpoint"] = request.endpoint
+        query["method"] = request.method
+        query["args"] = request.args.to_dict(flat=False)
+    explain = (
+        conf.slow_query_explain
+        and not executemany
+        and explainer.explainable(conn, statement)
+    )
+
+    log.warning(
+        "Slow query (%.3f s) in %s %s: %s %s",
+        duration,
+        query["method"],
+        query["endpoint"],
+        query["statement"],
+        query["args"],
+    )
+    slow_query_log.record(query)
+    if explain:
+        explainer.submit(conn, query, statement, parameters)
+
+
+def init_slow_query_log():
+    """Sets the SQLAlchemy engine events recording the slow queries."""
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Schedule of the -requested tags used by the stale requests daemon"""
+
+import heapq
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from sqlalchemy import and_, func, or_
+
+from cts.metrics import (
+    stale_requests_retagged,
+    stale_requests_scheduled,
+    stale_requests_sweep_duration,
+)
+from cts.models import Compose, ComposeChange, Tag
+
+log = getLogger(__name__)
+
+# Number of the IDs below the watermark checked for gaps by `rebuild`.
+GAP_BAND = 1000
+
+
+class StaleRequestsScheduler(object):
+    """
+    Keeps time ordered schedule of the deadlines of -requested tags and
+    retags the composes once the deadline passes.
+
+    The schedule is built by `rebuild` or restored from the `state_file` by
+    `load` and then updated by `sweep` using only the compose_changes newer
+    than the `watermark`.
+    """
+
+    def __init__(
+        self,
+        session,
+        username,
+        timeout,
+        batch_size=100,
+        state_file=None,
+        gap_timeout=timedelta(minutes=10),
+    ):
+        """
+        :param session: SQLAlchemy session.
+        :param str username: Name of the user retagging the composes.
+        :param timedelta timeout: Time after which the -requested tag is stale.
+        :param int batch_size: Number of composes retagged in single transaction.
+        :param str state_file: File to persist the schedule in between restarts.
+        :param timedelta gap_timeout: Time for which the missing IDs below the
+            watermark are checked again.
+        """
+        self.session = session
+        self.username = username
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.state_file = state_file
+        self.gap_timeout = gap_timeout
+        # ID of the last compose_changes row reflected in the schedule.
+        self.watermark = 0
+        # The IDs are allocated on insert, but the rows become visible on
+        # commit, so the row with lower ID can appear after the watermark
+        # has passed it. These missing IDs below the watermark are checked
+        # again by each `fold_changes` until the `gap_timeout` passes, which
+        # is the case of the rolled back inserts. Maps ID to the time it was
+        # found missing.
+        self.gaps = {}
+        # Deadline of each (compose_id, tag_id) pair.
+        self.deadlines = {}
+        # Heap of (deadline, compose_id, tag_id). It can contain entries
+        # which are not in `deadlines` anymore, these are skipped.
+        self._heap = []
+
+    def _schedule(self, compose_id, tag_id, deadline):
+        self.deadlines[(compose_id, tag_id)] = deadline
+        heapq.heappush(self._heap, (deadline, compose_id, tag_id))
+
+    def _track_gaps(self, low, high, seen, now):
+        """Remembers the IDs in (low, high] which are not in `seen`."""
+        for id in range(low + 1, high + 1):
+            if id not in seen:
+                self.gaps.setdefault(id, now)
+
+    def rebuild(self):
+        """Builds the schedule from all the composes with -requested tag."""
+        self.watermark = self.session.query(func.max(ComposeChange.id)).scalar() or 0
+        self.deadlines = {}
+        self._heap = []
+        self.gaps = {}
+        low = max(self.watermark - GAP_BAND, 0)
+        seen = {
+            row[0]
+            for row in self.session.query(ComposeChange.id).filter(
+                ComposeChange.id > low, ComposeChange.id <= self.watermark
+            )
+        }
+        self._track_gaps(low, self.watermark, seen, datetime.utcnow())
+        query = Compose.requested_tags(self.session)
+        for compose_id, tag_id, tagged in query.yield_per(self.batch_size):
+            self._schedule(compose_id, tag_id, tagged + self.timeout)
+        log.info(
+            "Scheduled %d requested tags up to change %d",
+            len(self.deadlines),
+            self.watermark,
+        )
+
+    def load(self):
+        """
+        Loads the schedule from the `state_file`.
+
+        :return bool: True if the schedule has been loaded.
+        """
+        if not self.state_file or not os.path.exists(self.state_file):
+            return False
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            if state["timeout"] != self.timeout.total_seconds():
+                log.info("Timeout has changed, ignoring %s", self.state_file)
+                return False
+            self.watermark = state["watermark"]
+            self.gaps = {
+                id: datetime.fromisoformat(found) for id, found in state.get("gaps", [])
+            }
+            self.deadlines = {}
+            self._heap = []
+            for compose_id, tag_id, deadline in state["deadlines"]:
+                self._schedule(compose_id, tag_id, datetime.fromisoformat(deadline))
+        except (OSError, ValueError, KeyError, TypeError):
+            log.exception("Cannot load %s", self.state_file)
+            return False
+        return True
+
+    def save(self):
+        """Persists the schedule to the `state_file`."""
+        if not self.state_file:
+            return
+        state = {
+            "timeout": self.timeout.total_seconds(),
+            "watermark": self.watermark,
+            "gaps": [[id, found.isoformat()] for id, found in self.gaps.items()],
+            "deadlines": [
+                [compose_id, tag_id, deadline.isoformat()]
+                for (compose_id, tag_id), deadline in self.deadlines.items()
+            ],
+        }
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def fold_changes(self):
+        """
+        Updates the schedule with the compose_changes newer than watermark
+        and with the ones committed since the last call in the gaps below it.
+        """
+        now = datetime.utcnow()
+        self.gaps = {
+            id: found
+            for id, found in self.gaps.items()
+            if now - found < self.gap_timeout
+        }
+        last_id = self.session.query(func.max(ComposeChange.id)).scalar() or 0
+        requested = {
+            row[0]
+            for row in self.session.query(Tag.id).filter(Tag.name.contains("requested"))
+        }
+        new_changes = and_(
+            ComposeChange.id > self.watermark, ComposeChange.id <= last_id
+        )
+        if self.gaps:
+            new_changes = or_(new_changes, ComposeChange.id.in_(list(self.gaps)))
+        query = (
+            self.session.query(
+                ComposeChange.id,
+                ComposeChange.compose_id,
+                ComposeChange.tag_id,
+                ComposeChange.action,
+                ComposeChange.time,
+            )
+            .filter(new_changes)
+            .order_by(ComposeChange.id)
+        )
+        seen = set()
+        for id, compose_id, tag_id, action, tagged in query.yield_per(self.batch_size):
+            seen.add(id)
+            self.gaps.pop(id, None)
+            if tag_id not in requested:
+                continue
+            if action == "tagged":
+                self._schedule(compose_id, tag_id, tagged + self.timeout)
+            elif action == "untagged":
+                self.deadlines.pop((compose_id, tag_id), None)
+        self._track_gaps(self.watermark, last_id, seen, now)
+        self.watermark = max(self.watermark, last_id)
+
+    def _pop_due(self, now):
+        """Removes and returns the (compose_id, tag_id) pairs due before `now`."""
+        due = []
+        while self._heap and self._heap[0][0] < now:
+            deadline, compose_id, tag_id = heapq.heappop(self._heap)
+            if self.deadlines.get((compose_id, tag_id)) == deadline:
+                del self.deadlines[(compose_id, tag_id)]
+                due.append((compose_id, tag_id))
+        return due
+
+    def next_deadline(self):
+        """Returns the earliest deadline in the schedule or None."""
+        return self._heap[0][0] if self._heap else None
+
+    def sweep(self, now=None):
+        """
+        Updates the schedule and retags the composes with stale -requested tags.
+
+        The pairs due in the schedule are checked against the database again
+        before retagging, so the schedule never causes unexpected retag.
+
+        :param datetime now: Current time, datetime.utcnow() by default.
+        :return list: The (compose_id, Tag) pairs which are retagged.
+        """
+        start = time.monotonic()
+        now = now or datetime.utcnow()
+        self.fold_changes()
+        compose_ids = sorted({compose_id for compose_id, _ in self._pop_due(now)})
+        retagged = []
+        for i in range(0, len(compose_ids), self.batch_size):
+            retagged += Compose.retag_stale_requested_tags(
+                self.session,
+                self.username,
+                now - self.timeout,
+                self.batch_size,
+                compose_ids=compose_ids[i : i + self.batch_size],
+            )
+        for _, tag in retagged:
+            stale_requests_retagged.labels(tag.name).inc()
+        stale_requests_scheduled.set(len(self.deadlines))
+        stale_requests_sweep_duration.observe(time.monotonic() - start)
+        self.save()
+        return retagged
+
+    def sleep_time(self, interval, now=None):
+        """
+        Returns number of seconds to sleep before next sweep. This is the
+        `interval` or less if some deadline passes sooner.
+        """
+        now = now or datetime.utcnow()
+        deadline = self.next_deadline()
+        if deadline is None:
+            return interval
+        return max(0, min(interval, (deadline - now).total_seconds()))
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Process-local catalogue of the tags.
+
+The tags are changed a few times a week, but they are needed by most of the
+requests, so all of them are cached in each CTS process together with their
+taggers and untaggers.
+
+Every change of a tag is recorded by TagChange, so the number of TagChange
+records and the ID of the last one are the version of the catalogue. The
+version is checked once per request, so the changes done by other CTS
+processes are seen by the next request. The changes done by this process
+invalidate the catalogue immediately.
+"""
+
+import threading
+
+from flask import g, has_request_context
+
+
+class CachedTag(object):
+    """
+    Read-only copy of the Tag. It can be used in place of the Tag by the code
+    which needs just the Tag `id`, `name` or the permissions, but it is not
+    bound to any session.
+    """
+
+    def __init__(self, tag):
+        """
+        :param Tag tag: Tag with the permissions loaded.
+        """
+        self.id = tag.id
+        self.name = tag.name
+        self.json = tag.json()
+        # Usernames of the users with the permissions.
+        self.taggers = frozenset(self.json["taggers"])
+        self.untaggers = frozenset(self.json["untaggers"])
+        # Groups with the permissions.
+        self.tagger_groups = frozenset(self.json["tagger_groups"])
+        self.untagger_groups = frozenset(self.json["untagger_groups"])
+
+    def __repr__(self):
+        return "<CachedTag %r>" % self.name
+
+
+class _Snapshot(object):
+    """All the tags of single catalogue version."""
+
+    def __init__(self, version, tags):
+        self.version = version
+        self.tags = tags
+        self.by_id = {tag.id: tag for tag in tags}
+        self.by_name = {tag.name: tag for tag in tags}
+
+
+class TagCatalogue(object):
+    """Caches all the tags as CachedTag instances."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Snapshot of the tags, None if not cached.
+        self._snapshot = None
+
+    def invalidate(self):
+        """Removes the tags from the cache."""
+        with self._lock:
+            self._snapshot = None
+
+    def _load(self, session):
+        from cts.models import Tag, TagChange
+
+        with self._lock:
+            snapshot = self._snapshot
+        # The version of the snapshot has been checked by this request.
+        if (
+            snapshot is not None
+            and has_request_context()
+            and g.get("tag_catalogue_snapshot") is snapshot
+        ):
+            return snapshot
+
+        version = TagChange.version(session)
+        if snapshot is None or snapshot.version != version:
+            query = Tag.with_permissions(session.query(Tag)).order_by(Tag.id)
+            snapshot = _Snapshot(version, [CachedTag(tag) for tag in query])
+            with self._lock:
+                self._snapshot = snapshot
+        if has_request_context():
+            g.tag_catalogue_snapshot = snapshot
+        return snapshot
+
+    def tags(self, session):
+        """
+        Returns all the tags ordered by ID.
+
+        :param session: SQLAlchemy session.
+        :return list: List of CachedTag instances.
+        """
+        return self._load(session).tags
+
+    def get_by_name(self, session, name):
+        """
+        Returns the tag with the `name`.
+
+        :param session: SQLAlchemy session.
+        :param str name: Tag name.
+        :return CachedTag: The tag or None.
+        """
+        return self._load(session).by_name.get(name)
+
+    def get_by_id(self, session, id):
+        """
+        Returns the tag with the `id`.
+
+        :param session: SQLAlchemy session.
+        :param int id: Tag ID.
+        :return CachedTag: The tag or None.
+        """
+        return self._load(session).by_id.get(id)
+
+
+tag_catalogue = TagCatalogue()
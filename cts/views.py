@@ -23,30 +23,42 @@
 
 import json
 import os
+import time
 
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
 from apispec_webframeworks.flask import FlaskPlugin
 from productmd import ComposeInfo
 from flask.views import MethodView, View
-from flask import render_template, request, jsonify, g, Response
+from flask import render_template, request, jsonify, g, Response, stream_with_context
 from flask_login import login_required
 from marshmallow import Schema, fields
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
 from cts import app, conf, version, db
 from cts.errors import NotFound, Forbidden
-from cts.models import Compose, Tag
+from cts.models import Compose, ComposeChange, Tag, TagChange
 from cts.api_utils import (
     pagination_metadata,
+    bulk_composes_query,
+    changes_feed,
+    compose_facets,
+    filter_changes,
     filter_composes,
     filter_tags,
+    get_tag,
     is_tagger,
     is_untagger,
+    query_composes,
+    tag_fields,
 )
+from cts.event_stream import event_stream
 from cts.auth import requires_role, require_scopes, require_oidc_scope, has_role
 from cts.metrics import registry
+from cts.slow_queries import slow_query_log
+from cts.tag_catalogue import tag_catalogue
 
 
 app.openapispec = APISpec(
@@ -142,10 +154,96 @@ class ChangeSchema(Schema):
     user_data = fields.String()
 
 
+class ChangesMetaSchema(Schema):
+    """Schema for paginated changes response."""
+
+    limit = fields.Integer()
+    next = fields.URL()
+
+
+class ComposeEdgeSchema(Schema):
+    parent = fields.String()
+    child = fields.String()
+
+
+class ComposeGraphSchema(Schema):
+    """Schema for ComposeAncestorsAPI and ComposeDescendantsAPI response."""
+
+    compose = fields.String()
+    depth = fields.Integer()
+    nodes = fields.List(fields.Nested(ComposeSchema))
+    edges = fields.List(fields.Nested(ComposeEdgeSchema))
+
+
+class ComposeRespinsSchema(Schema):
+    """Schema for ComposeRespinsAPI response."""
+
+    compose = fields.String()
+    original = fields.String()
+    head = fields.String()
+    respins = fields.List(fields.Nested(ComposeSchema))
+
+
+class ComposesLatestSchema(Schema):
+    """Schema for ComposesLatestAPI response."""
+
+    items = fields.List(fields.Nested(ComposeSchema))
+
+
+class FacetCountSchema(Schema):
+    value = fields.Raw()
+    count = fields.Integer()
+
+
+class ComposeFacetsSchema(Schema):
+    """Schema for ComposeFacetsAPI response."""
+
+    total = fields.Integer()
+    facets = fields.Dict(
+        keys=fields.String(), values=fields.List(fields.Nested(FacetCountSchema))
+    )
+
+
+class SlowQuerySchema(Schema):
+    time = fields.DateTime()
+    duration = fields.Float()
+    statement = fields.String()
+    parameters = fields.Dict()
+    endpoint = fields.String()
+    method = fields.String()
+    args = fields.Dict(keys=fields.String(), values=fields.List(fields.String()))
+    plan = fields.String()
+
+
+class SlowQueriesSchema(Schema):
+    """Schema for SlowQueriesAPI response."""
+
+    items = fields.List(fields.Nested(SlowQuerySchema))
+
+
+class FeedChangeSchema(Schema):
+    id = fields.Integer()
+    type = fields.String()
+    compose = fields.String()
+    tag = fields.String()
+    action = fields.String()
+    time = fields.DateTime()
+    user = fields.String()
+    user_data = fields.String()
+
+
+class ChangesFeedSchema(Schema):
+    """Schema for ChangesFeedAPI response."""
+
+    changes = fields.List(fields.Nested(FeedChangeSchema))
+    next = fields.String()
+
+
 class ComposeChangesSchema(Schema):
     """Schema for ComposeChangesAPI response."""
 
     changes = fields.List(fields.Nested(ChangeSchema))
+    meta = fields.Nested(ChangesMetaSchema)
 
 
 class TagSchema(Schema):
@@ -172,6 +270,7 @@ class TagChangesSchema(Schema):
     """Schema for TagChangesAPI response."""
 
     changes = fields.List(fields.Nested(ChangeSchema))
+    meta = fields.Nested(ChangesMetaSchema)
 
 
 class HTTPErrorSchema(Schema):
@@ -183,6 +282,9 @@ class HTTPErrorSchema(Schema):
 
 
 class ComposesListAPI(MethodView):
+    # The GET requests can read from the database replicas.
+    read_replica = True
+
     def get(self):
         """Returns CTS composes.
 
@@ -426,8 +528,139 @@ class ComposesListAPI(MethodView):
         )[1]
         return jsonify(json.loads(ci.dumps())), 200
 
+    @login_required
+    @require_scopes("edit-compose")
+    def patch(self):
+        """Tag or untag multiple composes.
+
+        ---
+        summary: Bulk edit composes
+        description: |
+          Tag or untag multiple composes in single transaction. The composes
+          are selected either by the list of compose IDs or by the filters.
+        requestBody:
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  action:
+                    type: string
+                    enum:
+                      - tag
+                      - untag
+                    description: |
+                      `Required`. One of the action
+                      - ``tag`` - Add ``tag`` to composes.
+                      - ``untag`` - Remove ``tag`` from composes.
+                  tag:
+                    type: string
+                    description: |
+                      `Required`. Tag to use.
+                  composes:
+                    type: array of string
+                    description: |
+                      IDs of composes to change. Either ``composes`` or
+                      ``filters`` must be set.
+                  filters:
+                    type: object
+                    description: |
+                      Change all composes matching these filters. The filters
+                      are the same as the query parameters of the list composes
+                      API, for example ``{"release_short": "Fedora", "tag": ["nightly"]}``.
+                  user_data:
+                    type: string
+                    description: |
+                      Optional data stored in the compose change history for
+                      these compose changes.
+        responses:
+          200:
+            description: |
+              Composes updated. The IDs of composes which have been actually
+              tagged or untagged are returned.
+            content:
+              application/json:
+                schema:
+                  type: object
+                  properties:
+                    action:
+                      type: string
+                    tag:
+                      type: string
+                    composes:
+                      type: array of string
+          400:
+            description: Request not in valid format.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+          401:
+            description: User is unathorized.
+            content:
+              text/html:
+                schema:
+                  type: string
+          403:
+            description: User is not allowed to edit compose.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+          404:
+            description: Compose not found.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+        """
+        data = request.get_json(force=True)
+        if not data:
+            raise ValueError("No JSON PATCH data submitted.")
+
+        action = data.get("action", None)
+        if action is None:
+            raise ValueError('No "action" field in JSON PATCH data.')
+        if action not in ["tag", "untag"]:
+            raise ValueError("Unknown action.")
+
+        tag_name = data.get("tag", None)
+        if not tag_name:
+            raise ValueError('No "tag" field in JSON PATCH data.')
+        tag = tag_catalogue.get_by_name(db.session, tag_name)
+        if not tag:
+            raise ValueError('Tag "%s" does not exist' % tag_name)
+
+        if action == "tag":
+            if not is_tagger(g.user, g.groups, tag) and not has_role("admins"):
+                raise Forbidden(
+                    'User "%s" does not have "taggers" permission for tag '
+                    '"%s".' % (g.user.username, tag_name)
+                )
+            bulk_action = Compose.bulk_tag
+        else:
+            if not is_untagger(g.user, g.groups, tag) and not has_role("admins"):
+                raise Forbidden(
+                    'User "%s" does not have "untaggers" permission for tag '
+                    '"%s".' % (g.user.username, tag_name)
+                )
+            bulk_action = Compose.bulk_untag
+
+        query = bulk_composes_query(data)
+        compose_ids = bulk_action(
+            db.session,
+            g.user.username,
+            tag,
+            query,
+            user_data=data.get("user_data", None),
+        )
+        db.session.commit()
+        return (
+            jsonify({"action": action, "tag": tag_name, "composes": compose_ids}),
+            200,
+        )
+
 
 class ComposeDetailAPI(MethodView):
+    read_replica = True
+
     def get(self, id):
         """Returns compose.
 
@@ -537,116 +770,646 @@ class ComposeDetailAPI(MethodView):
                     description: URL to the top level directory of the compose.
         responses:
           200:
-            description: Compose updated and returned.
-            content:
-              application/json:
-                schema: ComposeSchema
-          401:
-            description: User is unathorized.
+            description: Compose updated and returned.
+            content:
+              application/json:
+                schema: ComposeSchema
+          401:
+            description: User is unathorized.
+            content:
+              text/html:
+                schema:
+                  type: string
+          403:
+            description: User is not allowed to edit compose.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+          404:
+            description: Compose not found.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+        """
+        compose = Compose.query.filter_by(id=id).first()
+        if not compose:
+            raise NotFound("No such compose found.")
+
+        data = request.get_json(force=True)
+        if not data:
+            raise ValueError("No JSON PATCH data submitted.")
+
+        action = data.get("action", None)
+        if action is None:
+            raise ValueError('No "action" field in JSON PATCH data.')
+
+        user_data = data.get("user_data", None)
+
+        is_admin = has_role("admins")
+
+        if action in ["tag", "untag"]:
+            tag_name = data.get("tag", None)
+            if not tag_name:
+                raise ValueError('No "tag" field in JSON PATCH data.')
+            tag = tag_catalogue.get_by_name(db.session, tag_name)
+            if not tag:
+                raise ValueError('Tag "%s" does not exist' % tag_name)
+
+            if action == "tag":
+                if not is_tagger(g.user, g.groups, tag) and not is_admin:
+                    raise Forbidden(
+                        'User "%s" does not have "taggers" permission for tag '
+                        '"%s".' % (g.user.username, tag_name)
+                    )
+                compose.tag(g.user.username, tag_name, user_data)
+            else:
+                if not is_untagger(g.user, g.groups, tag) and not is_admin:
+                    raise Forbidden(
+                        'User "%s" does not have "untaggers" permission for tag '
+                        '"%s".' % (g.user.username, tag_name)
+                    )
+                compose.untag(g.user.username, tag_name, user_data)
+        elif action == "set_url":
+            if not has_role("allowed_builders") and not is_admin:
+                raise Forbidden(
+                    'User "%s" does not have permission to set compose_url'
+                    % g.user.username
+                )
+
+            compose_url = data.get("compose_url", None)
+            if compose_url is None:
+                raise ValueError('No "compose_url" field in JSON PATCH data.')
+            if not compose_url.startswith("http"):
+                raise ValueError('"compose_url" field must be a valid http(s) URL')
+            compose.compose_url = compose_url
+        else:
+            raise ValueError("Unknown action.")
+
+        db.session.commit()
+        return jsonify(compose.json()), 200
+
+
+def _changes_response(change_class, query):
+    """
+    Returns the JSON response with the changes from `query` filtered and
+    paginated based on the request parameters.
+    """
+    change_format = request.args.get("format", "full")
+    if change_format not in ("full", "compact"):
+        raise ValueError('"format" must be "full" or "compact".')
+    if change_format == "compact":
+        query = change_class.compact_query(query)
+
+    changes, meta = filter_changes(request, change_class, query)
+    if change_format == "compact":
+        changes = [change_class.compact_json(c) for c in changes]
+    else:
+        changes = [c.json() for c in changes]
+    return jsonify({"changes": changes, "meta": meta}), 200
+
+
+class ComposeChangesAPI(MethodView):
+    read_replica = True
+
+    def get(self, id):
+        """Returns compose change history.
+
+        ---
+        summary: Get compose changes
+        description: |
+          Get compose changes ordered by time. The changes are paginated, the
+          `meta.next` contains the URL of the next page or null.
+        parameters:
+          - name: id
+            in: path
+            schema:
+              type: string
+            required: true
+            description: Compose ID
+          - name: since
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Return only changes done at this time or later, for example "2020-05-17T10:00:00Z".
+          - name: until
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Return only changes done before this time.
+          - name: action
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Return only changes with this action. Can be repeated.
+          - name: user
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Return only changes done by this user.
+          - name: limit
+            in: query
+            schema:
+              type: integer
+            required: false
+            description: Maximum number of changes returned, 100 by default, 1000 at most.
+          - name: after
+            in: query
+            schema:
+              type: integer
+            required: false
+            description: |
+              Return the changes following the change with this ID. Use the
+              `meta.next` URL to get the next page instead of setting it directly.
+          - name: format
+            in: query
+            schema:
+              type: string
+            required: false
+            description: |
+              Set to "compact" to return only the `id`, `time`, `action`, `user`
+              `user_data` and `tag` of changes, without the generated `message`.
+        responses:
+          200:
+            description: Compose changes are returned.
+            content:
+              application/json:
+                schema: ComposeChangesSchema
+          404:
+            description: Compose not found.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+        """
+        if not Compose.query.filter_by(id=id).count():
+            raise NotFound("No such compose found.")
+
+        query = ComposeChange.query.filter_by(compose_id=id)
+        return _changes_response(ComposeChange, query)
+
+
+class ComposeGraphBaseAPI(MethodView):
+    read_replica = True
+
+    def _graph(self, id, ancestors):
+        """
+        Returns the JSON response with the graph of composes related to
+        compose `id` found by Compose.graph_edges.
+        """
+        if not Compose.query.filter_by(id=id).count():
+            raise NotFound("No such compose found.")
+
+        max_depth = conf.compose_graph_max_depth
+        depth = request.args.get("depth", max_depth, type=int)
+        if depth < 1 or depth > max_depth:
+            raise ValueError('"depth" must be between 1 and %d.' % max_depth)
+
+        edges = Compose.graph_edges(db.session, id, ancestors, depth)
+        node_ids = {id}
+        for parent, child in edges:
+            node_ids.update([parent, child])
+        nodes = (
+            Compose.query.filter(Compose.id.in_(node_ids))
+            .options(
+                selectinload(Compose.tags),
+                selectinload(Compose.parents),
+                selectinload(Compose.children),
+                selectinload(Compose.respun_by),
+            )
+            .order_by(Compose.id)
+        )
+        return (
+            jsonify(
+                {
+                    "compose": id,
+                    "depth": depth,
+                    "nodes": [c.json() for c in nodes],
+                    "edges": [
+                        {"parent": parent, "child": child} for parent, child in edges
+                    ],
+                }
+            ),
+            200,
+        )
+
+
+class ComposeAncestorsAPI(ComposeGraphBaseAPI):
+    def get(self, id):
+        """Returns the graph of compose ancestors.
+
+        ---
+        summary: Get compose ancestors
+        description: |
+          Get the compose and all its parents, the parents of the parents and
+          so on up to the `depth`. The `edges` contain all the parent-child
+          relations between the returned composes.
+        parameters:
+          - name: id
+            in: path
+            schema:
+              type: string
+            required: true
+            description: Compose ID
+          - name: depth
+            in: query
+            schema:
+              type: integer
+            required: false
+            description: |
+              Maximum distance of the returned composes from the compose `id`.
+              Defaults to the maximum allowed by CTS configuration.
+        responses:
+          200:
+            content:
+              application/json:
+                schema: ComposeGraphSchema
+          400:
+            description: Invalid depth.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+          404:
+            description: Compose not found.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+        """
+        return self._graph(id, ancestors=True)
+
+
+class ComposeDescendantsAPI(ComposeGraphBaseAPI):
+    def get(self, id):
+        """Returns the graph of compose descendants.
+
+        ---
+        summary: Get compose descendants
+        description: |
+          Get the compose and all its children, the children of the children
+          and so on up to the `depth`. The `edges` contain all the
+          parent-child relations between the returned composes.
+        parameters:
+          - name: id
+            in: path
+            schema:
+              type: string
+            required: true
+            description: Compose ID
+          - name: depth
+            in: query
+            schema:
+              type: integer
+            required: false
+            description: |
+              Maximum distance of the returned composes from the compose `id`.
+              Defaults to the maximum allowed by CTS configuration.
+        responses:
+          200:
+            content:
+              application/json:
+                schema: ComposeGraphSchema
+          400:
+            description: Invalid depth.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+          404:
+            description: Compose not found.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+        """
+        return self._graph(id, ancestors=False)
+
+
+class ComposeRespinsAPI(MethodView):
+    read_replica = True
+
+    def get(self, id):
+        """Returns the respin lineage of compose.
+
+        ---
+        summary: Get compose respins
+        description: |
+          Get all the composes in the respin lineage of the compose `id`. The
+          `respins` start with the `original` compose which is not respin of
+          any other compose and continue with all its respins, recursively,
+          ordered by the number of respins in between, date and respin. The
+          `head` is the last compose in the lineage.
+        parameters:
+          - name: id
+            in: path
+            schema:
+              type: string
+            required: true
+            description: Compose ID
+        responses:
+          200:
+            content:
+              application/json:
+                schema: ComposeRespinsSchema
+          404:
+            description: Compose not found.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+        """
+        respins = (
+            Compose.respin_lineage(db.session, id)
+            .options(
+                selectinload(Compose.tags),
+                selectinload(Compose.parents),
+                selectinload(Compose.children),
+                selectinload(Compose.respun_by),
+            )
+            .all()
+        )
+        if not respins:
+            raise NotFound("No such compose found.")
+
+        return (
+            jsonify(
+                {
+                    "compose": id,
+                    "original": respins[0].id,
+                    "head": respins[-1].id,
+                    "respins": [c.json() for c in respins],
+                }
+            ),
+            200,
+        )
+
+
+class ComposesLatestAPI(MethodView):
+    read_replica = True
+
+    def get(self):
+        """Returns the newest compose of each compose stream.
+
+        ---
+        summary: Get latest composes
+        description: |
+          Get the newest compose of each compose stream. The compose stream
+          is the group of composes with the same `release_short`,
+          `release_version` and `type`. The newest compose is the one with
+          the highest `date`, `respin` and `id`.
+
+          The composes are filtered first, so for example
+          `?release_short=Fedora&tag=nightly-ready` returns the newest compose
+          with the "nightly-ready" tag of each Fedora stream. All the query
+          parameters accepted by the "/api/1/composes/" endpoint to filter the
+          composes can be used, ordering and pagination is not supported.
+        responses:
+          200:
+            content:
+              application/json:
+                schema: ComposesLatestSchema
+        """
+        query = query_composes(request.args, db.session.query(Compose))
+        composes = (
+            Compose.latest_per_stream(db.session, query)
+            .options(
+                selectinload(Compose.tags),
+                selectinload(Compose.parents),
+                selectinload(Compose.children),
+                selectinload(Compose.respun_by),
+            )
+            .all()
+        )
+        return jsonify({"items": [c.json() for c in composes]}), 200
+
+
+class ComposeFacetsAPI(MethodView):
+    read_replica = True
+
+    def get(self):
+        """Returns the number of composes grouped by the facets.
+
+        ---
+        summary: Get compose facets
+        description: |
+          Get the number of composes grouped by each of the requested facets.
+          The composes can be filtered using all the query parameters accepted
+          by the "/api/1/composes/" endpoint to filter the composes.
+
+          The "tag" facet counts the composes with each tag, so single compose
+          can be counted in multiple groups. The "date" facet is the date
+          histogram with the groups set by the `interval`, the value of each
+          group is the first day of the interval.
+        parameters:
+          - name: facet
+            in: query
+            schema:
+              type: array
+              items:
+                type: string
+            required: false
+            description: |
+              Facets to return, the "tag", "date" or name of any other compose
+              attribute which can be used as filter, like "release_short" or
+              "type". By default "tag", "release_short", "type" and "date".
+          - name: interval
+            in: query
+            schema:
+              type: string
+              enum: [day, week, month]
+            required: false
+            description: Interval of the "date" facet groups, "day" by default.
+        responses:
+          200:
+            content:
+              application/json:
+                schema: ComposeFacetsSchema
+          400:
+            description: Unknown facet or invalid interval.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+        """
+        return jsonify(compose_facets(request)), 200
+
+
+class ChangesFeedAPI(MethodView):
+    def get(self):
+        """Returns compose and tag changes done since the last request.
+
+        ---
+        summary: Get changes feed
+        description: |
+          Get all the compose and tag changes done after the `since` cursor.
+          The compose changes and the tag changes are each returned in the
+          order of their commits and interleaved by time. The `next` cursor
+          should be used as `since` in the next request to get only the new
+          changes.
+
+          For compose changes, the `tag` is the name of the added or removed
+          tag. For tag changes, the `tag` is the name of the changed tag and
+          `compose` is null.
+        parameters:
+          - name: since
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Cursor returned as `next`. Defaults to "0-0", the first change.
+          - name: limit
+            in: query
+            schema:
+              type: integer
+            required: false
+            description: Maximum number of changes returned. Limited by CTS configuration.
+          - name: wait
+            in: query
+            schema:
+              type: integer
+            required: false
+            description: |
+              Number of seconds to wait for new changes when there are none yet.
+              Limited by CTS configuration. Defaults to 0, no waiting.
+        responses:
+          200:
+            content:
+              application/json:
+                schema: ChangesFeedSchema
+          400:
+            description: Invalid request parameters.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+        """
+        since = request.args.get("since", "0-0")
+        limit = request.args.get("limit", conf.changes_feed_batch_size, type=int)
+        if limit < 1 or limit > conf.changes_feed_batch_size:
+            raise ValueError(
+                '"limit" must be between 1 and %d.' % conf.changes_feed_batch_size
+            )
+        wait = request.args.get("wait", 0, type=int)
+        if wait < 0 or wait > conf.changes_feed_max_wait:
+            raise ValueError(
+                '"wait" must be between 0 and %d.' % conf.changes_feed_max_wait
+            )
+
+        deadline = time.monotonic() + wait
+        while True:
+            changes, cursor = changes_feed(since, limit)
+            if changes or time.monotonic() >= deadline:
+                break
+            # Return the connection to the pool while waiting.
+            db.session.close()
+            time.sleep(conf.changes_feed_poll_interval)
+
+        return jsonify({"changes": changes, "next": cursor}), 200
+
+
+class EventStreamAPI(MethodView):
+    def get(self):
+        """Returns the stream of compose events.
+
+        ---
+        summary: Get compose events stream
+        description: |
+          Get the Server-Sent Events stream of the compose events, like
+          "compose-created", "compose-tagged" or "compose-untagged". The data
+          of each event is the JSON message as sent to the messaging backend.
+
+          When the `Last-Event-ID` header is set, the stream starts with the
+          events following this event, as long as they are still kept by CTS.
+          Otherwise, only the new events are sent.
+        parameters:
+          - name: tag
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Send only the events about adding or removing this tag.
+          - name: release_short
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Send only the events about composes of this release.
+          - name: release_version
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Send only the events about composes of this release version.
+          - name: Last-Event-ID
+            in: header
+            schema:
+              type: integer
+            required: false
+            description: ID of the last event received by the client.
+        responses:
+          200:
             content:
-              text/html:
+              text/event-stream:
                 schema:
                   type: string
-          403:
-            description: User is not allowed to edit compose.
+          400:
+            description: Invalid Last-Event-ID.
             content:
               application/json:
                 schema: HTTPErrorSchema
           404:
-            description: Compose not found.
+            description: Event stream is disabled.
             content:
               application/json:
                 schema: HTTPErrorSchema
         """
-        compose = Compose.query.filter_by(id=id).first()
-        if not compose:
-            raise NotFound("No such compose found.")
-
-        data = request.get_json(force=True)
-        if not data:
-            raise ValueError("No JSON PATCH data submitted.")
-
-        action = data.get("action", None)
-        if action is None:
-            raise ValueError('No "action" field in JSON PATCH data.')
-
-        user_data = data.get("user_data", None)
-
-        is_admin = has_role("admins")
-
-        if action in ["tag", "untag"]:
-            tag_name = data.get("tag", None)
-            if not tag_name:
-                raise ValueError('No "tag" field in JSON PATCH data.')
-            tag = Tag.get_by_name(tag_name)
-            if not tag:
-                raise ValueError('Tag "%s" does not exist' % tag_name)
-
-            if action == "tag":
-                if not is_tagger(g.user, g.groups, tag) and not is_admin:
-                    raise Forbidden(
-                        'User "%s" does not have "taggers" permission for tag '
-                        '"%s".' % (g.user.username, tag_name)
-                    )
-                compose.tag(g.user.username, tag_name, user_data)
-            else:
-                if not is_untagger(g.user, g.groups, tag) and not is_admin:
-                    raise Forbidden(
-                        'User "%s" does not have "untaggers" permission for tag '
-                        '"%s".' % (g.user.username, tag_name)
-                    )
-                compose.untag(g.user.username, tag_name, user_data)
-        elif action == "set_url":
-            if not has_role("allowed_builders") and not is_admin:
-                raise Forbidden(
-                    'User "%s" does not have permission to set compose_url'
-                    % g.user.username
-                )
-
-            compose_url = data.get("compose_url", None)
-            if compose_url is None:
-                raise ValueError('No "compose_url" field in JSON PATCH data.')
-            if not compose_url.startswith("http"):
-                raise ValueError('"compose_url" field must be a valid http(s) URL')
-            compose.compose_url = compose_url
-        else:
-            raise ValueError("Unknown action.")
-
-        db.session.commit()
-        return jsonify(compose.json()), 200
+        if not conf.event_stream_retention:
+            raise NotFound("Event stream is disabled.")
+
+        last_event_id = request.headers.get("Last-Event-ID")
+        if last_event_id is not None:
+            if not last_event_id.isdigit():
+                raise ValueError('Invalid Last-Event-ID "%s".' % last_event_id)
+            last_event_id = int(last_event_id)
+
+        stream = event_stream(
+            last_event_id,
+            tag=request.args.get("tag"),
+            release_short=request.args.get("release_short"),
+            release_version=request.args.get("release_version"),
+        )
+        return Response(
+            stream_with_context(stream),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
 
-class ComposeChangesAPI(MethodView):
-    def get(self, id):
-        """Returns compose change history.
+class SlowQueriesAPI(MethodView):
+    @login_required
+    @requires_role("admins")
+    def get(self):
+        """Returns the recent slow SQL queries.
 
         ---
-        summary: Get compose changes
-        description: Get compose changes
-        parameters:
-          - name: id
-            in: path
-            schema:
-              type: string
-            required: true
-            description: Compose ID
+        summary: Get slow queries
+        description: |
+          Get the recent SQL queries which took longer than the configured
+          threshold, the newest first. Each CTS process keeps its own slow
+          queries, so the response contains only the slow queries of the
+          process handling the request.
+
+          The `statement` is normalized and the `parameters` contain only the
+          number and types of the bind parameters. The `plan` is set only if
+          EXPLAIN of slow queries is enabled.
         responses:
           200:
-            description: Compose changes are returned.
             content:
               application/json:
-                schema: ComposeChangesSchema
-          404:
-            description: Compose not found.
+                schema: SlowQueriesSchema
+          403:
+            description: User is not admin.
             content:
               application/json:
                 schema: HTTPErrorSchema
         """
-        compose = Compose.query.filter_by(id=id).first()
-        if not compose:
-            raise NotFound("No such compose found.")
-
-        return jsonify({"changes": [c.json() for c in compose.changes]}), 200
+        return jsonify({"items": slow_query_log.queries()}), 200
 
 
 class AboutAPI(MethodView):
@@ -714,6 +1477,8 @@ class MetricsAPI(MethodView):
 
 
 class TagsListAPI(MethodView):
+    read_replica = True
+
     def get(self):
         """Returns tags.
 
@@ -730,17 +1495,32 @@ class TagsListAPI(MethodView):
               Order the tags by the given fields. If ``-`` prefix is used, the
               order will be descending.
               The default value is `?order_by=-id`.
+          - name: fields
+            in: query
+            schema:
+              type: string
+            required: false
+            description: |
+              Comma separated list of the returned tag fields, for example
+              `?fields=id,name` to skip the taggers and untaggers. All the
+              fields are returned by default.
         responses:
           200:
             content:
               application/json:
                 schema: TagListSchema
+          400:
+            description: Request not in valid format.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
         """
+        fields = tag_fields(request)
         p_query = filter_tags(request)
 
         json_data = {
             "meta": pagination_metadata(p_query, request.args),
-            "items": [item.json() for item in p_query.items],
+            "items": [{f: item[f] for f in fields} for item in p_query.items],
         }
 
         return jsonify(json_data), 200
@@ -834,8 +1614,120 @@ class TagsListAPI(MethodView):
             raise ValueError(str(e))
         return jsonify(t.json()), 200
 
+    @login_required
+    @require_scopes("edit-tag")
+    @requires_role("admins")
+    def patch(self):
+        """Grant or revoke permissions of multiple tags.
+
+        ---
+        summary: Bulk edit tag permissions
+        description: |
+          Grant or revoke the tagger and untagger permissions of multiple tags
+          in single transaction.
+        requestBody:
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  tags:
+                    type: array of string
+                    description: |
+                      `Required`. Names of the tags to change.
+                  actions:
+                    type: array of object
+                    description: |
+                      `Required`. List of the permission changes applied to
+                      all the tags in the given order. Each change is an object
+                      with the ``action`` and the ``username`` or ``group``, the
+                      same as in the edit tag API, for example
+                      ``{"action": "add_tagger", "group": "qe"}``.
+                  user_data:
+                    type: string
+                    description: |
+                      Optional data stored in the tag change history for these
+                      tag changes.
+        responses:
+          200:
+            description: |
+              Tags updated. The changed tags and the number of permissions
+              which have been actually granted or revoked are returned.
+            content:
+              application/json:
+                schema:
+                  type: object
+                  properties:
+                    items:
+                      type: array of TagSchema
+                    changes:
+                      type: integer
+          400:
+            description: Request not in valid format.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+          401:
+            description: User is unathorized.
+            content:
+              text/html:
+                schema:
+                  type: string
+          403:
+            description: User is not allowed to edit tags.
+            content:
+              application/json:
+                schema: HTTPErrorSchema
+        """
+        data = request.get_json(force=True)
+        if not data:
+            raise ValueError("No JSON PATCH data submitted.")
+
+        tag_names = data.get("tags", None)
+        if not tag_names or not isinstance(tag_names, list):
+            raise ValueError('"tags" must be a non-empty list of tag names.')
+        tags = Tag.query.filter(Tag.name.in_(tag_names)).order_by(Tag.id).all()
+        missing = set(tag_names) - {t.name for t in tags}
+        if missing:
+            raise ValueError('Tag "%s" does not exist' % sorted(missing)[0])
+
+        actions = data.get("actions", None)
+        if not actions or not isinstance(actions, list):
+            raise ValueError('"actions" must be a non-empty list.')
+        for action in actions:
+            if not isinstance(action, dict) or action.get("action") not in [
+                "add_tagger",
+                "remove_tagger",
+                "add_untagger",
+                "remove_untagger",
+            ]:
+                raise ValueError("Unknown action.")
+            if not action.get("username") and not action.get("group"):
+                raise ValueError('Either "username" or "group" should be defined.')
+
+        tag_ids = [t.id for t in tags]
+        changes = Tag.bulk_change_permissions(
+            db.session,
+            g.user.username,
+            tags,
+            actions,
+            user_data=data.get("user_data", None),
+        )
+        db.session.commit()
+        # The commit expires the tags, so load them again together with the
+        # changed permissions of all of them at once.
+        tags = (
+            Tag.with_permissions(Tag.query.filter(Tag.id.in_(tag_ids)))
+            .order_by(Tag.id)
+            .populate_existing()
+            .all()
+        )
+        return jsonify({"items": [t.json() for t in tags], "changes": changes}), 200
+
 
 class TagDetailAPI(MethodView):
+    read_replica = True
+
     def get(self, id):
         """Return tag.
 
@@ -849,22 +1741,32 @@ class TagDetailAPI(MethodView):
               type: integer or string
             required: true
             description: Numeric ID of the tag or string of tag name to get
+          - name: fields
+            in: query
+            schema:
+              type: string
+            required: false
+            description: |
+              Comma separated list of the returned tag fields. All the fields
+              are returned by default.
         responses:
           200:
             content:
               application/json:
                 schema: TagSchema
+          400:
+            content:
+              application/json:
+                schema: HTTPErrorSchema
           404:
             content:
               application/json:
                 schema: HTTPErrorSchema
         """
-        if id.isdigit():
-            tag = Tag.query.filter_by(id=id).first()
-        else:
-            tag = Tag.query.filter_by(name=id).first()
+        fields = tag_fields(request)
+        tag = get_tag(id)
         if tag:
-            return jsonify(tag.json()), 200
+            return jsonify({f: tag[f] for f in fields}), 200
         else:
             raise NotFound("No such tag found.")
 
@@ -969,6 +1871,16 @@ class TagDetailAPI(MethodView):
         if documentation:
             t.documentation = documentation
 
+        if db.session.is_modified(t):
+            TagChange.create(
+                db.session,
+                t,
+                g.user.username,
+                action="updated",
+                message="Tag name, description or documentation updated.",
+                user_data=data.get("user_data", None),
+            )
+
         action = data.get("action", None)
         if action:
             if action not in [
@@ -999,12 +1911,16 @@ class TagDetailAPI(MethodView):
 
 
 class TagChangesAPI(MethodView):
+    read_replica = True
+
     def get(self, id):
         """Returns tag change history.
 
         ---
         summary: Get tag changes
-        description: Get tag changes
+        description: |
+          Get tag changes ordered by time. The changes are paginated, the
+          `meta.next` contains the URL of the next page or null.
         parameters:
           - name: id
             in: path
@@ -1012,6 +1928,52 @@ class TagChangesAPI(MethodView):
               type: integer or string
             required: true
             description: Numeric tag id or string of tag name
+          - name: since
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Return only changes done at this time or later, for example "2020-05-17T10:00:00Z".
+          - name: until
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Return only changes done before this time.
+          - name: action
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Return only changes with this action. Can be repeated.
+          - name: user
+            in: query
+            schema:
+              type: string
+            required: false
+            description: Return only changes done by this user.
+          - name: limit
+            in: query
+            schema:
+              type: integer
+            required: false
+            description: Maximum number of changes returned, 100 by default, 1000 at most.
+          - name: after
+            in: query
+            schema:
+              type: integer
+            required: false
+            description: |
+              Return the changes following the change with this ID. Use the
+              `meta.next` URL to get the next page instead of setting it directly.
+          - name: format
+            in: query
+            schema:
+              type: string
+            required: false
+            description: |
+              Set to "compact" to return only the `id`, `time`, `action`, `user`
+              and `user_data` of changes, without the generated `message`.
         responses:
           200:
             description: Tag changes are returned.
@@ -1031,10 +1993,13 @@ class TagChangesAPI(MethodView):
         if not tag:
             raise NotFound("No such tag found.")
 
-        return jsonify({"changes": [c.json() for c in tag.changes]}), 200
+        query = TagChange.query.filter_by(tag_id=tag.id)
+        return _changes_response(TagChange, query)
 
 
 class RepoAPI(MethodView):
+    read_replica = True
+
     def get(self, id):
         """Returns content of repofile.
 
@@ -1165,7 +2130,7 @@ class UserInfoAPI(MethodView):
         is_allowed_builder = has_role("allowed_builders")
         is_tagger_of = []
         is_untagger_of = []
-        for t in Tag.query.all():
+        for t in tag_catalogue.tags(db.session):
             if in_edit_compose_scope and (is_admin or is_tagger(g.user, g.groups, t)):
                 is_tagger_of.append(t.name)
             if in_edit_compose_scope and (is_admin or is_untagger(g.user, g.groups, t)):
@@ -1206,10 +2171,24 @@ def register_api_v1():
         "composes": {
             "url": "/api/1/composes/",
             "options": {
-                "methods": ["GET", "POST"],
+                "methods": ["GET", "POST", "PATCH"],
             },
             "view_class": ComposesListAPI,
         },
+        "composeslatest": {
+            "url": "/api/1/composes/latest/",
+            "options": {
+                "methods": ["GET"],
+            },
+            "view_class": ComposesLatestAPI,
+        },
+        "composefacets": {
+            "url": "/api/1/composes/facets/",
+            "options": {
+                "methods": ["GET"],
+            },
+            "view_class": ComposeFacetsAPI,
+        },
         "composedetail": {
             "url": "/api/1/composes/<id>",
             "options": {
@@ -1224,10 +2203,45 @@ def register_api_v1():
             },
             "view_class": ComposeChangesAPI,
         },
+        "composeancestors": {
+            "url": "/api/1/composes/<id>/ancestors/",
+            "options": {
+                "methods": ["GET"],
+            },
+            "view_class": ComposeAncestorsAPI,
+        },
+        "composedescendants": {
+            "url": "/api/1/composes/<id>/descendants/",
+            "options": {
+                "methods": ["GET"],
+            },
+            "view_class": ComposeDescendantsAPI,
+        },
+        "composerespins": {
+            "url": "/api/1/composes/<id>/respins/",
+            "options": {
+                "methods": ["GET"],
+            },
+            "view_class": ComposeRespinsAPI,
+        },
+        "changes": {
+            "url": "/api/1/changes/",
+            "options": {
+                "methods": ["GET"],
+            },
+            "view_class": ChangesFeedAPI,
+        },
+        "events": {
+            "url": "/api/1/events/",
+            "options": {
+                "methods": ["GET"],
+            },
+            "view_class": EventStreamAPI,
+        },
         "tags": {
             "url": "/api/1/tags/",
             "options": {
-                "methods": ["GET", "POST"],
+                "methods": ["GET", "POST", "PATCH"],
             },
             "view_class": TagsListAPI,
         },
@@ -1262,6 +2276,13 @@ def register_api_v1():
             "options": {"methods": ["GET"]},
             "view_class": MetricsAPI,
         },
+        "slowqueries": {
+            "url": "/api/1/slow-queries/",
+            "options": {
+                "methods": ["GET"],
+            },
+            "view_class": SlowQueriesAPI,
+        },
         "about": {
             "url": "/api/1/about/",
             "options": {"methods": ["GET"]},
@@ -42,7 +42,7 @@ setup(
     author_email="cts-owner@fedoraproject.org",
     url="https://pagure.io/cts/",
     license="MIT",
-    packages=find_packages(exclude=["tests", "tests.*"]),
+    packages=find_packages(exclude=["tests", "tests.*", "benchmarks", "benchmarks.*"]),
     include_package_data=True,
     zip_safe=False,
     install_requires=install_requires,
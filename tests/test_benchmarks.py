@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from cts import app, db
+from cts.models import Compose, ComposeChange, Tag, tags_to_composes
+
+from benchmarks.generator import populate
+from benchmarks.runner import compare_results, percentile, run_scenario
+from benchmarks.scenarios import SCENARIOS
+from utils import ModelsBaseTest
+
+
+class TestBenchmarks(ModelsBaseTest):
+    def test_populate(self):
+        dataset = populate(db.session, composes=200, tags=10, seed=1)
+        self.assertEqual(Compose.query.count(), 200)
+        self.assertEqual(Tag.query.count(), 10)
+        self.assertEqual(
+            db.session.query(tags_to_composes).count(), len(dataset.tagged)
+        )
+        self.assertEqual(ComposeChange.query.filter_by(action="created").count(), 200)
+        self.assertTrue(Compose.query.filter(Compose.respin_of_id.isnot(None)).count())
+        self.assertEqual(
+            sorted(dataset.compose_ids),
+            [c.id for c in Compose.query.order_by(Compose.id)],
+        )
+
+    def test_scenarios(self):
+        dataset = populate(db.session, composes=50, tags=5, seed=1)
+        db.session.remove()
+        client = app.test_client()
+        for scenario in SCENARIOS:
+            result = run_scenario(client, scenario, dataset, requests=2, warmup=1)
+            self.assertEqual(result["errors"], 0, scenario.__name__)
+            self.assertGreaterEqual(result["statements"], 1)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 90), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_compare_results(self):
+        base = {
+            "scenario": "detail",
+            "errors": 0,
+            "p50_ms": 10.0,
+            "p90_ms": 20.0,
+            "statements": 5.0,
+        }
+        result = dict(base, p50_ms=11.0, statements=7.0)
+        self.assertEqual(
+            compare_results([result], [base], max_regression=0.25),
+            ["detail: statements 7.00 > 5.00"],
+        )
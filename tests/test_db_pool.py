@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+import cts.replicas
+from cts import app, conf, db
+from cts.db_pool import MeteredQueuePool, _set_statement_timeout, engine_options
+from cts.metrics import (
+    db_pool_checked_out,
+    db_pool_checkout_wait,
+    db_pool_overflow,
+    init_pool_metrics,
+)
+
+
+class TestDBPool(unittest.TestCase):
+    def test_engine_options(self):
+        self.assertEqual(
+            engine_options(conf, "sqlite://"),
+            {"pool_pre_ping": False, "pool_recycle": -1},
+        )
+        self.assertEqual(
+            engine_options(conf, "postgresql://cts@localhost/cts", {"pool_size": 20}),
+            {
+                "pool_pre_ping": False,
+                "pool_recycle": -1,
+                "poolclass": MeteredQueuePool,
+                "pool_size": 20,
+                "max_overflow": 10,
+                "pool_timeout": 30.0,
+            },
+        )
+
+    def test_primary_engine_options(self):
+        url = make_url("postgresql://cts@localhost/cts")
+        sa_url, options = db.apply_driver_hacks(app, url, {})
+        self.assertEqual(sa_url, url)
+        self.assertEqual(options, engine_options(conf, url))
+
+    def test_replica_engine_options(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        uri = "sqlite:///%s" % os.path.join(tmpdir, "replica.db")
+        with patch.object(cts.replicas, "replica_engines", new=[]), patch.dict(
+            app.config, {"SQLALCHEMY_ENGINE_OPTIONS": {"pool_recycle": 60}}
+        ):
+            cts.replicas.create_replica_engines(app, [uri])
+            engine = cts.replicas.replica_engines[0]
+        self.addCleanup(engine.dispose)
+        # The SQLALCHEMY_ENGINE_OPTIONS are used for the replicas too.
+        self.assertEqual(engine.pool._recycle, 60)
+
+    def _sample(self, metric, name, database="test"):
+        for sample in metric.collect()[0].samples:
+            if sample.name == name and sample.labels == {"database": database}:
+                return sample.value
+        return 0
+
+    def test_pool_metrics_primary(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        name = "db_pool_checked_out_connections"
+        before = self._sample(db_pool_checked_out, name, "primary")
+        # The engine is created again when the SQLALCHEMY_DATABASE_URI changes.
+        engine = db.create_engine(
+            make_url("sqlite:///%s" % os.path.join(tmpdir, "test.db")), {}
+        )
+        self.addCleanup(engine.dispose)
+        with engine.connect():
+            self.assertEqual(
+                self._sample(db_pool_checked_out, name, "primary"), before + 1
+            )
+
+    def test_pool_metrics(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        engine = create_engine(
+            "sqlite:///%s" % os.path.join(tmpdir, "test.db"),
+            poolclass=MeteredQueuePool,
+            pool_size=1,
+            max_overflow=1,
+        )
+        self.addCleanup(engine.dispose)
+        init_pool_metrics(engine, "test")
+
+        conn1 = engine.connect()
+        conn2 = engine.connect()
+        self.assertEqual(
+            self._sample(db_pool_checked_out, "db_pool_checked_out_connections"), 2
+        )
+        self.assertEqual(
+            self._sample(db_pool_overflow, "db_pool_overflow_connections"), 1
+        )
+        self.assertEqual(
+            self._sample(db_pool_checkout_wait, "db_pool_checkout_wait_seconds_count"),
+            2,
+        )
+
+        conn2.close()
+        conn1.close()
+        self.assertEqual(
+            self._sample(db_pool_checked_out, "db_pool_checked_out_connections"), 0
+        )
+        self.assertEqual(
+            self._sample(db_pool_overflow, "db_pool_overflow_connections"), 0
+        )
+
+    def test_statement_timeout(self):
+        connection = Mock()
+        connection.dialect.name = "postgresql"
+        with patch.object(conf, "database_statement_timeout", new=1.5):
+            _set_statement_timeout(None, None, connection)
+            connection.exec_driver_sql.assert_not_called()
+
+            with app.test_request_context():
+                _set_statement_timeout(None, None, connection)
+            connection.exec_driver_sql.assert_called_once_with(
+                "SET LOCAL statement_timeout = 1500"
+            )
+
+    def test_statement_timeout_disabled(self):
+        connection = Mock()
+        connection.dialect.name = "postgresql"
+        with app.test_request_context():
+            _set_statement_timeout(None, None, connection)
+            connection.dialect.name = "sqlite"
+            with patch.object(conf, "database_statement_timeout", new=1.5):
+                _set_statement_timeout(None, None, connection)
+        connection.exec_driver_sql.assert_not_called()
@@ -28,7 +28,7 @@ from unittest.mock import patch, ANY, call, Mock
 
 from cts import conf
 from cts import app, db
-from cts.models import Compose, User, Tag
+from cts.models import Compose, ComposeEvent, User, Tag
 from utils import ModelsBaseTest
 
 try:
@@ -197,6 +197,36 @@ class TestMessaging(ModelsBaseTest):
                 ]
             )
 
+    def test_message_compose_create_event_stored(self, publish):
+        publish.side_effect = RuntimeError("bus is down")
+        with app.app_context():
+            flask.g.user = Mock(username="odcs")
+            self.ci.compose.respin += 1
+            compose = Compose.create(db.session, "odcs", self.ci)[0]
+
+            # The event is committed with the compose, even when the message
+            # cannot be sent.
+            event = ComposeEvent.query.order_by(ComposeEvent.id.desc()).first()
+            self.assertEqual(event.event, "compose-created")
+            self.assertEqual(event.compose_id, compose.id)
+            self.assertEqual(json.loads(event.message)["compose"], compose.json())
+
+    def test_message_compose_create_respin_conflict(self, publish):
+        with app.app_context():
+            flask.g.user = Mock(username="odcs")
+            compose = Compose.create(db.session, "odcs", self.ci)[0]
+
+            self.assertEqual(compose.id, "Fedora-Rawhide-20200517.n.2")
+            publish.assert_called_once_with(
+                [
+                    {
+                        "event": "compose-created",
+                        "agent": "odcs",
+                        "compose": compose.json(),
+                    }
+                ]
+            )
+
     def test_message_compose_tag(self, publish):
         with app.app_context():
             flask.g.user = Mock(username="odcs")
@@ -231,6 +261,20 @@ class TestMessaging(ModelsBaseTest):
         )
         self.assertEqual(publish.mock_calls[1], expected_call)
 
+    def test_message_compose_retag(self, publish):
+        with app.app_context():
+            flask.g.user = Mock(username="odcs")
+            self.compose.tag("odcs", "periodic")
+            db.session.commit()
+            self.compose.tag("odcs", "periodic")
+            db.session.commit()
+            self.compose.untag("odcs", "nightly")
+            db.session.commit()
+
+        # Only the first tagging changed the compose.
+        self.assertEqual(len(publish.mock_calls), 1)
+        self.assertEqual(publish.mock_calls[0][1][0][0]["event"], "compose-tagged")
+
     def test_message_compose_untag(self, publish):
         with app.app_context():
             flask.g.user = Mock(username="odcs")
@@ -270,7 +314,48 @@ class TestMessaging(ModelsBaseTest):
         )
         self.assertEqual(publish.mock_calls[3], expected_call)
 
-    def test_retag_stale_composes(self, publish):
+    def test_message_compose_bulk_tag(self, publish):
+        with app.app_context():
+            flask.g.user = Mock(username="odcs")
+            self.ci.compose.respin += 1
+            compose = Compose.create(db.session, "odcs", self.ci)[0]
+            publish.reset_mock()
+
+            tag = Tag.get_by_name("periodic")
+            Compose.bulk_tag(db.session, "odcs", tag, Compose.query, "bulk")
+            db.session.commit()
+
+            publish.assert_called_once_with(
+                [
+                    {
+                        "event": "compose-tagged",
+                        "tag": "periodic",
+                        "compose": self.compose.json(),
+                        "agent": "odcs",
+                        "user_data": "bulk",
+                    },
+                    {
+                        "event": "compose-tagged",
+                        "tag": "periodic",
+                        "compose": compose.json(),
+                        "agent": "odcs",
+                        "user_data": "bulk",
+                    },
+                ]
+            )
+            self.assertEqual(compose.json()["tags"], ["periodic"])
+
+            publish.reset_mock()
+            Compose.bulk_untag(db.session, "odcs", tag, Compose.query)
+            db.session.commit()
+
+            msgs = publish.call_args[0][0]
+            self.assertEqual(
+                [(m["event"], m["compose"]["tags"]) for m in msgs],
+                [("compose-untagged", []), ("compose-untagged", [])],
+            )
+
+    def test_retag_stale_requested_tags(self, publish):
         import datetime
         from freezegun import freeze_time
 
@@ -287,64 +372,35 @@ class TestMessaging(ModelsBaseTest):
             freezer.stop()
 
             # Retag only the -requested tags when 1 hour timeout occurs
-            timeout = datetime.timedelta(hours=1)
+            older_than = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
             self.compose.tag("odcs", "development-nightly-requested")
             db.session.commit()
-            retags = [x for x in self.compose.retag_stale_composes("odcs", timeout)]
-
-        # There should be 3 retagging check for all requested tag, nightly-requested, candidate-requested, development-nightly-requested
-        self.assertEqual(len(retags), 3)
-
-        expected_call = call(
-            [
-                {
-                    "event": "compose-untagged",
-                    "tag": "nightly-requested",
-                    "compose": ANY,
-                    "user_data": None,
-                    "agent": "odcs",
-                }
-            ]
-        )
-        self.assertEqual(publish.mock_calls[4], expected_call)
-
-        expected_call = call(
-            [
-                {
-                    "event": "compose-tagged",
-                    "tag": "nightly-requested",
-                    "compose": ANY,
-                    "user_data": None,
-                    "agent": "odcs",
-                }
-            ]
-        )
-        self.assertEqual(publish.mock_calls[5], expected_call)
+            retags = list(
+                Compose.retag_stale_requested_tags(
+                    db.session, "odcs", older_than, batch_size=1
+                )
+            )
 
-        expected_call = call(
-            [
-                {
-                    "event": "compose-untagged",
-                    "tag": "candidate-requested",
-                    "compose": ANY,
-                    "user_data": None,
-                    "agent": "odcs",
-                }
-            ]
+        # Only the nightly-requested and candidate-requested are stale.
+        self.assertEqual(
+            [tag.name for _, tag in retags],
+            ["nightly-requested", "candidate-requested"],
         )
-        self.assertEqual(publish.mock_calls[6], expected_call)
 
-        expected_call = call(
-            [
-                {
-                    "event": "compose-tagged",
-                    "tag": "candidate-requested",
-                    "compose": ANY,
-                    "user_data": None,
-                    "agent": "odcs",
-                }
-            ]
-        )
-        self.assertEqual(publish.mock_calls[7], expected_call)
-        # There should be 8 mock calls, since timeout is not occured for development-nightly-requested compose and nightly compose is not retagged
-        self.assertEqual(len(publish.mock_calls), 8)
+        # Each tag is removed and added again in single transaction.
+        for i, tag in [(4, "nightly-requested"), (5, "candidate-requested")]:
+            expected_call = call(
+                [
+                    {
+                        "event": event,
+                        "tag": tag,
+                        "compose": ANY,
+                        "user_data": None,
+                        "agent": "odcs",
+                    }
+                    for event in ["compose-untagged", "compose-tagged"]
+                ]
+            )
+            self.assertEqual(publish.mock_calls[i], expected_call)
+        # The development-nightly-requested and nightly are not retagged.
+        self.assertEqual(len(publish.mock_calls), 6)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.mmap_dict import MmapedDict
+
+from cts.metrics import (
+    ArchivedMultiProcessCollector,
+    archive_current_process_metrics,
+    archive_process_metrics,
+)
+
+
+class TestArchiveProcessMetrics(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def _write(self, filename, name, value):
+        key = json.dumps(["retagged", name, {"tag": "a"}, "Retagged"])
+        values = MmapedDict(os.path.join(self.path, filename))
+        values.write_value(key, value, 0)
+        values.close()
+
+    def _collect(self):
+        registry = CollectorRegistry()
+        ArchivedMultiProcessCollector(registry, path=self.path)
+        return {
+            sample.name: sample.value
+            for metric in registry.collect()
+            for sample in metric.samples
+        }
+
+    def test_archive_process_metrics(self):
+        self._write("counter_100.db", "retagged_total", 2)
+        self._write("counter_101.db", "retagged_total", 3)
+        self._write("gauge_livesum_100.db", "scheduled", 5)
+        self._write("gauge_livesum_101.db", "scheduled", 7)
+
+        archive_process_metrics(100, self.path)
+        archive_process_metrics(101, self.path)
+
+        self.assertEqual(
+            sorted(os.listdir(self.path)), ["archive.lock", "counter_archive.db"]
+        )
+        self.assertEqual(self._collect(), {"retagged_total": 5})
+
+    def test_archive_process_metrics_live_process(self):
+        self._write("counter_100.db", "retagged_total", 2)
+        self._write("counter_101.db", "retagged_total", 3)
+        self._write("gauge_livesum_101.db", "scheduled", 7)
+
+        archive_process_metrics(100, self.path)
+
+        self.assertEqual(self._collect(), {"retagged_total": 5, "scheduled": 7})
+
+    def test_archive_current_process_metrics_forked(self):
+        # The file of the parent process, which is still running.
+        self._write("counter_%d.db" % os.getpid(), "retagged_total", 2)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self._write("counter_%d.db" % os.getpid(), "retagged_total", 3)
+                archive_current_process_metrics(self.path)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(
+            sorted(os.listdir(self.path)),
+            ["archive.lock", "counter_%d.db" % os.getpid(), "counter_archive.db"],
+        )
+        self.assertEqual(self._collect(), {"retagged_total": 5})
@@ -20,10 +20,24 @@
 #
 # Written by Jan Kaluza <jkaluza@redhat.com>
 
-from unittest.mock import ANY
+from datetime import datetime, timedelta
+from unittest.mock import ANY, Mock, patch
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
 
 from cts import db
-from cts.models import User, Compose, Tag
+from cts.models import (
+    User,
+    Compose,
+    ComposeChange,
+    Tag,
+    TagChange,
+    lock_change_ids,
+    tag_compose_counts,
+    tags_to_composes,
+)
+from cts.tag_catalogue import tag_catalogue
 
 from utils import ModelsBaseTest
 
@@ -96,6 +110,35 @@ class TestComposeModel(ModelsBaseTest):
         self.assertEqual(compose.respin, 2)
         self.assertEqual(ci.compose.respin, 2)
 
+    def test_create_single_commit(self):
+        User.create_user(username="odcs")
+        db.session.commit()
+
+        commits = []
+
+        def on_commit(session):
+            # Ignore the SAVEPOINT releases.
+            if not session.in_nested_transaction():
+                commits.append(session)
+
+        event.listen(SignallingSession, "after_commit", on_commit)
+        try:
+            Compose.create(db.session, "odcs", self.ci)
+            # Second compose hits the compose ID conflict and is retried.
+            Compose.create(db.session, "odcs", self.ci, user_data="foo")
+        finally:
+            event.remove(SignallingSession, "after_commit", on_commit)
+
+        self.assertEqual(len(commits), 2)
+        changes = ComposeChange.query.order_by(ComposeChange.id).all()
+        self.assertEqual(
+            [(c.compose_id, c.action, c.user_data) for c in changes],
+            [
+                ("Fedora-Rawhide-20200517.n.1", "created", None),
+                ("Fedora-Rawhide-20200517.n.2", "created", "foo"),
+            ],
+        )
+
     def test_create_parent_compose_ids(self):
         # Create for first time
         User.create_user(username="odcs")
@@ -210,6 +253,88 @@ class TestTagModel(ModelsBaseTest):
         t.add_tagger("admin", "me")
         db.session.commit()
 
+    def test_create_single_commit(self):
+        commits = []
+        statements = []
+
+        def on_commit(session):
+            if not session.in_nested_transaction():
+                commits.append(session)
+
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("INSERT INTO tag_changes"):
+                statements.append(executemany)
+
+        event.listen(SignallingSession, "after_commit", on_commit)
+        event.listen(db.engine, "before_cursor_execute", on_execute)
+        try:
+            t = Tag.create(
+                db.session,
+                "admin",
+                name="weekly",
+                description="Weekly",
+                documentation="http://localhost/",
+            )
+            t.add_tagger("admin", "me")
+            t.add_untagger("admin", "you")
+            db.session.commit()
+        finally:
+            event.remove(SignallingSession, "after_commit", on_commit)
+            event.remove(db.engine, "before_cursor_execute", on_execute)
+
+        self.assertEqual(len(commits), 2)
+        # The tagger and untagger changes are inserted together.
+        self.assertEqual(statements, [False, True])
+        changes = TagChange.query.filter_by(tag_id=t.id).order_by(TagChange.id)
+        self.assertEqual(
+            [c.action for c in changes],
+            ["created", "add_tagger", "add_untagger"],
+        )
+
+    def test_audit_records_rollback(self):
+        t = Tag.get_by_name("periodic")
+        t.remove_tagger("admin", username="me")
+        db.session.rollback()
+        db.session.commit()
+
+        t = Tag.get_by_name("periodic")
+        self.assertEqual(t.taggers, [self.me, self.you])
+        self.assertEqual(TagChange.query.filter_by(action="remove_tagger").count(), 0)
+
+    def test_lock_change_ids(self):
+        session = Mock()
+        lock_change_ids(session)
+        session.execute.assert_not_called()
+
+        with patch.object(db.engine.dialect, "name", new="postgresql"):
+            lock_change_ids(session)
+        statement = session.execute.call_args[0][0]
+        self.assertIn("pg_advisory_xact_lock", str(statement))
+
+    def test_audit_records_savepoint_rollback(self):
+        t = Tag.get_by_name("periodic")
+        t.remove_tagger("admin", username="me")
+        # The rollback of the savepoint keeps the records added before it.
+        savepoint = db.session.begin_nested()
+        db.session.flush()
+        savepoint.rollback()
+        db.session.commit()
+
+        self.assertEqual(TagChange.query.filter_by(action="remove_tagger").count(), 1)
+
+    def test_audit_records_savepoint_rollback_discards_savepoint(self):
+        t = Tag.get_by_name("periodic")
+        t.remove_tagger("admin", username="me")
+        changes = TagChange.query.count()
+        # The records added in the rolled back savepoint are discarded.
+        savepoint = db.session.begin_nested()
+        TagChange.create(db.session, t, "admin", action="add_untagger")
+        savepoint.rollback()
+        db.session.commit()
+
+        self.assertEqual(TagChange.query.filter_by(action="remove_tagger").count(), 1)
+        self.assertEqual(TagChange.query.count(), changes + 1)
+
     def test_add_remove_tagger(self):
         t = Tag.get_by_name("periodic")
         self.assertEqual(t.taggers, [self.me, self.you])
@@ -427,8 +552,210 @@ class TestTagModel(ModelsBaseTest):
                 "user_data": None,
             },
         ]
+        # The ComposeChange records are written on commit.
+        self.assertEqual(len(self.compose.changes), 2)
+        db.session.commit()
         compose_changes = [change.json() for change in self.compose.changes]
         self.assertEqual(compose_changes, expected_compose_changes)
+        periodic = Tag.get_by_name("periodic")
+        self.assertEqual(
+            [change.tag_id for change in self.compose.changes],
+            [None, periodic.id, periodic.id],
+        )
+
+    def test_tag_catalogue(self):
+        tag = tag_catalogue.get_by_name(db.session, "periodic")
+        self.assertEqual(tag.taggers, {"me", "you"})
+        self.assertEqual(tag.untaggers, {"me"})
+        self.assertEqual(tag_catalogue.get_by_id(db.session, tag.id), tag)
+        self.assertEqual(tag_catalogue.get_by_name(db.session, "foo"), None)
+
+        # Changes done by this process invalidate the catalogue.
+        Tag.get_by_name("periodic").add_tagger("admin", group="devel")
+        db.session.commit()
+        tag = tag_catalogue.get_by_name(db.session, "periodic")
+        self.assertEqual(tag.tagger_groups, {"devel"})
+
+        # Changes done by other processes are found by the TagChange ID.
+        with db.engine.begin() as conn:
+            conn.execute(
+                Tag.__table__.update()
+                .where(Tag.__table__.c.id == tag.id)
+                .values(name="weekly")
+            )
+            conn.execute(
+                TagChange.__table__.insert(),
+                {"time": datetime.utcnow(), "tag_id": tag.id, "user_id": 1},
+            )
+        self.assertEqual(tag_catalogue.get_by_name(db.session, "periodic"), None)
+        self.assertEqual(
+            [t.name for t in tag_catalogue.tags(db.session)], ["weekly", "nightly"]
+        )
+
+    def test_tag_catalogue_out_of_order(self):
+        tag = tag_catalogue.get_by_name(db.session, "periodic")
+        last_id = TagChange.version(db.session)[1]
+
+        def change_tag(id, name):
+            with db.engine.begin() as conn:
+                conn.execute(
+                    Tag.__table__.update()
+                    .where(Tag.__table__.c.id == tag.id)
+                    .values(name=name)
+                )
+                conn.execute(
+                    TagChange.__table__.insert(),
+                    {
+                        "id": id,
+                        "time": datetime.utcnow(),
+                        "tag_id": tag.id,
+                        "user_id": 1,
+                    },
+                )
+
+        change_tag(last_id + 2, "weekly")
+        self.assertEqual(tag_catalogue.get_by_id(db.session, tag.id).name, "weekly")
+        # The change with lower ID committed later is found too.
+        change_tag(last_id + 1, "daily")
+        self.assertEqual(tag_catalogue.get_by_id(db.session, tag.id).name, "daily")
+
+    def test_compose_counts(self):
+        self.ci.compose.respin += 1
+        other = Compose.create(db.session, "odcs", self.ci)[0]
+        db.session.commit()
+
+        self.compose.tag("odcs", "periodic")
+        self.compose.tag("odcs", "periodic")
+        self.compose.tag("odcs", "nightly")
+        db.session.commit()
+        self.assertEqual(
+            Tag.compose_counts(db.session), [("nightly", 1), ("periodic", 1)]
+        )
+
+        periodic = Tag.get_by_name("periodic")
+        # The already tagged compose is neither returned nor counted.
+        tagged = Compose.bulk_tag(db.session, "odcs", periodic, Compose.query)
+        db.session.commit()
+        self.assertEqual(tagged, [other.id])
+        self.assertEqual(
+            Tag.compose_counts(db.session), [("nightly", 1), ("periodic", 2)]
+        )
+        self.assertEqual(ComposeChange.query.filter_by(tag_id=periodic.id).count(), 2)
+
+        other.untag("odcs", "nightly")
+        untagged = Compose.bulk_untag(db.session, "odcs", periodic, Compose.query)
+        db.session.commit()
+        self.assertEqual(untagged, [self.compose.id, other.id])
+        self.assertEqual(
+            Tag.compose_counts(db.session), [("nightly", 1), ("periodic", 0)]
+        )
+
+    def test_compose_counts_on_commit(self):
+        self.compose.tag("odcs", "periodic")
+        self.compose.untag("odcs", "periodic")
+        self.compose.tag("odcs", "nightly")
+        # The counts are written only on commit and the zero deltas are not
+        # written at all.
+        self.assertEqual(Tag.compose_counts(db.session), [])
+        db.session.commit()
+        self.assertEqual(Tag.compose_counts(db.session), [("nightly", 1)])
+
+        self.compose.untag("odcs", "nightly")
+        db.session.rollback()
+        db.session.commit()
+        self.assertEqual(Tag.compose_counts(db.session), [("nightly", 1)])
+
+    def test_reconcile_compose_counts(self):
+        self.compose.tag("odcs", "periodic")
+        db.session.commit()
+        db.session.execute(tag_compose_counts.update().values(composes=10))
+
+        Tag.reconcile_compose_counts(db.session)
+        db.session.commit()
+        self.assertEqual(Tag.compose_counts(db.session), [("periodic", 1)])
+
+    def test_retag_stale_requested_tags(self):
+        self.ci.compose.respin += 1
+        compose2 = Compose.create(db.session, "odcs", self.ci)[0]
+        t = Tag.create(
+            db.session,
+            "admin",
+            name="nightly-requested",
+            description="Nightly requested",
+            documentation="http://localhost/",
+        )
+        db.session.commit()
+        for compose in [self.compose, compose2]:
+            compose.tag("odcs", "nightly-requested")
+            compose.tag("odcs", "periodic")
+        db.session.commit()
+        # Only the first compose is stale.
+        for change in self.compose.changes:
+            change.time = datetime.utcnow() - timedelta(hours=2)
+        db.session.commit()
+
+        older_than = datetime.utcnow() - timedelta(hours=1)
+        stale = Compose.stale_requested_tags(db.session, older_than).all()
+        self.assertEqual(stale, [(self.compose.id, t.id)])
+
+        # Both are stale now.
+        older_than = datetime.utcnow() + timedelta(hours=1)
+        retagged = list(
+            Compose.retag_stale_requested_tags(
+                db.session, "odcs", older_than, batch_size=1
+            )
+        )
+        self.assertEqual(
+            [(compose_id, tag.id) for compose_id, tag in retagged],
+            [(self.compose.id, t.id), (compose2.id, t.id)],
+        )
+
+        changes = (
+            ComposeChange.query.filter_by(tag_id=t.id).order_by(ComposeChange.id).all()
+        )
+        self.assertEqual(
+            [(c.compose_id, c.action) for c in changes],
+            [
+                (self.compose.id, "tagged"),
+                (compose2.id, "tagged"),
+                (self.compose.id, "untagged"),
+                (self.compose.id, "tagged"),
+                (compose2.id, "untagged"),
+                (compose2.id, "tagged"),
+            ],
+        )
+        self.assertEqual(len(self.compose.tags), 2)
+        self.assertEqual(len(compose2.tags), 2)
+
+    def test_compose_tagging_concurrent(self):
+        # Load the tags, so the Compose does not know about the tag added
+        # by another request below.
+        self.assertEqual(self.compose.tags, [])
+        periodic = Tag.get_by_name("periodic")
+        db.session.execute(
+            tags_to_composes.insert().values(
+                compose_id=self.compose.id, tag_id=periodic.id
+            )
+        )
+
+        ret = self.compose.tag("odcs", "periodic")
+        db.session.commit()
+        self.assertEqual(ret, True)
+        self.assertEqual(self.compose.tags, [periodic])
+
+        # Remove the tag by another request and try to untag it again.
+        db.session.execute(
+            tags_to_composes.delete().where(
+                tags_to_composes.c.compose_id == self.compose.id
+            )
+        )
+        ret = self.compose.untag("odcs", "periodic")
+        db.session.commit()
+        self.assertEqual(ret, True)
+        self.assertEqual(self.compose.tags, [])
+
+        # No ComposeChange is added when nothing changed.
+        self.assertEqual([c.action for c in self.compose.changes], ["created"])
 
 
 class TestUserModel(ModelsBaseTest):
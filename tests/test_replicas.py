@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+
+import cts.replicas
+from cts import app, db
+from cts.models import Compose, User
+from cts.replicas import STICKY_COOKIE, STICKY_HEADER, using_primary
+
+from test_views import ViewBaseTest
+
+
+class TestReplicas(ViewBaseTest):
+    """
+    Uses empty SQLite database as the replica, so the requests routed to the
+    replica do not find the compose stored in the primary database.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.replica = create_engine(
+            "sqlite:///%s" % os.path.join(self.tmpdir, "replica.db")
+        )
+        db.metadata.create_all(self.replica)
+        self.patch_replicas = patch.object(
+            cts.replicas, "replica_engines", new=[self.replica]
+        )
+        self.patch_replicas.start()
+        super(TestReplicas, self).setUp()
+
+    def tearDown(self):
+        super(TestReplicas, self).tearDown()
+        self.patch_replicas.stop()
+        self.replica.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def setup_composes(self):
+        User.create_user(username="odcs")
+        Compose.create(db.session, "odcs", self.ci)
+        db.session.commit()
+
+    def test_get_from_replica(self):
+        rv = self.client.get("/api/1/composes/Fedora-Rawhide-20200517.n.1")
+        self.assertEqual(rv.status_code, 404)
+        rv = self.client.get("/api/1/composes/")
+        self.assertEqual(rv.json["items"], [])
+
+        with patch.object(cts.replicas, "replica_engines", new=[]):
+            rv = self.client.get("/api/1/composes/Fedora-Rawhide-20200517.n.1")
+        self.assertEqual(rv.status_code, 200)
+
+    def test_get_from_primary(self):
+        # The changes feed is not routed to the replicas.
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get("/api/1/changes/")
+        self.assertEqual(len(rv.json["changes"]), 1)
+
+    def test_read_your_writes(self):
+        url = "http://localhost/composes/Fedora-Rawhide-20200517.n.1"
+        with self._test_request_context(user="odcs"):
+            rv = self.client.patch(
+                "/api/1/composes/Fedora-Rawhide-20200517.n.1",
+                json={"action": "set_url", "compose_url": url},
+            )
+        self.assertEqual(rv.status_code, 200)
+        until = float(rv.headers[STICKY_HEADER])
+        self.assertGreater(until, time.time())
+        self.assertIn(STICKY_COOKIE, rv.headers["Set-Cookie"])
+
+        # The client keeping the cookie reads from the primary.
+        rv = self.client.get("/api/1/composes/Fedora-Rawhide-20200517.n.1")
+        self.assertEqual(rv.json["compose_url"], url)
+
+        # Other clients read from the replica unless they send the header.
+        client = app.test_client()
+        rv = client.get("/api/1/composes/Fedora-Rawhide-20200517.n.1")
+        self.assertEqual(rv.status_code, 404)
+        rv = client.get(
+            "/api/1/composes/Fedora-Rawhide-20200517.n.1",
+            headers={STICKY_HEADER: str(until)},
+        )
+        self.assertEqual(rv.status_code, 200)
+        rv = client.get(
+            "/api/1/composes/Fedora-Rawhide-20200517.n.1",
+            headers={STICKY_HEADER: str(time.time() - 1)},
+        )
+        self.assertEqual(rv.status_code, 404)
+
+    def test_session_reads_own_writes(self):
+        db.session.info.pop("wrote", None)
+        db.session.info["replica"] = self.replica
+        try:
+            self.assertEqual(Compose.query.count(), 0)
+            User.create_user(username="me")
+            db.session.flush()
+            self.assertEqual(Compose.query.count(), 1)
+        finally:
+            db.session.info.pop("replica", None)
+            db.session.info.pop("wrote", None)
+
+    def test_using_primary(self):
+        db.session.info.pop("wrote", None)
+        db.session.info["replica"] = self.replica
+        try:
+            with using_primary(db.session):
+                self.assertEqual(Compose.query.count(), 1)
+            self.assertEqual(Compose.query.count(), 0)
+        finally:
+            db.session.info.pop("replica", None)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cts import conf
+from cts.slow_queries import (
+    SlowQueryExplainer,
+    _explain,
+    normalize_statement,
+    parameters_shape,
+)
+
+
+class TestSlowQueries(unittest.TestCase):
+    def test_normalize_statement(self):
+        self.assertEqual(
+            normalize_statement(
+                "SELECT composes.id\nFROM composes\n"
+                "WHERE composes.id IN (?, ?, ?) AND composes.type = ?"
+            ),
+            "SELECT composes.id FROM composes "
+            "WHERE composes.id IN (...) AND composes.type = ?",
+        )
+        self.assertEqual(
+            normalize_statement(
+                "SELECT 1 WHERE id IN (%(id_1_1)s, %(id_1_2)s) AND x = %(x_1)s"
+            ),
+            "SELECT 1 WHERE id IN (...) AND x = %(x_1)s",
+        )
+
+    def test_parameters_shape(self):
+        self.assertEqual(
+            parameters_shape({"id_1": "a", "id_2": "b", "respin_1": 1}),
+            {"count": 3, "types": {"str": 2, "int": 1}},
+        )
+        self.assertEqual(parameters_shape(()), {"count": 0, "types": {}})
+        self.assertEqual(
+            parameters_shape([("a", 1), ("b", 2)], executemany=True),
+            {
+                "executemany": 2,
+                "parameters": {"count": 2, "types": {"str": 1, "int": 1}},
+            },
+        )
+
+    def _explain(self, statement):
+        engine = MagicMock()
+        dbapi_conn = engine.raw_connection.return_value
+        cursor = dbapi_conn.cursor.return_value
+        cursor.fetchall.return_value = [("Seq Scan",), ("Filter",)]
+        plan = _explain(engine, statement, {"id_1": 1})
+        return plan, dbapi_conn, cursor
+
+    def test_explain(self):
+        plan, dbapi_conn, cursor = self._explain("SELECT 1 WHERE id = %(id_1)s")
+        self.assertEqual(plan, "Seq Scan\nFilter")
+        cursor.execute.assert_called_once_with(
+            "EXPLAIN SELECT 1 WHERE id = %(id_1)s", {"id_1": 1}
+        )
+        # The transaction is rolled back.
+        dbapi_conn.rollback.assert_called_once_with()
+        dbapi_conn.close.assert_called_once_with()
+
+    @patch.object(conf, "slow_query_explain_analyze", new=True)
+    @patch.object(conf, "database_statement_timeout", new=2.0)
+    def test_explain_analyze(self):
+        plan, dbapi_conn, cursor = self._explain("SELECT 1")
+        self.assertEqual(
+            [c[0][0] for c in cursor.execute.call_args_list],
+            [
+                "SET LOCAL statement_timeout = 2000",
+                "EXPLAIN (ANALYZE, BUFFERS) SELECT 1",
+            ],
+        )
+
+    def test_explainable(self):
+        explainer = SlowQueryExplainer(1)
+        conn = MagicMock()
+        conn.dialect.name = "postgresql"
+        self.assertTrue(explainer.explainable(conn, "SELECT 1"))
+        for statement in [
+            "UPDATE composes SET state = 1",
+            "WITH deleted AS (DELETE FROM composes RETURNING id) SELECT id",
+            "SELECT id FROM composes WHERE id = 1 FOR UPDATE",
+            "SELECT id FROM composes FOR NO KEY UPDATE",
+            "SELECT id FROM composes FOR SHARE",
+        ]:
+            self.assertFalse(explainer.explainable(conn, statement))
+        conn.dialect.name = "sqlite"
+        self.assertFalse(explainer.explainable(conn, "SELECT 1"))
+
+    def test_explainer(self):
+        explainer = SlowQueryExplainer(1)
+        conn = MagicMock()
+        query = {"statement": "SELECT 1", "plan": None}
+        with patch("cts.slow_queries._explain", return_value="Result") as explain:
+            with patch.object(explainer, "_engine") as engine:
+                explainer.submit(conn, query, "SELECT 1", ())
+                explainer.join()
+        self.assertEqual(query["plan"], "Result")
+        # The connection pool of the slow query is not used.
+        engine.assert_called_once_with(conn.engine.url)
+        conn.engine.raw_connection.assert_not_called()
+        explain.assert_called_once_with(engine.return_value, "SELECT 1", ())
+
+    def test_explainer_full(self):
+        explainer = SlowQueryExplainer(1)
+        with patch.object(explainer, "_start"):
+            for i in range(2):
+                explainer.submit(MagicMock(), {"statement": "SELECT 1"}, "SELECT 1", ())
+        # The second query is not explained.
+        self.assertEqual(explainer._queue.qsize(), 1)
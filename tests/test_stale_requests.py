@@ -0,0 +1,187 @@
+# Copyright (c) 2020  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Written by Jan Kaluza <jkaluza@redhat.com>
+
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from cts import db
+from cts.models import User, Compose, ComposeChange, Tag
+from cts.stale_requests import StaleRequestsScheduler
+from utils import ModelsBaseTest
+
+
+class TestStaleRequestsScheduler(ModelsBaseTest):
+    def setup_composes(self):
+        User.create_user(username="odcs")
+        self.c1 = Compose.create(db.session, "odcs", self.ci)[0]
+        self.ci.compose.respin += 1
+        self.c2 = Compose.create(db.session, "odcs", self.ci)[0]
+        for name in ["nightly-requested", "nightly"]:
+            Tag.create(
+                db.session,
+                "odcs",
+                name=name,
+                description=name,
+                documentation="http://localhost/",
+            )
+        db.session.commit()
+        self.requested = Tag.get_by_name("nightly-requested")
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmpdir, "state.json")
+
+    def tearDown(self):
+        super(TestStaleRequestsScheduler, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def _scheduler(self):
+        return StaleRequestsScheduler(
+            db.session, "odcs", timedelta(hours=1), state_file=self.state_file
+        )
+
+    def _tag(self, compose, tag, time):
+        compose.tag("odcs", tag)
+        db.session.commit()
+        change = ComposeChange.query.order_by(ComposeChange.id.desc()).first()
+        change.time = time
+        db.session.commit()
+
+    def test_sweep(self):
+        now = datetime.utcnow()
+        self._tag(self.c1, "nightly-requested", now - timedelta(hours=2))
+        self._tag(self.c1, "nightly", now - timedelta(hours=2))
+
+        scheduler = self._scheduler()
+        scheduler.rebuild()
+        self.assertEqual(
+            scheduler.deadlines,
+            {(self.c1.id, self.requested.id): now - timedelta(hours=1)},
+        )
+
+        # The change done after rebuild is found using the watermark.
+        self._tag(self.c2, "nightly-requested", now - timedelta(minutes=30))
+
+        retagged = scheduler.sweep(now)
+        self.assertEqual(
+            [(compose_id, tag.id) for compose_id, tag in retagged],
+            [(self.c1.id, self.requested.id)],
+        )
+        self.assertEqual(
+            scheduler.deadlines,
+            {(self.c2.id, self.requested.id): now + timedelta(minutes=30)},
+        )
+        self.assertEqual(scheduler.next_deadline(), now + timedelta(minutes=30))
+        self.assertEqual(scheduler.sleep_time(3600, now), 1800)
+        self.assertEqual(scheduler.sleep_time(60, now), 60)
+
+        # The retag of c1 is scheduled by the next sweep.
+        self.assertEqual(scheduler.sweep(now), [])
+        self.assertEqual(
+            set(scheduler.deadlines),
+            {(c.id, self.requested.id) for c in [self.c1, self.c2]},
+        )
+
+    def test_sweep_untagged(self):
+        now = datetime.utcnow()
+        self._tag(self.c1, "nightly-requested", now - timedelta(hours=2))
+        scheduler = self._scheduler()
+        scheduler.rebuild()
+
+        self.c1.untag("odcs", "nightly-requested")
+        db.session.commit()
+
+        self.assertEqual(scheduler.sweep(now), [])
+        self.assertEqual(scheduler.deadlines, {})
+
+    def _add_change(self, id, compose, tag, time):
+        db.session.execute(
+            ComposeChange.__table__.insert().values(
+                id=id,
+                time=time,
+                compose_id=compose.id,
+                action="tagged",
+                user_id=User.find_user_by_name("odcs").id,
+                tag_id=Tag.get_by_name(tag).id,
+            )
+        )
+        db.session.commit()
+
+    def test_sweep_out_of_order(self):
+        now = datetime.utcnow()
+        scheduler = self._scheduler()
+        scheduler.rebuild()
+        watermark = scheduler.watermark
+        self.assertEqual(scheduler.gaps, {})
+
+        # The change with higher ID is committed first.
+        self._add_change(watermark + 2, self.c1, "nightly", now)
+        scheduler.fold_changes()
+        self.assertEqual(scheduler.watermark, watermark + 2)
+        self.assertEqual(list(scheduler.gaps), [watermark + 1])
+
+        self._add_change(
+            watermark + 1, self.c2, "nightly-requested", now - timedelta(minutes=30)
+        )
+        scheduler.fold_changes()
+        self.assertEqual(scheduler.gaps, {})
+        self.assertEqual(
+            scheduler.deadlines,
+            {(self.c2.id, self.requested.id): now + timedelta(minutes=30)},
+        )
+
+    def test_gap_timeout(self):
+        scheduler = StaleRequestsScheduler(
+            db.session, "odcs", timedelta(hours=1), gap_timeout=timedelta(0)
+        )
+        scheduler.rebuild()
+        self._add_change(scheduler.watermark + 2, self.c1, "nightly", datetime.utcnow())
+        scheduler.fold_changes()
+        self.assertEqual(len(scheduler.gaps), 1)
+        # The rolled back insert is not checked forever.
+        scheduler.fold_changes()
+        self.assertEqual(scheduler.gaps, {})
+
+    def test_save_load(self):
+        now = datetime.utcnow()
+        self._tag(self.c1, "nightly-requested", now - timedelta(hours=2))
+        scheduler = self._scheduler()
+        self.assertFalse(scheduler.load())
+        scheduler.rebuild()
+        scheduler.save()
+
+        loaded = self._scheduler()
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.watermark, scheduler.watermark)
+        self.assertEqual(loaded.gaps, scheduler.gaps)
+        self.assertEqual(loaded.deadlines, scheduler.deadlines)
+        self.assertEqual(
+            [(compose_id, tag.name) for compose_id, tag in loaded.sweep(now)],
+            [(self.c1.id, "nightly-requested")],
+        )
+
+        # Schedule computed with different timeout cannot be used.
+        loaded = StaleRequestsScheduler(
+            db.session, "odcs", timedelta(hours=2), state_file=self.state_file
+        )
+        self.assertFalse(loaded.load())
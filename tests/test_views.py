@@ -21,16 +21,26 @@
 # Written by Jan Kaluza <jkaluza@redhat.com>
 
 import contextlib
+import datetime
 import json
 import unittest
 
 import flask
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+import cts.api_utils
 import cts.auth
 from cts import conf, db, app, login_manager, version
-from cts.models import Compose, User, Tag
+from cts.event_stream import event_stream, notifier, store_messages
+from cts.slow_queries import slow_query_log
+from cts.metrics import (
+    request_db_statements,
+    request_duration,
+    request_errors,
+    response_size,
+)
+from cts.models import Compose, ComposeChange, ComposeEvent, User, Tag, TagChange
 
 from utils import ModelsBaseTest
 
@@ -107,6 +117,57 @@ class ViewBaseTest(ModelsBaseTest):
                 if patch_auth_backend is not None:
                     patch_auth_backend.stop()
 
+    def setup_tagged_composes(self, count=15):
+        """
+        Creates `count` tags with permissions and `count` composes, each of
+        them respin and child of the previous one and tagged by two tags.
+
+        The tests of statement budgets use it, so the endpoints are checked
+        on more rows than the budget.
+
+        :param int count: Number of tags and composes to create.
+        :return: List of the created compose IDs.
+        """
+        for username in ["odcs", "dev"]:
+            if not User.find_user_by_name(username):
+                User.create_user(username=username)
+        for i in range(count):
+            t = Tag.create(
+                db.session,
+                "odcs",
+                name="tag-%d" % i,
+                description="test",
+                documentation="test",
+            )
+            t.add_tagger("odcs", "dev")
+            t.add_tagger("odcs", group="devel")
+            t.add_untagger("odcs", "dev")
+            t.add_untagger("odcs", group="devel")
+        db.session.commit()
+
+        ids = []
+        for i in range(count):
+            self.ci.compose.respin = i
+            c = Compose.create(
+                db.session,
+                "odcs",
+                self.ci,
+                parent_compose_ids=ids[-1:],
+                respin_of=ids[-1] if ids else None,
+            )[0]
+            ids.append(c.id)
+            c.tag("odcs", "tag-%d" % i)
+            c.tag("odcs", "tag-%d" % ((i + 1) % count))
+        db.session.commit()
+        return ids
+
+    def _get_within_budget(self, url, max_statements, user="odcs", groups=None):
+        with self._test_request_context(user=user, groups=groups):
+            with self.assertMaxStatements(max_statements):
+                rv = self.client.get(url)
+        self.assertEqual(rv.status, "200 OK")
+        return json.loads(rv.get_data(as_text=True))
+
     def setup_test_data(self):
         """Set up data for running tests"""
 
@@ -147,6 +208,52 @@ class TestMetricsView(ViewBaseTest):
         expected_data = 'composes_total{tag="test"} 1.0'
         self.assertTrue(expected_data in data)
 
+    def _sample(self, metric, name, **labels):
+        for sample in metric.collect()[0].samples:
+            if sample.name == name and sample.labels == labels:
+                return sample.value
+        return 0
+
+    def test_request_metrics(self):
+        labels = {"endpoint": "composes", "method": "GET"}
+        count = self._sample(
+            request_duration, "http_request_duration_seconds_count", **labels
+        )
+        statements = self._sample(
+            request_db_statements, "http_request_db_statements_sum", **labels
+        )
+        size = self._sample(response_size, "http_response_size_bytes_sum", **labels)
+
+        rv = self.client.get("/api/1/composes/")
+        self.assertEqual(rv.status, "200 OK")
+
+        self.assertEqual(
+            self._sample(
+                request_duration, "http_request_duration_seconds_count", **labels
+            ),
+            count + 1,
+        )
+        self.assertGreater(
+            self._sample(
+                request_db_statements, "http_request_db_statements_sum", **labels
+            ),
+            statements,
+        )
+        self.assertEqual(
+            self._sample(response_size, "http_response_size_bytes_sum", **labels),
+            size + len(rv.get_data()),
+        )
+
+    def test_request_metrics_errors(self):
+        labels = {"endpoint": "composedetail", "method": "GET", "status": "404"}
+        errors = self._sample(request_errors, "http_request_errors_total", **labels)
+        rv = self.client.get("/api/1/composes/missing")
+        self.assertEqual(rv.status, "404 NOT FOUND")
+        self.assertEqual(
+            self._sample(request_errors, "http_request_errors_total", **labels),
+            errors + 1,
+        )
+
 
 class TestViews(ViewBaseTest):
     maxDiff = None
@@ -311,6 +418,15 @@ class TestViews(ViewBaseTest):
         ]
         self.assertEqual(expected_compose_ids, compose_ids)
 
+    def test_composes_get_statements(self):
+        self.setup_tagged_composes()
+        data = self._get_within_budget("/api/1/composes/?per_page=15", 6)
+        self.assertEqual(len(data["items"]), 15)
+
+    def test_compose_get_statements(self):
+        ids = self.setup_tagged_composes()
+        self._get_within_budget("/api/1/composes/%s" % ids[7], 5)
+
     def test_composes_post(self):
         with self._test_request_context(user="odcs"):
             rv = self.client.post(
@@ -464,6 +580,20 @@ class TestViews(ViewBaseTest):
         )
         self.assertEqual(c, None)
 
+    def test_composes_post_statements(self):
+        ids = self.setup_tagged_composes()
+        with self._test_request_context(user="odcs"):
+            with self.assertMaxStatements(12):
+                rv = self.client.post(
+                    "/api/1/composes/",
+                    json={
+                        "compose_info": json.loads(self.ci.dumps()),
+                        "parent_compose_ids": ids,
+                        "respin_of": ids[-1],
+                    },
+                )
+        self.assertEqual(rv.status, "200 OK")
+
     def test_tags_get(self):
         self.test_tags_post()
         rv = self.client.get("/api/1/tags/")
@@ -526,6 +656,66 @@ class TestViews(ViewBaseTest):
         }
         self.assertEqual(data, expected_data)
 
+    def test_tags_get_fields(self):
+        self.test_tags_post()
+        rv = self.client.get("/api/1/tags/?fields=id,name")
+        data = json.loads(rv.get_data(as_text=True))
+        self.assertEqual(data["items"], [{"id": 1, "name": "periodic"}])
+
+        rv = self.client.get("/api/1/tags/periodic?fields=name&fields=taggers")
+        data = json.loads(rv.get_data(as_text=True))
+        self.assertEqual(data, {"name": "periodic", "taggers": []})
+
+    def test_tags_get_unknown_field(self):
+        rv = self.client.get("/api/1/tags/?fields=id,foo")
+        data = json.loads(rv.get_data(as_text=True))
+        self.assertEqual(rv.status, "400 BAD REQUEST")
+        self.assertEqual(data["message"], 'Unknown field "foo".')
+
+    def test_tags_get_order_by(self):
+        for name in ["b", "c", "a"]:
+            Tag.create(
+                db.session, "odcs", name=name, description="test", documentation="test"
+            )
+        for order_by, names in [
+            ("", ["a", "c", "b"]),
+            ("?order_by=name", ["a", "b", "c"]),
+            ("?order_by=-name&per_page=2&page=2", ["a"]),
+            ("?name=c", ["c"]),
+        ]:
+            rv = self.client.get("/api/1/tags/" + order_by)
+            data = json.loads(rv.get_data(as_text=True))
+            self.assertEqual([t["name"] for t in data["items"]], names)
+
+    def test_tags_get_after_patch(self):
+        self.test_tags_post()
+        rv = self.client.get("/api/1/tags/1")
+        self.assertEqual(json.loads(rv.get_data(as_text=True))["name"], "periodic")
+        with self._test_request_context(user="root"):
+            self.client.patch("/api/1/tags/1", json={"name": "daily"})
+        rv = self.client.get("/api/1/tags/1")
+        self.assertEqual(json.loads(rv.get_data(as_text=True))["name"], "daily")
+
+        change = TagChange.query.order_by(TagChange.id.desc()).first()
+        self.assertEqual(change.action, "updated")
+        self.assertEqual(change.user.username, "root")
+
+    def test_tags_get_statements(self):
+        self.setup_tagged_composes()
+        data = self._get_within_budget("/api/1/tags/?per_page=15", 6)
+        self.assertEqual(len(data["items"]), 15)
+
+    def test_tag_get_statements(self):
+        self.setup_tagged_composes()
+        self._get_within_budget("/api/1/tags/1", 6)
+
+    def test_tags_get_cached_statements(self):
+        self.setup_tagged_composes()
+        self._get_within_budget("/api/1/tags/", 6)
+        data = self._get_within_budget("/api/1/tags/?per_page=15&fields=id,name", 1)
+        self.assertEqual(data["items"][0], {"id": 15, "name": "tag-14"})
+        self._get_within_budget("/api/1/tags/tag-1", 1)
+
     def test_tags_post(self):
         with self._test_request_context(user="root"):
             req = {
@@ -729,6 +919,13 @@ class TestViews(ViewBaseTest):
             },
         )
 
+    def test_userinfo_statements(self):
+        self.setup_tagged_composes()
+        data = self._get_within_budget(
+            "/api/1/userinfo", 5, user="dev", groups=["devel"]
+        )
+        self.assertEqual(len(data["permissions"]["is_tagger_of"]), 15)
+
 
 class TestViewsQueryByTag(ViewBaseTest):
     def setup_test_data(self):
@@ -999,6 +1196,319 @@ class TestViewsComposeTagging(ViewBaseTest):
         self.assertEqual(data["status"], 400)
         self.assertEqual(data["message"], 'Tag "not-existing" does not exist')
 
+    def test_composes_patch_tag_statements(self):
+        ids = self.setup_tagged_composes()
+        # Warm up the tag catalogue.
+        self._get_within_budget("/api/1/tags/", 6)
+        for action, tag, max_statements in [
+            ("tag", "tag-5", 11),
+            ("untag", "tag-0", 11),
+        ]:
+            req = {"action": action, "tag": tag}
+            with self._test_request_context(user="root"):
+                with self.assertMaxStatements(max_statements) as statements:
+                    rv = self.client.patch("/api/1/composes/%s" % ids[0], json=req)
+            self.assertEqual(rv.status, "200 OK")
+            # The tag is resolved by the tag catalogue.
+            self.assertEqual([s for s in statements if "tags.name = " in s], [])
+
+
+class TestViewsComposeBulkTagging(ViewBaseTest):
+    maxDiff = None
+
+    def setup_composes(self):
+        User.create_user(username="root")
+        User.create_user(username="odcs")
+        t = Tag.create(
+            db.session,
+            "root",
+            name="periodic",
+            description="Periodic compose",
+            documentation="http://localhost/",
+        )
+        t.add_tagger("root", "odcs")
+        t.add_untagger("root", "odcs")
+        c1 = Compose.create(db.session, "odcs", self.ci)[0]
+        c1.tag("odcs", "periodic")
+        db.session.commit()
+        self.c1 = c1.id
+        self.c2 = Compose.create(db.session, "odcs", self.ci)[0].id
+        self.ci.release.short = "DP"
+        self.c3 = Compose.create(db.session, "odcs", self.ci)[0].id
+
+    def _get_compose(self, id):
+        db.session.expire_all()
+        return db.session.query(Compose).filter(Compose.id == id).one()
+
+    def _bulk_patch(self, req, user="odcs"):
+        with self._test_request_context(user=user):
+            rv = self.client.patch("/api/1/composes/", json=req)
+            data = json.loads(rv.get_data(as_text=True))
+        return rv, data
+
+    def test_composes_bulk_tag(self):
+        rv, data = self._bulk_patch(
+            {
+                "action": "tag",
+                "tag": "periodic",
+                "composes": [self.c1, self.c2, self.c3],
+                "user_data": "release candidate",
+            }
+        )
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(
+            data,
+            {
+                "action": "tag",
+                "tag": "periodic",
+                "composes": sorted([self.c2, self.c3]),
+            },
+        )
+
+        for id in [self.c1, self.c2, self.c3]:
+            c = self._get_compose(id)
+            self.assertEqual([t.name for t in c.tags], ["periodic"])
+        self.assertEqual(
+            [(ch.action, ch.user_data) for ch in c.changes],
+            [("created", None), ("tagged", "release candidate")],
+        )
+
+    def test_composes_bulk_tag_filters(self):
+        rv, data = self._bulk_patch(
+            {
+                "action": "tag",
+                "tag": "periodic",
+                "filters": {"release_short": "Fedora", "tag": ["-periodic"]},
+            }
+        )
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(data["composes"], [self.c2])
+
+    def test_composes_bulk_untag(self):
+        rv, data = self._bulk_patch(
+            {
+                "action": "untag",
+                "tag": "periodic",
+                "filters": {"release_short_startswith": "Fed"},
+            }
+        )
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(data["composes"], [self.c1])
+
+        c1 = self._get_compose(self.c1)
+        self.assertEqual(c1.tags, [])
+        self.assertEqual(c1.changes[-1].action, "untagged")
+
+    def test_composes_bulk_tag_no_tagger(self):
+        rv, data = self._bulk_patch(
+            {"action": "tag", "tag": "periodic", "composes": [self.c2]},
+            user="foo",
+        )
+        self.assertEqual(rv.status, "403 FORBIDDEN")
+
+        self.assertEqual(self._get_compose(self.c2).tags, [])
+
+    def test_composes_bulk_tag_missing_compose(self):
+        rv, data = self._bulk_patch(
+            {
+                "action": "tag",
+                "tag": "periodic",
+                "composes": [self.c2, "not-existing"],
+            }
+        )
+        self.assertEqual(rv.status, "404 NOT FOUND")
+        self.assertEqual(data["message"], "No such compose found: not-existing.")
+
+        self.assertEqual(self._get_compose(self.c2).tags, [])
+
+    def test_composes_bulk_tag_wrong_selection(self):
+        for req, msg in [
+            ({}, 'Exactly one of "composes" or "filters" must be set.'),
+            (
+                {"composes": [self.c1], "filters": {"type": "nightly"}},
+                'Exactly one of "composes" or "filters" must be set.',
+            ),
+            ({"composes": []}, '"composes" must be non-empty list of compose IDs.'),
+            ({"composes": [1]}, '"composes" must be non-empty list of compose IDs.'),
+            ({"composes": [{}]}, '"composes" must be non-empty list of compose IDs.'),
+            ({"filters": {}}, '"filters" must be non-empty object.'),
+            ({"filters": {"order_by": "id"}}, "Unknown filter 'order_by'."),
+        ]:
+            req.update({"action": "tag", "tag": "periodic"})
+            rv, data = self._bulk_patch(req)
+            self.assertEqual(rv.status, "400 BAD REQUEST")
+            self.assertEqual(data["message"], msg)
+
+    def test_composes_bulk_tag_statements(self):
+        ids = self.setup_tagged_composes()
+        for action, max_statements in [("tag", 12), ("untag", 12)]:
+            req = {"action": action, "tag": "periodic", "composes": ids}
+            with self._test_request_context(user="odcs"):
+                with self.assertMaxStatements(max_statements):
+                    rv = self.client.patch("/api/1/composes/", json=req)
+            self.assertEqual(rv.status, "200 OK")
+            data = json.loads(rv.get_data(as_text=True))
+            self.assertEqual(data["composes"], sorted(ids))
+
+
+class TestViewsTagBulkPermissions(ViewBaseTest):
+    def setup_composes(self):
+        User.create_user(username="root")
+        User.create_user(username="odcs")
+        for name in ["periodic", "nightly", "test"]:
+            Tag.create(
+                db.session,
+                "root",
+                name=name,
+                description="test",
+                documentation="http://localhost/",
+            )
+        Tag.get_by_name("periodic").add_tagger("root", "odcs")
+        Tag.get_by_name("periodic").add_untagger("root", group="qe")
+        db.session.commit()
+
+    def _bulk_patch(self, req, user="root", max_statements=None):
+        with self._test_request_context(user=user):
+            if max_statements is None:
+                rv = self.client.patch("/api/1/tags/", json=req)
+            else:
+                with self.assertMaxStatements(max_statements):
+                    rv = self.client.patch("/api/1/tags/", json=req)
+            data = json.loads(rv.get_data(as_text=True))
+        return rv, data
+
+    def test_tags_bulk_permissions_statements(self):
+        names = ["tag-%d" % i for i in range(15)]
+        for name in names:
+            Tag.create(
+                db.session,
+                "root",
+                name=name,
+                description="test",
+                documentation="http://localhost/",
+            )
+        db.session.commit()
+        rv, data = self._bulk_patch(
+            {
+                "tags": names,
+                "actions": [
+                    {"action": "add_tagger", "username": "odcs", "group": "devel"},
+                    {"action": "remove_untagger", "group": "qe"},
+                ],
+            },
+            max_statements=14,
+        )
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(len(data["items"]), 15)
+
+    def test_tags_bulk_permissions(self):
+        rv, data = self._bulk_patch(
+            {
+                "tags": ["periodic", "nightly"],
+                "actions": [
+                    {"action": "add_tagger", "username": "odcs", "group": "devel"},
+                    {"action": "add_untagger", "username": "new"},
+                    {"action": "remove_untagger", "group": "qe"},
+                ],
+                "user_data": "Ticket #123",
+            }
+        )
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(data["changes"], 6)
+        self.assertEqual(
+            [
+                (t["name"], t["taggers"], t["tagger_groups"], t["untaggers"])
+                for t in data["items"]
+            ],
+            [
+                ("periodic", ["odcs"], ["devel"], ["new"]),
+                ("nightly", ["odcs"], ["devel"], ["new"]),
+            ],
+        )
+        self.assertEqual(data["items"][0]["untagger_groups"], [])
+        self.assertEqual(Tag.get_by_name("test").json()["taggers"], [])
+
+        changes = (
+            TagChange.query.filter_by(user_data="Ticket #123")
+            .order_by(TagChange.id)
+            .all()
+        )
+        self.assertEqual(
+            [(c.tag_id, c.action, c.message, c.user.username) for c in changes],
+            [
+                (2, "add_tagger", 'Tagger permission granted to user "odcs".', "root"),
+                (
+                    1,
+                    "add_tagger",
+                    'Tagger permission granted to group "devel".',
+                    "root",
+                ),
+                (
+                    2,
+                    "add_tagger",
+                    'Tagger permission granted to group "devel".',
+                    "root",
+                ),
+                (
+                    1,
+                    "add_untagger",
+                    'Untagger permission granted to user "new".',
+                    "root",
+                ),
+                (
+                    2,
+                    "add_untagger",
+                    'Untagger permission granted to user "new".',
+                    "root",
+                ),
+                (
+                    1,
+                    "remove_untagger",
+                    'Untagger permission removed from group "qe".',
+                    "root",
+                ),
+            ],
+        )
+
+        # The tag catalogue is invalidated.
+        rv = self.client.get("/api/1/tags/nightly")
+        data = json.loads(rv.get_data(as_text=True))
+        self.assertEqual(data["taggers"], ["odcs"])
+
+    def test_tags_bulk_permissions_invalid(self):
+        for req, message in [
+            ({"actions": []}, '"tags" must be a non-empty list of tag names.'),
+            ({"tags": ["foo"]}, 'Tag "foo" does not exist'),
+            ({"tags": ["test"]}, '"actions" must be a non-empty list.'),
+            ({"tags": ["test"], "actions": [{"action": "foo"}]}, "Unknown action."),
+            (
+                {"tags": ["test"], "actions": [{"action": "add_tagger"}]},
+                'Either "username" or "group" should be defined.',
+            ),
+            (
+                {
+                    "tags": ["test"],
+                    "actions": [
+                        {"action": "add_tagger", "group": "devel"},
+                        {"action": "remove_tagger", "username": "foo"},
+                    ],
+                },
+                'User "foo" does not exist.',
+            ),
+        ]:
+            rv, data = self._bulk_patch(req)
+            self.assertEqual(rv.status, "400 BAD REQUEST")
+            self.assertEqual(data["message"], message)
+        # Nothing has been changed.
+        self.assertEqual(Tag.get_by_name("test").tagger_groups, [])
+
+    def test_tags_bulk_permissions_not_admin(self):
+        rv, data = self._bulk_patch(
+            {"tags": ["test"], "actions": [{"action": "add_tagger", "group": "x"}]},
+            user="odcs",
+        )
+        self.assertEqual(rv.status, "403 FORBIDDEN")
+
 
 class TestViewsComposeRepo(ViewBaseTest):
     maxDiff = None
@@ -1091,22 +1601,702 @@ class TestViewsComposeChanges(ViewBaseTest):
         self.c.compose_url = "http://localhost/composes/Fedora-Rawhide-20200517.n.1"
         db.session.commit()
 
+    def _changes(self):
+        return ComposeChange.query.order_by(ComposeChange.time, ComposeChange.id)
+
     def test_initial_change(self):
         with self._test_request_context(user="odcs"):
             rv = self.client.get("/api/1/composes/Fedora-Rawhide-20200517.n.1/changes/")
             data = json.loads(rv.get_data(as_text=True))
         self.assertEqual(rv.status, "200 OK")
         self.assertEqual(len(data["changes"]), 1)
-        self.assertEqual(data["changes"], [c.json() for c in self.c.changes])
+        self.assertEqual(data["changes"], [c.json() for c in self._changes()])
+        self.assertEqual(data["meta"], {"limit": 100, "next": None})
 
     def test_changes_with_addtag(self):
         Tag.create(
             db.session, "odcs", name="test", description="test", documentation="test"
         )
         self.c.tag("odcs", "test")
+        db.session.commit()
         with self._test_request_context(user="odcs"):
             rv = self.client.get("/api/1/composes/Fedora-Rawhide-20200517.n.1/changes/")
             data = json.loads(rv.get_data(as_text=True))
         self.assertEqual(rv.status, "200 OK")
         self.assertEqual(len(data["changes"]), 2)
-        self.assertEqual(data["changes"], [c.json() for c in self.c.changes])
+        self.assertEqual(data["changes"], [c.json() for c in self._changes()])
+
+    def _get_changes(self, url):
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get(url)
+            return rv, json.loads(rv.get_data(as_text=True))
+
+    def _setup_changes(self):
+        Tag.create(
+            db.session, "odcs", name="test", description="test", documentation="test"
+        )
+        User.create_user(username="other")
+        db.session.commit()
+        for i in range(5):
+            self.c.tag("odcs" if i % 2 else "other", "test")
+            self.c.untag("odcs", "test")
+        db.session.commit()
+        # 1 "created" + 5 "tagged" + 5 "untagged", one per minute.
+        for i, change in enumerate(self._changes()):
+            change.time = datetime.datetime(2020, 5, 17, 10, i)
+        db.session.commit()
+
+    def test_changes_pagination(self):
+        self._setup_changes()
+        url = "/api/1/composes/%s/changes/?limit=4&action=tagged" % self.c.id
+        pages = []
+        while url:
+            rv, data = self._get_changes(url)
+            self.assertEqual(rv.status, "200 OK")
+            pages.append([c["time"] for c in data["changes"]])
+            url = data["meta"]["next"]
+        self.assertEqual(
+            pages,
+            [
+                [
+                    "2020-05-17T10:01:00Z",
+                    "2020-05-17T10:03:00Z",
+                    "2020-05-17T10:05:00Z",
+                    "2020-05-17T10:07:00Z",
+                ],
+                ["2020-05-17T10:09:00Z"],
+            ],
+        )
+
+    def test_changes_filters(self):
+        self._setup_changes()
+        rv, data = self._get_changes(
+            "/api/1/composes/%s/changes/?since=2020-05-17T10:02:00Z"
+            "&until=2020-05-17T10:07:00Z&user=odcs" % self.c.id
+        )
+        self.assertEqual(
+            [(c["time"], c["action"]) for c in data["changes"]],
+            [
+                ("2020-05-17T10:02:00Z", "untagged"),
+                ("2020-05-17T10:03:00Z", "tagged"),
+                ("2020-05-17T10:04:00Z", "untagged"),
+                ("2020-05-17T10:06:00Z", "untagged"),
+            ],
+        )
+
+    def test_changes_compact(self):
+        self._setup_changes()
+        rv, data = self._get_changes(
+            "/api/1/composes/%s/changes/?format=compact&limit=2" % self.c.id
+        )
+        changes = self._changes().limit(2).all()
+        self.assertEqual(
+            data["changes"],
+            [
+                {
+                    "id": changes[0].id,
+                    "time": "2020-05-17T10:00:00Z",
+                    "action": "created",
+                    "user": "odcs",
+                    "tag": None,
+                    "user_data": None,
+                },
+                {
+                    "id": changes[1].id,
+                    "time": "2020-05-17T10:01:00Z",
+                    "action": "tagged",
+                    "user": "other",
+                    "tag": "test",
+                    "user_data": None,
+                },
+            ],
+        )
+
+    def test_changes_invalid_args(self):
+        for args, message in [
+            ("since=yesterday", 'Invalid datetime "yesterday" for "since".'),
+            ("limit=0", '"limit" must be between 1 and 1000.'),
+            ("after=1000", 'Invalid "after" change ID 1000.'),
+            ("format=xml", '"format" must be "full" or "compact".'),
+        ]:
+            rv, data = self._get_changes(
+                "/api/1/composes/%s/changes/?%s" % (self.c.id, args)
+            )
+            self.assertEqual(rv.status, "400 BAD REQUEST")
+            self.assertEqual(data["message"], message)
+
+    def test_tag_changes(self):
+        self._setup_changes()
+        self.c.tag("odcs", "test")
+        Tag.get_by_name("test").add_tagger("odcs", "other")
+        db.session.commit()
+        rv, data = self._get_changes(
+            "/api/1/tags/test/changes/?format=compact&action=add_tagger"
+        )
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(
+            [(c["action"], c["user"]) for c in data["changes"]],
+            [("add_tagger", "odcs")],
+        )
+        self.assertEqual(
+            sorted(data["changes"][0]), ["action", "id", "time", "user", "user_data"]
+        )
+
+    def test_changes_statements(self):
+        ids = self.setup_tagged_composes()
+        data = self._get_within_budget("/api/1/composes/%s/changes/" % ids[7], 2)
+        self.assertEqual(len(data["changes"]), 3)
+
+
+class TestViewsComposeGraph(ViewBaseTest):
+    def setup_composes(self):
+        User.create_user(username="odcs")
+        # Diamond: A <- B, A <- C, B <- D, C <- D
+        self.ids = []
+        for respin, parents in enumerate([[], [0], [0], [1, 2]]):
+            self.ci.compose.respin = respin
+            c = Compose.create(
+                db.session,
+                "odcs",
+                self.ci,
+                parent_compose_ids=[self.ids[i] for i in parents],
+            )[0]
+            self.ids.append(c.id)
+
+    def _get(self, url):
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get(url)
+            return rv, json.loads(rv.get_data(as_text=True))
+
+    def test_descendants(self):
+        a, b, c, d = self.ids
+        rv, data = self._get("/api/1/composes/%s/descendants/" % a)
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(data["compose"], a)
+        self.assertEqual(data["depth"], 10)
+        self.assertEqual(
+            [n["compose_info"]["payload"]["compose"]["id"] for n in data["nodes"]],
+            [a, b, c, d],
+        )
+        self.assertEqual(
+            data["edges"],
+            [
+                {"parent": a, "child": b},
+                {"parent": a, "child": c},
+                {"parent": b, "child": d},
+                {"parent": c, "child": d},
+            ],
+        )
+
+    def test_descendants_depth(self):
+        a, b, c, d = self.ids
+        rv, data = self._get("/api/1/composes/%s/descendants/?depth=1" % a)
+        self.assertEqual(
+            [n["compose_info"]["payload"]["compose"]["id"] for n in data["nodes"]],
+            [a, b, c],
+        )
+        self.assertEqual(
+            data["edges"], [{"parent": a, "child": b}, {"parent": a, "child": c}]
+        )
+
+    def test_ancestors(self):
+        a, b, c, d = self.ids
+        rv, data = self._get("/api/1/composes/%s/ancestors/" % d)
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(
+            [n["compose_info"]["payload"]["compose"]["id"] for n in data["nodes"]],
+            [a, b, c, d],
+        )
+        self.assertEqual(data["nodes"][3]["parents"], [b, c])
+        self.assertEqual(len(data["edges"]), 4)
+
+        rv, data = self._get("/api/1/composes/%s/ancestors/?depth=1" % b)
+        self.assertEqual(data["edges"], [{"parent": a, "child": b}])
+
+        rv, data = self._get("/api/1/composes/%s/ancestors/" % a)
+        self.assertEqual(len(data["nodes"]), 1)
+        self.assertEqual(data["edges"], [])
+
+    def test_graph_errors(self):
+        rv, data = self._get("/api/1/composes/unknown/ancestors/")
+        self.assertEqual(rv.status, "404 NOT FOUND")
+
+        rv, data = self._get("/api/1/composes/%s/descendants/?depth=0" % self.ids[0])
+        self.assertEqual(rv.status, "400 BAD REQUEST")
+        self.assertEqual(data["message"], '"depth" must be between 1 and 10.')
+
+
+class TestViewsComposeRespins(ViewBaseTest):
+    def setup_composes(self):
+        User.create_user(username="odcs")
+        # a <- b <- d, a <- c
+        self.ids = []
+        for respin, respin_of in enumerate([None, 0, 0, 1]):
+            self.ci.compose.respin = respin
+            c = Compose.create(
+                db.session,
+                "odcs",
+                self.ci,
+                respin_of=None if respin_of is None else self.ids[respin_of],
+            )[0]
+            self.ids.append(c.id)
+        self.ci.compose.respin = 10
+        self.other = Compose.create(db.session, "odcs", self.ci)[0].id
+
+    def _get(self, url):
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get(url)
+            return rv, json.loads(rv.get_data(as_text=True))
+
+    def test_respins(self):
+        a, b, c, d = self.ids
+        for id in self.ids:
+            rv, data = self._get("/api/1/composes/%s/respins/" % id)
+            self.assertEqual(rv.status, "200 OK")
+            self.assertEqual(data["compose"], id)
+            self.assertEqual(data["original"], a)
+            self.assertEqual(data["head"], d)
+            self.assertEqual(
+                [
+                    n["compose_info"]["payload"]["compose"]["id"]
+                    for n in data["respins"]
+                ],
+                [a, b, c, d],
+            )
+        self.assertEqual(data["respins"][0]["respun_by"], [b, c])
+        self.assertEqual(data["respins"][3]["respin_of"], b)
+
+    def test_respins_no_respin(self):
+        rv, data = self._get("/api/1/composes/%s/respins/" % self.other)
+        self.assertEqual(data["original"], self.other)
+        self.assertEqual(data["head"], self.other)
+        self.assertEqual(len(data["respins"]), 1)
+
+    def test_respins_not_found(self):
+        rv, data = self._get("/api/1/composes/unknown/respins/")
+        self.assertEqual(rv.status, "404 NOT FOUND")
+
+
+class TestViewsComposesLatest(ViewBaseTest):
+    def setup_composes(self):
+        User.create_user(username="odcs")
+        Tag.create(
+            db.session, "odcs", name="test", description="test", documentation="test"
+        )
+        self.ids = {}
+        for version, type, date, respin in [
+            ("Rawhide", "nightly", "20200517", 1),
+            ("Rawhide", "nightly", "20200517", 2),
+            ("Rawhide", "nightly", "20200516", 3),
+            ("Rawhide", "production", "20200510", 0),
+            ("32", "nightly", "20200515", 0),
+        ]:
+            self.ci.release.version = version
+            self.ci.compose.type = type
+            self.ci.compose.date = date
+            self.ci.compose.respin = respin
+            c = Compose.create(db.session, "odcs", self.ci)[0]
+            self.ids[(version, type, date, respin)] = c.id
+        db.session.commit()
+        c = Compose.query.get(self.ids[("Rawhide", "nightly", "20200517", 1)])
+        c.tag("odcs", "test")
+        db.session.commit()
+
+    def _get(self, url):
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get(url)
+            return rv, json.loads(rv.get_data(as_text=True))
+
+    def _ids(self, data):
+        return [c["compose_info"]["payload"]["compose"]["id"] for c in data["items"]]
+
+    def test_composes_latest(self):
+        rv, data = self._get("/api/1/composes/latest/")
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(
+            self._ids(data),
+            [
+                self.ids[("32", "nightly", "20200515", 0)],
+                self.ids[("Rawhide", "nightly", "20200517", 2)],
+                self.ids[("Rawhide", "production", "20200510", 0)],
+            ],
+        )
+
+    def test_composes_latest_filters(self):
+        rv, data = self._get("/api/1/composes/latest/?tag=test")
+        self.assertEqual(
+            self._ids(data), [self.ids[("Rawhide", "nightly", "20200517", 1)]]
+        )
+        self.assertEqual(data["items"][0]["tags"], ["test"])
+
+        rv, data = self._get(
+            "/api/1/composes/latest/?release_version=Rawhide&type=nightly"
+            "&date_before=20200517"
+        )
+        self.assertEqual(
+            self._ids(data), [self.ids[("Rawhide", "nightly", "20200516", 3)]]
+        )
+
+        rv, data = self._get("/api/1/composes/latest/?release_short=RHEL")
+        self.assertEqual(data, {"items": []})
+
+    def test_composes_latest_statements(self):
+        self.setup_tagged_composes()
+        self._get_within_budget("/api/1/composes/latest/", 5)
+
+
+class TestViewsComposeFacets(ViewBaseTest):
+    def setup_composes(self):
+        User.create_user(username="odcs")
+        Tag.create(
+            db.session, "odcs", name="test", description="test", documentation="test"
+        )
+        self.ids = []
+        for version, type, date in [
+            ("Rawhide", "nightly", "20200516"),
+            ("Rawhide", "nightly", "20200517"),
+            ("Rawhide", "production", "20200518"),
+            ("32", "nightly", "20200601"),
+        ]:
+            self.ci.release.version = version
+            self.ci.compose.type = type
+            self.ci.compose.date = date
+            self.ids.append(Compose.create(db.session, "odcs", self.ci)[0].id)
+        db.session.commit()
+        for id in self.ids[1:3]:
+            Compose.query.get(id).tag("odcs", "test")
+            db.session.commit()
+
+    def _get(self, url):
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get(url)
+            return rv, json.loads(rv.get_data(as_text=True))
+
+    def _counts(self, facet):
+        return [(c["value"], c["count"]) for c in facet]
+
+    def test_compose_facets(self):
+        rv, data = self._get("/api/1/composes/facets/")
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(data["total"], 4)
+        facets = data["facets"]
+        self.assertEqual(
+            sorted(facets.keys()), ["date", "release_short", "tag", "type"]
+        )
+        self.assertEqual(self._counts(facets["tag"]), [("test", 2)])
+        self.assertEqual(self._counts(facets["release_short"]), [("Fedora", 4)])
+        self.assertEqual(
+            self._counts(facets["type"]), [("nightly", 3), ("production", 1)]
+        )
+        self.assertEqual(
+            self._counts(facets["date"]),
+            [("20200516", 1), ("20200517", 1), ("20200518", 1), ("20200601", 1)],
+        )
+
+    def test_compose_facets_filters(self):
+        rv, data = self._get(
+            "/api/1/composes/facets/?facet=release_version&facet=final" "&type=nightly"
+        )
+        self.assertEqual(data["total"], 3)
+        self.assertEqual(
+            data["facets"],
+            {
+                "release_version": [
+                    {"value": "32", "count": 1},
+                    {"value": "Rawhide", "count": 2},
+                ],
+                "final": [{"value": False, "count": 3}],
+            },
+        )
+
+        rv, data = self._get("/api/1/composes/facets/?facet=type&tag=test")
+        self.assertEqual(data["total"], 2)
+        self.assertEqual(
+            self._counts(data["facets"]["type"]),
+            [("nightly", 1), ("production", 1)],
+        )
+
+    def test_compose_facets_date_interval(self):
+        rv, data = self._get("/api/1/composes/facets/?facet=date&interval=week")
+        self.assertEqual(
+            self._counts(data["facets"]["date"]),
+            [("20200511", 2), ("20200518", 1), ("20200601", 1)],
+        )
+
+        rv, data = self._get("/api/1/composes/facets/?facet=date&interval=month")
+        self.assertEqual(
+            self._counts(data["facets"]["date"]),
+            [("20200501", 3), ("20200601", 1)],
+        )
+
+    @patch.object(conf, "compose_facets_cache_ttl", new=60)
+    def test_compose_facets_cache(self):
+        self.addCleanup(cts.api_utils._facets_cache.clear)
+        rv, data = self._get("/api/1/composes/facets/?facet=type&release_short=Fedora")
+        self.assertEqual(data["total"], 4)
+
+        Compose.create(db.session, "odcs", self.ci)
+        db.session.commit()
+        rv, data = self._get("/api/1/composes/facets/?facet=type&release_short=Fedora")
+        self.assertEqual(data["total"], 4)
+        rv, data = self._get("/api/1/composes/facets/?facet=type")
+        self.assertEqual(data["total"], 5)
+
+    def test_compose_facets_invalid_args(self):
+        for args, message in [
+            ("facet=id", 'Unknown facet "id".'),
+            ("interval=year", '"interval" must be one of "day", "week" or "month".'),
+        ]:
+            rv, data = self._get("/api/1/composes/facets/?%s" % args)
+            self.assertEqual(rv.status, "400 BAD REQUEST")
+            self.assertEqual(data["message"], message)
+
+
+class TestViewsSlowQueries(ViewBaseTest):
+    def setup_test_data(self):
+        slow_query_log.clear()
+        self.addCleanup(slow_query_log.clear)
+
+    def _get(self, url, user="root"):
+        with self._test_request_context(user=user):
+            rv = self.client.get(url)
+            return rv, json.loads(rv.get_data(as_text=True))
+
+    def test_slow_queries(self):
+        with patch.object(conf, "slow_query_threshold", new=1e-9):
+            rv, data = self._get("/api/1/composes/?release_short=Fedora&tag=a&tag=b")
+        self.assertEqual(rv.status, "200 OK")
+
+        rv, data = self._get("/api/1/slow-queries/")
+        self.assertEqual(rv.status, "200 OK")
+        queries = [q for q in data["items"] if q["endpoint"] == "composes"]
+        self.assertTrue(queries)
+        query = queries[0]
+        self.assertEqual(query["method"], "GET")
+        self.assertEqual(
+            query["args"], {"release_short": ["Fedora"], "tag": ["a", "b"]}
+        )
+        self.assertTrue(query["statement"].startswith("SELECT"))
+        self.assertIsNone(query["plan"])
+
+    def test_slow_queries_threshold(self):
+        with patch.object(conf, "slow_query_threshold", new=3600):
+            self._get("/api/1/composes/")
+        rv, data = self._get("/api/1/slow-queries/")
+        self.assertEqual(data, {"items": []})
+
+    def test_slow_queries_not_admin(self):
+        rv, data = self._get("/api/1/slow-queries/", user="odcs")
+        self.assertEqual(rv.status, "403 FORBIDDEN")
+
+
+class TestViewsChangesFeed(ViewBaseTest):
+    def setup_composes(self):
+        User.create_user(username="odcs")
+        self.c = Compose.create(db.session, "odcs", self.ci)[0]
+        self.tag = Tag.create(
+            db.session, "odcs", name="test", description="test", documentation="test"
+        )
+        db.session.commit()
+        self.c.tag("odcs", "test")
+        db.session.commit()
+        self.compose_id = self.c.id
+
+    def _get(self, url):
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get(url)
+            return rv, json.loads(rv.get_data(as_text=True))
+
+    def test_changes_feed(self):
+        rv, data = self._get("/api/1/changes/?limit=2")
+        self.assertEqual(rv.status, "200 OK")
+        self.assertEqual(
+            [(c["type"], c["action"], c["compose"]) for c in data["changes"]],
+            [("compose", "created", self.compose_id), ("tag", "created", None)],
+        )
+        self.assertEqual(data["changes"][1]["tag"], "test")
+        self.assertEqual(data["next"], "1-1")
+
+        rv, data = self._get("/api/1/changes/?since=%s" % data["next"])
+        self.assertEqual(
+            [(c["type"], c["action"], c["tag"]) for c in data["changes"]],
+            [("compose", "tagged", "test")],
+        )
+        self.assertEqual(data["next"], "2-1")
+
+        # No new changes, the cursor stays the same.
+        rv, data = self._get("/api/1/changes/?since=2-1")
+        self.assertEqual(data, {"changes": [], "next": "2-1"})
+
+    def test_changes_feed_id_gap(self):
+        # The change 3 has been rolled back, its ID is never committed later.
+        db.session.execute(
+            ComposeChange.__table__.insert().values(
+                id=4,
+                time=datetime.datetime.utcnow(),
+                compose_id=self.compose_id,
+                action="tagged",
+                user_id=User.find_user_by_name("odcs").id,
+                tag_id=Tag.get_by_name("test").id,
+            )
+        )
+        db.session.commit()
+        rv, data = self._get("/api/1/changes/?since=2-1")
+        self.assertEqual([c["id"] for c in data["changes"]], [4])
+        self.assertEqual(data["next"], "4-1")
+
+    def test_changes_feed_wait(self):
+        def add_change(seconds):
+            c = Compose.query.get(self.compose_id)
+            c.untag("odcs", "test")
+            db.session.commit()
+
+        with patch("cts.views.time.sleep", side_effect=add_change) as sleep:
+            rv, data = self._get("/api/1/changes/?since=2-1&wait=10")
+        sleep.assert_called_once_with(conf.changes_feed_poll_interval)
+        self.assertEqual(
+            [(c["type"], c["action"]) for c in data["changes"]],
+            [("compose", "untagged")],
+        )
+        self.assertEqual(data["next"], "3-1")
+
+    def test_changes_feed_invalid_args(self):
+        for args, message in [
+            ("since=foo", 'Invalid changes cursor "foo".'),
+            ("limit=1000", '"limit" must be between 1 and 100.'),
+            ("wait=3600", '"wait" must be between 0 and 30.'),
+        ]:
+            rv, data = self._get("/api/1/changes/?%s" % args)
+            self.assertEqual(rv.status, "400 BAD REQUEST")
+            self.assertEqual(data["message"], message)
+
+    def test_changes_feed_statements(self):
+        self.setup_tagged_composes()
+        self._get_within_budget("/api/1/changes/", 2)
+
+
+class TestViewsEventStream(ViewBaseTest):
+    def setup_composes(self):
+        User.create_user(username="odcs")
+        self.c = Compose.create(db.session, "odcs", self.ci)[0]
+        db.session.commit()
+        compose = self.c.json()
+        store_messages(
+            db.session,
+            [
+                {"event": "compose-created", "compose": compose},
+                {"event": "compose-tagged", "compose": compose, "tag": "test"},
+            ],
+        )
+        db.session.commit()
+        self.compose_id = self.c.id
+
+    def _events(self, url, count, headers=None):
+        """Returns first `count` events from the stream."""
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get(url, headers=headers)
+            self.assertEqual(rv.status, "200 OK")
+            self.assertEqual(rv.mimetype, "text/event-stream")
+            events = []
+            for chunk in rv.response:
+                chunk = chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+                fields = dict(line.split(": ", 1) for line in chunk.split("\n") if line)
+                events.append(
+                    (int(fields["id"]), fields["event"], json.loads(fields["data"]))
+                )
+                if len(events) == count:
+                    break
+            rv.close()
+            return events
+
+    def test_event_stream_last_event_id(self):
+        events = self._events("/api/1/events/", 2, headers={"Last-Event-ID": "0"})
+        self.assertEqual(
+            [(event_id, event) for event_id, event, _ in events],
+            [(1, "compose-created"), (2, "compose-tagged")],
+        )
+        self.assertEqual(events[1][2]["tag"], "test")
+        payload = events[1][2]["compose"]["compose_info"]["payload"]
+        self.assertEqual(payload["compose"]["id"], self.compose_id)
+
+        events = self._events("/api/1/events/", 1, headers={"Last-Event-ID": "1"})
+        self.assertEqual(events[0][:2], (2, "compose-tagged"))
+
+    def test_event_stream_filters(self):
+        events = self._events(
+            "/api/1/events/?tag=test&release_short=Fedora&release_version=Rawhide",
+            1,
+            headers={"Last-Event-ID": "0"},
+        )
+        self.assertEqual(events[0][:2], (2, "compose-tagged"))
+
+    def test_event_stream_invalid_last_event_id(self):
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get("/api/1/events/", headers={"Last-Event-ID": "foo"})
+            data = json.loads(rv.get_data(as_text=True))
+        self.assertEqual(rv.status, "400 BAD REQUEST")
+        self.assertEqual(data["message"], 'Invalid Last-Event-ID "foo".')
+
+    def test_event_stream_id_gap(self):
+        with patch.object(notifier, "wait", return_value=False):
+            stream = event_stream(last_event_id=2)
+            self.assertEqual(next(stream), ": keepalive\n\n")
+            # The event 3 has been rolled back, its ID is never committed
+            # later.
+            db.session.execute(
+                ComposeEvent.__table__.insert().values(
+                    id=4,
+                    time=datetime.datetime.utcnow(),
+                    event="compose-tagged",
+                    compose_id=self.compose_id,
+                    tag="test",
+                    release_short="Fedora",
+                    release_version="Rawhide",
+                    message="{}",
+                )
+            )
+            db.session.commit()
+            self.assertTrue(next(stream).startswith("id: 4\n"))
+
+    def test_store_messages_rollback(self):
+        compose = self.c.json()
+        with patch.object(notifier, "notify") as notify:
+            store_messages(
+                db.session, [{"event": "compose-changed", "compose": compose}]
+            )
+            db.session.rollback()
+            notify.assert_not_called()
+            self.assertEqual(ComposeEvent.query.count(), 2)
+
+            store_messages(
+                db.session, [{"event": "compose-changed", "compose": compose}]
+            )
+            db.session.commit()
+            notify.assert_called_once_with()
+            self.assertEqual(ComposeEvent.query.count(), 3)
+
+    @patch("cts.event_stream.PRUNE_INTERVAL", new=10)
+    def test_event_stream_listen_prune(self):
+        conn = MagicMock(notifies=["notification"])
+        with patch.object(db.engine, "raw_connection", return_value=conn), patch(
+            "cts.event_stream.select.select", return_value=([conn], [], [])
+        ) as select, patch(
+            "cts.event_stream.time.monotonic", side_effect=[0, 4, 8, 9, 12]
+        ), patch.object(
+            notifier, "_prune", side_effect=RuntimeError
+        ) as prune, patch.object(
+            notifier, "notify"
+        ) as notify:
+            # The events are pruned even when the notifications keep coming.
+            with self.assertRaises(RuntimeError):
+                notifier._listen()
+        self.assertEqual([c[0][3] for c in select.call_args_list], [6, 1])
+        self.assertEqual(notify.call_count, 2)
+        prune.assert_called_once_with()
+        conn.close.assert_called_once_with()
+
+    @patch.object(conf, "event_stream_retention", new=0)
+    def test_event_stream_disabled(self):
+        with self._test_request_context(user="odcs"):
+            rv = self.client.get("/api/1/events/")
+        self.assertEqual(rv.status, "404 NOT FOUND")
@@ -21,13 +21,17 @@
 #
 # Written by Chenxiong Qi <cqi@redhat.com>
 
+import contextlib
 import unittest
 from productmd import ComposeInfo
 
 from cts import db
 from sqlalchemy import event
 from cts.events import cache_composes_if_state_changed
+from cts.events import cache_scheduled_messages
 from cts.events import start_to_publish_messages
+from cts.events import store_compose_event_messages
+from cts.tag_catalogue import tag_catalogue
 
 from flask_sqlalchemy import SignallingSession
 from unittest.mock import patch
@@ -76,6 +80,14 @@ class ModelsBaseTest(unittest.TestCase):
             event.remove(
                 SignallingSession, "after_flush", cache_composes_if_state_changed
             )
+        if event.contains(SignallingSession, "before_commit", cache_scheduled_messages):
+            event.remove(SignallingSession, "before_commit", cache_scheduled_messages)
+        if event.contains(
+            SignallingSession, "before_commit", store_compose_event_messages
+        ):
+            event.remove(
+                SignallingSession, "before_commit", store_compose_event_messages
+            )
         if event.contains(SignallingSession, "after_commit", start_to_publish_messages):
             event.remove(SignallingSession, "after_commit", start_to_publish_messages)
 
@@ -83,6 +95,8 @@ class ModelsBaseTest(unittest.TestCase):
         db.drop_all()
         db.create_all()
         db.session.commit()
+        # The TagChange IDs start from 1 again in the new database.
+        tag_catalogue.invalidate()
 
         # Default ComposeInfo for tests.
         self.ci = ComposeInfo()
@@ -108,6 +122,10 @@ class ModelsBaseTest(unittest.TestCase):
             event.listen(
                 SignallingSession, "after_flush", cache_composes_if_state_changed
             )
+            event.listen(SignallingSession, "before_commit", cache_scheduled_messages)
+            event.listen(
+                SignallingSession, "before_commit", store_compose_event_messages
+            )
             event.listen(SignallingSession, "after_commit", start_to_publish_messages)
 
     def tearDown(self):
@@ -115,6 +133,10 @@ class ModelsBaseTest(unittest.TestCase):
             event.remove(
                 SignallingSession, "after_flush", cache_composes_if_state_changed
             )
+            event.remove(SignallingSession, "before_commit", cache_scheduled_messages)
+            event.remove(
+                SignallingSession, "before_commit", store_compose_event_messages
+            )
             event.remove(SignallingSession, "after_commit", start_to_publish_messages)
 
         db.session.remove()
@@ -124,4 +146,34 @@ class ModelsBaseTest(unittest.TestCase):
         # Nothing special here. Just do what should be done in tearDown to
         # to restore enviornment for each test method.
         event.listen(SignallingSession, "after_flush", cache_composes_if_state_changed)
+        event.listen(SignallingSession, "before_commit", cache_scheduled_messages)
+        event.listen(SignallingSession, "before_commit", store_compose_event_messages)
         event.listen(SignallingSession, "after_commit", start_to_publish_messages)
+
+    @contextlib.contextmanager
+    def assertMaxStatements(self, count):
+        """
+        Fails if more than `count` SQL statements are executed in the block.
+
+        Tests of the API endpoints use it to declare the statement budget of
+        the request. The budget must not depend on the number of returned
+        rows and the test data must contain more rows than the budget, so
+        the N+1 queries always exceed it.
+
+        :param int count: Maximum number of SQL statements.
+        """
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        if len(statements) > count:
+            self.fail(
+                "%d SQL statements executed, expected at most %d:\n%s"
+                % (len(statements), count, "\n".join(statements))
+            )